@@ -0,0 +1,53 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from crawler import BLOCK_DOMAINS, BLOCK_RESOURCE_TYPES, Crawler
+from fixture_site import serve
+
+
+def bench(base_url: str, articles: int, block: bool) -> dict:
+    # loads and parses `articles` image-heavy pages; go_to_page waits for the
+    # load event, so blocked images shorten every load
+    crawler = Crawler(
+        headless=True,
+        page_cache_bytes=0,
+        block_resource_types=BLOCK_RESOURCE_TYPES if block else (),
+        block_domains=BLOCK_DOMAINS if block else (),
+    )
+    load_ms = []
+    try:
+        for i in range(articles):
+            st = time.perf_counter()
+            crawler.go_to_page(f"{base_url}article/{i}")
+            load_ms.append((time.perf_counter() - st) * 1000.0)
+            buffer = crawler.parse()
+            assert any(
+                n.get("inner_text", "").startswith(f"Figure 0 of article {i}")
+                for n in buffer.values()
+            ), "alt text missing from the buffer"
+    finally:
+        crawler.close()
+    return dict(crawler.blocker.summary(), load_ms=sum(load_ms) / len(load_ms))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="page loads with and without blocking heavy resources"
+    )
+    parser.add_argument("--articles", type=int, default=10)
+    parser.add_argument("--delay", type=float, default=0.2, help="server latency")
+    args = parser.parse_args()
+
+    httpd, base_url = serve(delay=args.delay)
+    print(f"{'block':>6} {'load ms':>8} {'requests':>9} {'blocked':>8} {'loaded MB':>10}")
+    for block in (False, True):
+        r = bench(base_url, args.articles, block)
+        print(
+            f"{str(block):>6} {r['load_ms']:>8.0f} {r['requests']:>9} "
+            f"{r['blocked']:>8} {r['loaded_bytes'] / 2**20:>10.2f}"
+        )
+    httpd.shutdown()
@@ -0,0 +1,86 @@
+import argparse
+import os
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from decoding import Decoding
+from dom_parser import parse_snapshot
+from llm import HTTPBackend
+from snapshots import VIEWPORT, generate_snapshot
+from stub_model_server import serve
+from webgpt import (
+    create_completion,
+    get_gpt_instruction,
+    instruction_params,
+    instruction_prompt,
+    set_backend,
+    validate_command,
+)
+
+OBJECTIVE = "Why are certain words considered bad in social settings?"
+
+
+def baseline_instruction(url, history, buffer) -> str:
+    # what every step used to request: best_of=4, n=2, keep the first choice
+    prompt = instruction_prompt(OBJECTIVE, url, history, [], buffer, VIEWPORT)
+    return create_completion(prompt, **instruction_params, best_of=4, n=2)[0]
+
+
+def bench(server, steps: int, buffer, decoding) -> dict:
+    server.reset()
+    history = deque(maxlen=5)
+    valid = 0
+    st = time.perf_counter()
+    for _ in range(steps):
+        if decoding is None:
+            ins = baseline_instruction("https://example.com/", history, buffer)
+        else:
+            ins = get_gpt_instruction(
+                OBJECTIVE, "https://example.com/", history, [], buffer, VIEWPORT,
+                decoding=decoding,
+            )
+        valid += validate_command(ins, buffer)
+    elapsed = time.perf_counter() - st
+    return {
+        "step ms": elapsed / steps * 1000.0,
+        "prompt tok": server.prompt_tokens / steps,
+        "compl tok": server.completion_tokens / steps,
+        "valid": valid / steps,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="per-step latency and token spend of each decoding strategy"
+    )
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--nodes", type=int, default=2000)
+    parser.add_argument("--error-rate", type=float, default=0.3)
+    parser.add_argument("--samples", type=int, default=3)
+    args = parser.parse_args()
+
+    server, api_base = serve(error_rate=args.error_rate)
+    set_backend(HTTPBackend(api_base=api_base))
+    buffer = parse_snapshot(generate_snapshot(args.nodes, seed=0), VIEWPORT)
+
+    strategies = [
+        ("best_of=4,n=2", None),
+        ("sample", Decoding("sample")),
+        ("greedy", Decoding("greedy")),
+        (f"best_of-{args.samples}", Decoding("best_of", args.samples)),
+        (f"vote-{args.samples}", Decoding("vote", args.samples)),
+    ]
+    print(
+        f"{'strategy':>14} {'step ms':>9} {'prompt tok':>11} "
+        f"{'compl tok':>10} {'valid':>6}"
+    )
+    for name, decoding in strategies:
+        r = bench(server, args.steps, buffer, decoding)
+        print(
+            f"{name:>14} {r['step ms']:>9.1f} {r['prompt tok']:>11.0f} "
+            f"{r['compl tok']:>10.1f} {r['valid']:>6.0%}"
+        )
+    server.shutdown()
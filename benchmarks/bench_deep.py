@@ -0,0 +1,61 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from dom_parser import NodeStore, parse_snapshot
+from snapshots import DEEP_FIXTURES, VIEWPORT, generate_deep_snapshot
+
+
+def recursive_walk(store: NodeStore, element_idx: int, enter, leave) -> None:
+    # one python frame per DOM level, as the parser used to traverse the tree
+    if enter(element_idx):
+        for child_idx in store.children(element_idx):
+            recursive_walk(store, child_idx, enter, leave)
+        leave(element_idx)
+
+
+def timed(fn) -> str:
+    st = time.perf_counter()
+    try:
+        fn()
+    except RecursionError:
+        return "RecursionError"
+    return f"{(time.perf_counter() - st) * 1000.0:.2f}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="traversal of very deep documents")
+    parser.add_argument("--depth", type=int, default=10000)
+    args = parser.parse_args()
+
+    print(
+        f"{'fixture':>15} {'nodes':>7} {'recursive ms':>15} "
+        f"{'iterative ms':>13} {'parse ms':>9}"
+    )
+    for kind in DEEP_FIXTURES:
+        tree = generate_deep_snapshot(kind, args.depth)
+        store = NodeStore(tree)
+        order = []
+
+        def enter(element_idx: int) -> bool:
+            order.append(element_idx)
+            return True
+
+        def leave(element_idx: int) -> None:
+            order.append(~element_idx)
+
+        recursive_ms = timed(lambda: recursive_walk(store, 0, enter, leave))
+        recursive_order, order = order, []
+        iterative_ms = timed(lambda: store.walk(0, enter, leave))
+        # the explicit-stack walk has to visit nodes in exactly the recursive order
+        if recursive_ms != "RecursionError":
+            assert recursive_order == order, kind
+
+        parse_ms = timed(lambda: parse_snapshot(tree, VIEWPORT, False))
+        print(
+            f"{kind:>15} {len(store):>7} {recursive_ms:>15} "
+            f"{iterative_ms:>13} {parse_ms:>9}"
+        )
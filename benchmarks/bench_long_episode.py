@@ -0,0 +1,101 @@
+import argparse
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from bench_memory import rss_mb
+from crawler import Crawler
+from fixture_site import serve
+
+
+def find_link(buffer, text: str) -> str:
+    for key, node in buffer.items():
+        if node["node_type"] == "link" and node.get("inner_text") == text:
+            return key
+    raise LookupError(f"no link `{text}` in the buffer")
+
+
+def listener_count(emitter) -> int:
+    # handlers registered on a playwright object, for every event
+    impl = emitter._impl_obj
+    return sum(len(impl.listeners(event)) for event in impl.event_names())
+
+
+def sample(crawler: Crawler, clicks: int) -> dict:
+    gc.collect()
+    return {
+        "clicks": clicks,
+        "context listeners": listener_count(crawler.context),
+        "page listeners": listener_count(crawler.page),
+        "sessions": len(crawler.sessions),
+        "pages": len(crawler.context.pages),
+        "rss MB": rss_mb(),
+    }
+
+
+def run(base_url: str, clicks: int, popup_every: int, sample_every: int) -> list:
+    # follows "Next article" links for `clicks` clicks; every `popup_every`th
+    # click opens the next article in a new tab and closes the old one, the
+    # way a user keeps one tab open
+    crawler = Crawler(viewport_height=2000, page_cache_bytes=0, headless=True)
+    samples = []
+    try:
+        crawler.go_to_page(base_url + "article/0")
+        for i in range(clicks):
+            buffer = crawler.parse()
+            popup = (i + 1) % popup_every == 0
+            previous = crawler.page
+            link = "Open next article" if popup else "Next article"
+            crawler.click(find_link(buffer, link))
+            if popup:
+                deadline = time.monotonic() + 10.0
+                while crawler.page is previous and time.monotonic() < deadline:
+                    previous.wait_for_timeout(50)
+                previous.close()
+            if (i + 1) % sample_every == 0:
+                samples.append(sample(crawler, i + 1))
+    finally:
+        crawler.close()
+    return samples
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="listeners, CDP sessions and memory over a long episode"
+    )
+    parser.add_argument("--clicks", type=int, default=500)
+    parser.add_argument("--popup-every", type=int, default=25)
+    parser.add_argument("--sample-every", type=int, default=50)
+    parser.add_argument(
+        "--max-growth-mb", type=float, default=20.0,
+        help="allowed rss growth after the first sample",
+    )
+    args = parser.parse_args()
+
+    httpd, base_url = serve()
+    samples = run(base_url, args.clicks, args.popup_every, args.sample_every)
+    httpd.shutdown()
+
+    columns = list(samples[0])
+    print(" ".join(f"{c:>17}" for c in columns))
+    for s in samples:
+        print(
+            " ".join(
+                f"{s[c]:>17.1f}" if c == "rss MB" else f"{s[c]:>17}" for c in columns
+            )
+        )
+
+    first, last = samples[0], samples[-1]
+    failures = [
+        f"{c} grew from {first[c]} to {last[c]}"
+        for c in ("context listeners", "page listeners", "sessions", "pages")
+        if last[c] > first[c]
+    ]
+    if last["rss MB"] - first["rss MB"] > args.max_growth_mb:
+        failures.append(f"rss grew by {last['rss MB'] - first['rss MB']:.1f} MB")
+    for failure in failures:
+        print(" > FAIL:", failure)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,88 @@
+import argparse
+import gc
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from snapshots import load_or_generate
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), ".snapshots")
+
+
+def build_dict_tree(tree):
+    # the per-node dict layout the parser used before the columnar store
+    document = tree["documents"][0]
+    strings = tree["strings"]
+    nodes = document["nodes"]
+    is_clickable = {str(i) for i in nodes["isClickable"]["index"]}
+    hash_tree = {}
+    for element_idx, parent_id in enumerate(nodes["parentIndex"]):
+        hash_name = str(element_idx)
+        hash_tree[hash_name] = {
+            "children": [],
+            "name": strings[nodes["nodeName"][element_idx]],
+            "value": strings[nodes["nodeValue"][element_idx]],
+            "is_clickable": hash_name in is_clickable,
+            "attributes": [strings[i] for i in nodes["attributes"][element_idx]],
+            "parent": str(parent_id),
+        }
+        if str(parent_id) in hash_tree:
+            hash_tree[str(parent_id)]["children"].append(hash_name)
+    for layout_idx, element_idx in enumerate(document["layout"]["nodeIndex"]):
+        x, y, width, height = document["layout"]["bounds"][layout_idx]
+        hash_tree[str(element_idx)].update(
+            {"x_mid": int(x + width / 2), "y_mid": int(y + height / 2)}
+        )
+    return hash_tree
+
+
+def rss_mb() -> float:
+    # resident set size of this process, linux only
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def measure(mode: str, n_nodes: int) -> None:
+    tree = load_or_generate(n_nodes, SNAPSHOT_DIR)
+    gc.collect()
+    # ru_maxrss would still hold the peak of json.load, so compare the resident
+    # size right before and after the build instead
+    before = rss_mb()
+    if mode == "dict":
+        built = build_dict_tree(tree)
+    else:
+        from dom_parser import NodeStore
+
+        built = NodeStore(tree)
+    print(f"{rss_mb() - before:.1f}")
+    del built
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="memory held by the parsed node tree")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--measure", choices=["dict", "store"])
+    parser.add_argument("--nodes", type=int)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.nodes)
+        sys.exit(0)
+
+    # every measurement runs in a fresh interpreter so peaks don't carry over
+    print(f"{'nodes':>8} {'dict MB':>9} {'store MB':>9} {'saved':>7}")
+    for n in args.sizes:
+        load_or_generate(n, SNAPSHOT_DIR)
+        rss = {}
+        for mode in ("dict", "store"):
+            out = subprocess.run(
+                [sys.executable, __file__, "--measure", mode, "--nodes", str(n)],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            rss[mode] = float(out.stdout)
+        saved = 1.0 - rss["store"] / rss["dict"] if rss["dict"] > 0 else 0.0
+        print(f"{n:>8} {rss['dict']:>9.1f} {rss['store']:>9.1f} {saved:>7.0%}")
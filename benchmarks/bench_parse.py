@@ -0,0 +1,47 @@
+import argparse
+import os
+import sys
+import time
+from typing import Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from dom_parser import NodeStore, build_buffer, parse_snapshot
+from snapshots import VIEWPORT, load_or_generate
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), ".snapshots")
+
+
+def bench(n_nodes: int, repeat: int) -> Tuple[float, float]:
+    tree = load_or_generate(n_nodes, SNAPSHOT_DIR)
+    best = float("inf")
+    for _ in range(repeat):
+        st = time.perf_counter()
+        parse_snapshot(tree, VIEWPORT, limit_to_viewport=False)
+        best = min(best, time.perf_counter() - st)
+
+    # re-parse of an unchanged page after scrolling: only the viewport culling
+    store = NodeStore(tree)
+    build_buffer(store, VIEWPORT)
+    best_scroll = float("inf")
+    for i in range(repeat):
+        scrolled = dict(VIEWPORT, page_y_offset=(i + 1) * VIEWPORT["height"] / 2)
+        st = time.perf_counter()
+        build_buffer(store, scrolled)
+        best_scroll = min(best_scroll, time.perf_counter() - st)
+    return best, best_scroll
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="parse time vs. DOM size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5000, 50000, 200000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # a linear parser keeps the per-node cost flat as the page grows
+    print(f"{'nodes':>8} {'best ms':>10} {'us/node':>8} {'scroll ms':>10}")
+    for n in args.sizes:
+        t, t_scroll = bench(n, args.repeat)
+        print(
+            f"{n:>8} {t * 1000.0:>10.2f} {t / n * 1e6:>8.2f} {t_scroll * 1000.0:>10.2f}"
+        )
@@ -0,0 +1,86 @@
+import argparse
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from dom_parser import NodeStore, build_buffer
+from search_index import PageIndex
+from snapshots import VIEWPORT, SnapshotBuilder
+
+OBJECTIVE = "Why are certain words considered bad in social settings?"
+ANSWER = (
+    "Words are considered bad when a community agrees they are offensive "
+    "in social settings"
+)
+
+
+def long_article(sections: int, answer_at: float, seed: int = 0) -> dict:
+    # an article of `sections` DIV sections of filler paragraphs; the section at
+    # `answer_at` (0 top, 1 bottom) holds the one paragraph that answers
+    b = SnapshotBuilder(seed)
+    html = b.add(-1, "#document", rendered=False)
+    body = b.add(b.add(html, "HTML"), "BODY")
+    answer_section = int(answer_at * (sections - 1))
+    for k in range(sections):
+        section = b.add(body, "DIV")
+        b.text(b.add(section, "H2"))
+        for _ in range(b.rng.randint(3, 6)):
+            p = b.add(section, "P")
+            b.add(p, "#text", b.words(b.rng.randint(15, 40)))
+            b.y += 20.0
+        if k == answer_section:
+            b.add(b.add(section, "P"), "#text", ANSWER)
+        a = b.add(section, "A", attrs={"href": f"/{k}"}, clickable=True)
+        b.text(a)
+    return b.snapshot()
+
+
+def answer_y(store: NodeStore) -> float:
+    for element_idx in range(len(store)):
+        if store.node_value(element_idx) == ANSWER:
+            return store.y[element_idx]
+    raise ValueError("no answer in the article")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="cost of indexing whole pages and whether the passage that "
+        "answers the objective reaches the prompt without scrolling"
+    )
+    parser.add_argument("--sections", type=int, nargs="+", default=[50, 200, 800])
+    parser.add_argument("--k", type=int, default=3, help="passages per prompt")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'sections':>9} {'nodes':>7} {'passages':>9} {'index ms':>9} "
+        f"{'search ms':>10} {'found':>6} {'scrolls saved':>14}"
+    )
+    for sections in args.sections:
+        for answer_at in (0.5, 0.9):
+            tree = long_article(sections, answer_at)
+            store = NodeStore(tree)
+            buffer = build_buffer(store, VIEWPORT)
+
+            st = time.perf_counter()
+            for _ in range(args.repeat):
+                index = PageIndex(store)
+            index_ms = (time.perf_counter() - st) * 1000.0 / args.repeat
+
+            st = time.perf_counter()
+            for _ in range(args.repeat):
+                passages = index.passage_buffer(OBJECTIVE, args.k, exclude=buffer)
+            search_ms = (time.perf_counter() - st) * 1000.0 / args.repeat
+
+            found = any(e.get("inner_text") == ANSWER for e in passages.values())
+            # SCROLL DOWN moves half a viewport; the answer is read once it is
+            # inside the viewport
+            height = VIEWPORT["height"]
+            scrolls = max(0, math.ceil((answer_y(store) - height) / (height / 2)))
+            print(
+                f"{sections:>9} {len(store):>7} {len(index):>9} {index_ms:>9.2f} "
+                f"{search_ms:>10.3f} {str(found):>6} {scrolls if found else 0:>14}"
+            )
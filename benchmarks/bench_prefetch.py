@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from playwright.async_api import async_playwright
+
+from async_crawler import AsyncCrawler, launch_browser
+from fixture_site import serve
+
+
+def find_link(buffer, text: str) -> str:
+    for key, node in buffer.items():
+        if node["node_type"] == "link" and node.get("inner_text", "").startswith(text):
+            return key
+    raise LookupError(f"no link `{text}` in the buffer")
+
+
+async def bench(base_url: str, prefetch: int, results: int, think: float) -> dict:
+    # visits `results` search results the way the agent does: click a result,
+    # read it, go back, with `think` seconds of model time before each action
+    playwright = await async_playwright().start()
+    browser = await launch_browser(playwright, headless=True)
+    crawler = await AsyncCrawler.create(
+        browser=browser, prefetch=prefetch, viewport_height=2000
+    )
+    click_ms = []
+    st = time.perf_counter()
+    try:
+        await crawler.go_to_page(base_url + "search?q=bad+words")
+        buffer = await crawler.parse()
+        for i in range(results):
+            await asyncio.sleep(think)
+            key = find_link(buffer, f"Result {i} ")
+            click_st = time.perf_counter()
+            await crawler.click(key)
+            article = await crawler.parse()
+            click_ms.append((time.perf_counter() - click_st) * 1000.0)
+            assert any(
+                n.get("inner_text", "").startswith(f"Article {i},")
+                for n in article.values()
+            )
+
+            await asyncio.sleep(think)
+            await crawler.back()
+            buffer = await crawler.parse()
+    finally:
+        await crawler.close()
+        await browser.close()
+        await playwright.stop()
+    return {
+        "total s": time.perf_counter() - st,
+        "click ms": sum(click_ms) / len(click_ms),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="visiting search results with and without prefetching"
+    )
+    parser.add_argument("--results", type=int, default=3)
+    parser.add_argument("--delay", type=float, default=0.5, help="article latency")
+    parser.add_argument("--think", type=float, default=1.0, help="model time per step")
+    args = parser.parse_args()
+
+    httpd, base_url = serve(delay=args.delay)
+    print(f"{'prefetch':>9} {'total s':>8} {'click ms':>9}")
+    for prefetch in (0, args.results):
+        r = asyncio.run(bench(base_url, prefetch, args.results, args.think))
+        print(f"{prefetch:>9} {r['total s']:>8.2f} {r['click ms']:>9.0f}")
+    httpd.shutdown()
@@ -0,0 +1,111 @@
+import argparse
+import os
+import random
+import sys
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from packing import count_tokens
+from quotes import QuoteStore
+from webgpt import (
+    ALREADY_QUOTED,
+    answer_prompt,
+    hist_len,
+    quote_buffer_limit,
+    quote_buffer_to_string,
+)
+
+OBJECTIVE = "Why are certain words considered bad in social settings?"
+
+PASSAGES = [
+    "Words become bad when a community agrees they are offensive in social settings.",
+    "Taboo words often refer to bodily functions, religion or social groups.",
+    "Linguists note that the social meaning of a word changes faster than its form.",
+    "Parents teach children which words are considered rude at a young age.",
+    "Swearing can signal anger, but also closeness among friends.",
+    "The weather in the region is mild in spring and rainy in autumn.",
+    "Euphemisms replace bad words until they in turn become offensive.",
+    "Some words are banned on broadcast television during the day.",
+]
+
+
+def mirror(rng: random.Random, passage: str) -> str:
+    # the same passage as a mirror site shows it: other punctuation and case,
+    # sometimes cut short or with a word of boilerplate around it
+    words = passage.replace(",", "").replace(".", "").split()
+    if rng.random() < 0.5:
+        words = words[: max(len(words) - 2, 3)]
+    text = " ".join(words)
+    return rng.choice(["", "Source: ", "Quote: "]) + (
+        text.upper() if rng.random() < 0.2 else text
+    )
+
+
+def episode(rng: random.Random, store, feedback: bool = False) -> dict:
+    # quotes as the model issues them: new passages, and now and then a
+    # passage it already has, found again on a mirror site, until the quotes
+    # reach quote_buffer_limit. with `feedback` rejected quotes are marked in
+    # the command history as the agent loops do, and the model does not quote
+    # a passage again while its rejection is in the history
+    steps = 0
+    seen = []
+    history = deque(maxlen=hist_len)
+    while len(quote_buffer_to_string(store)) < quote_buffer_limit and steps < 100:
+        steps += 1
+        rejected = {
+            source for command, source in history if command.endswith(ALREADY_QUOTED)
+        }
+        candidates = [s for s in seen if s not in rejected]
+        if candidates and rng.random() < 0.4:
+            source = rng.choice(candidates)
+            extract = mirror(rng, source)
+        else:
+            source = rng.choice([s for s in PASSAGES if s not in rejected])
+            seen.append(source)
+            extract = source
+        quote = (f"Page {steps}", f"https://site{steps}.example/", extract)
+        command = "QUOTE: " + extract
+        if isinstance(store, list):
+            store.append(dict(zip(("page_title", "domain", "extract"), quote)))
+        elif not store.add(*quote) and feedback:
+            command += ALREADY_QUOTED
+        history.append((command, source))
+    extracts = [q["extract"].lower() for q in store]
+    distinct = {p for p in PASSAGES if any(p[:30].lower() in e for e in extracts)}
+    return {
+        "steps": steps,
+        "quotes": len(store),
+        "distinct": len(distinct),
+        "answer tok": count_tokens(answer_prompt(OBJECTIVE, store)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="quote buffer as a plain list and as a deduplicating store, "
+        "with and without telling the model about rejected quotes"
+    )
+    parser.add_argument("--episodes", type=int, default=200)
+    args = parser.parse_args()
+
+    print(
+        f"{'buffer':>9} {'steps':>6} {'quotes':>7} {'distinct':>9} "
+        f"{'steps/distinct':>15} {'answer tok':>11}"
+    )
+    for name in ("list", "store", "feedback"):
+        rng = random.Random(0)
+        runs = [
+            episode(
+                rng,
+                [] if name == "list" else QuoteStore(OBJECTIVE),
+                feedback=name == "feedback",
+            )
+            for _ in range(args.episodes)
+        ]
+        mean = {k: sum(r[k] for r in runs) / len(runs) for k in runs[0]}
+        print(
+            f"{name:>9} {mean['steps']:>6.1f} {mean['quotes']:>7.1f} "
+            f"{mean['distinct']:>9.1f} {mean['steps'] / mean['distinct']:>15.2f} "
+            f"{mean['answer tok']:>11.0f}"
+        )
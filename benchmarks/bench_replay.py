@@ -0,0 +1,132 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from dom_parser import NodeStore
+from episodes import EpisodeRecorder
+from replay import replay_episode
+from snapshots import VIEWPORT, generate_snapshot
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+SYNTHETIC_DIR = os.path.join(ROOT, ".cache", "episodes-synthetic")
+
+
+def synthetic_episode(path: str, pages: int, nodes: int, seed: int) -> None:
+    # an episode without a browser: every page is read top to bottom with one
+    # SCROLL DOWN, so every other step reuses the page's snapshot, then ANSWER
+    recorder = EpisodeRecorder(path, "Why are certain words considered bad?")
+    crawler = SimpleNamespace(page=SimpleNamespace(title=lambda: "Synthetic page"))
+    for k in range(pages):
+        tree = generate_snapshot(nodes, seed=seed * 1000 + k)
+        url = f"https://example.com/{seed}/{k}"
+        crawler.page.url = url
+        crawler.store = NodeStore(tree)
+        for offset in (0, VIEWPORT["height"] // 2):
+            crawler.viewport = dict(
+                VIEWPORT,
+                page_y_offset=offset,
+                dom_version=f"{seed}-{k}:0:{nodes * 7}",
+                dom_fingerprint=f"{nodes}:0:{nodes * 7}",
+            )
+            if offset == 0:
+                recorder.add_snapshot(crawler.store, tree, crawler.viewport, url)
+            recorder.step(crawler)
+            last = k == pages - 1 and offset > 0
+            recorder.completion("ANSWER" if last else "SCROLL DOWN")
+    recorder.completion("Because communities agree they are offensive.", "answer")
+    recorder.close()
+
+
+def corpus(directory: str) -> list:
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith(".jsonl.xz")
+    )
+
+
+def revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="replay a corpus of recorded episodes and report wall time "
+        "and tokens of this revision"
+    )
+    parser.add_argument(
+        "corpus", nargs="?", help="directory of episode archives (default: synthetic)"
+    )
+    parser.add_argument("--episodes", type=int, default=5, help="synthetic episodes")
+    parser.add_argument("--pages", type=int, default=5, help="pages per episode")
+    parser.add_argument("--nodes", type=int, default=5000, help="nodes per page")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--results",
+        default=os.path.join(ROOT, ".cache", "replay_results.jsonl"),
+        help="file that collects the totals of every revision",
+    )
+    args = parser.parse_args()
+
+    directory = args.corpus
+    if directory is None:
+        directory = SYNTHETIC_DIR
+        os.makedirs(directory, exist_ok=True)
+        for seed in range(args.episodes):
+            path = os.path.join(directory, f"episode_{seed:03d}.jsonl.xz")
+            if not os.path.exists(path):
+                synthetic_episode(path, args.pages, args.nodes, seed)
+    paths = corpus(directory)
+    if not paths:
+        raise SystemExit(f"no episodes found in {directory}")
+
+    totals = {}
+    for _ in range(args.repeat):
+        for path in paths:
+            # the agent loop prints every step; keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = replay_episode(path)
+            for key, value in result.items():
+                totals[key] = totals.get(key, 0) + value / args.repeat
+
+    if totals.get("truncated"):
+        print(f" > {totals['truncated']:.0f} episodes end before the answer")
+
+    row = {"revision": revision(), "time": time.time(), "episodes": len(paths)}
+    row.update(totals)
+    os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+    with open(args.results, "a") as f:
+        f.write(json.dumps(row) + "\n")
+
+    with open(args.results) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    print(
+        f"{'revision':>16} {'episodes':>9} {'steps':>6} {'wall s':>8} "
+        f"{'parse ms':>9} {'prompt ms':>10} {'prompt tok':>11} {'compl tok':>10}"
+    )
+    for r in rows[-10:]:
+        parse_ms = sum(
+            r.get(f"{k}_ms", 0) for k in ("metrics", "snapshot", "tree", "collapse")
+        )
+        print(
+            f"{r['revision']:>16} {r['episodes']:>9} {r['steps']:>6.0f} "
+            f"{r['wall_s']:>8.2f} {parse_ms:>9.0f} {r.get('serialize_ms', 0):>10.0f} "
+            f"{r['prompt_tokens']:>11.0f} {r['completion_tokens']:>10.0f}"
+        )
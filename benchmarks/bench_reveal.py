@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from playwright.async_api import async_playwright
+
+from async_crawler import AsyncCrawler, launch_browser
+from fixture_site import serve
+
+QUERY = "further reading"
+
+
+def find_link(buffer, text: str) -> str:
+    for key, node in buffer.items():
+        if node["node_type"] == "link" and node.get("inner_text", "").startswith(text):
+            return key
+    raise LookupError(f"no link `{text}` in the buffer")
+
+
+async def bench(base_url: str, articles: int, warm: bool, think: float) -> dict:
+    # clicks a link that is only in the prompt as a relevant passage, below the
+    # viewport, on pages that change while the model generates. with `warm` the
+    # page is snapshotted in between, as async_webgpt.warm_while does
+    playwright = await async_playwright().start()
+    browser = await launch_browser(playwright, headless=True)
+    crawler = await AsyncCrawler.create(browser=browser, prefetch=0)
+    click_ms = []
+    try:
+        for i in range(articles):
+            await crawler.go_to_page(base_url + f"article/{i}")
+            await crawler.parse()
+            key = find_link(crawler.relevant_passages(QUERY), "Further reading")
+            await asyncio.sleep(think)
+            if warm:
+                await crawler.warm()
+            st = time.perf_counter()
+            await crawler.click(key)
+            await crawler.parse()
+            click_ms.append((time.perf_counter() - st) * 1000.0)
+            # the passage's ids are those of the prompt's store, not the warmed one
+            assert crawler.page.url.endswith(f"/article/{i + 1}"), crawler.page.url
+    finally:
+        await crawler.close()
+        await browser.close()
+        await playwright.stop()
+    return {"click ms": sum(click_ms) / len(click_ms)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="clicking relevant passages of changing pages, with and "
+        "without warming the snapshot in between"
+    )
+    parser.add_argument("--articles", type=int, default=3)
+    parser.add_argument("--think", type=float, default=0.5, help="model time per step")
+    args = parser.parse_args()
+
+    httpd, base_url = serve(late_content=True)
+    print(f"{'warm':>5} {'click ms':>9}")
+    for warm in (False, True):
+        r = asyncio.run(bench(base_url, args.articles, warm, args.think))
+        print(f"{str(warm):>5} {r['click ms']:>9.0f}")
+    httpd.shutdown()
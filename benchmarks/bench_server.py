@@ -0,0 +1,47 @@
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from fixture_site import serve
+from llm import StubBackend
+from server import AgentServer
+from stub_llm import scripted_completion
+from webgpt import get_backend, set_backend
+
+
+async def bench(
+    concurrency: int, n_questions: int, latency: float, base_url: str, settle: str
+):
+    # the agents call the model through the backend, as they do in production
+    respond = lambda prompt, params: scripted_completion(prompt)
+    set_backend(StubBackend(respond, latency))
+    server = AgentServer(
+        concurrency=concurrency, start_url=base_url, settle_condition=settle
+    )
+    await server.start()
+    try:
+        await server.run([f"question {i}" for i in range(n_questions)])
+    finally:
+        await server.stop()
+    return server.questions_per_minute(), server.failed, get_backend().metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="agent server throughput")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--questions", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.5, help="stub LLM delay")
+    parser.add_argument("--settle", default="dom-quiet")
+    args = parser.parse_args()
+
+    httpd, base_url = serve()
+    print(f"{'agents':>7} {'questions/min':>14} {'failed':>7} {'llm calls':>10}")
+    for concurrency in args.concurrency:
+        qpm, failed, metrics = asyncio.run(
+            bench(concurrency, args.questions, args.latency, base_url, args.settle)
+        )
+        print(f"{concurrency:>7} {qpm:>14.2f} {failed:>7} {len(metrics.latencies):>10}")
+    httpd.shutdown()
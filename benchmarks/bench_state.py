@@ -0,0 +1,81 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from crawler import Crawler
+from fixture_site import serve
+from packing import CONSENT, element_priority
+from state_store import StateStore
+
+
+def consent_button(buffer):
+    for key, node in buffer.items():
+        if node["node_type"] == "button" and element_priority(node) == CONSENT:
+            return key
+    return None
+
+
+def find_link(buffer, text: str) -> str:
+    for key, node in buffer.items():
+        if node["node_type"] == "link" and node.get("inner_text", "").startswith(text):
+            return key
+    raise LookupError(f"no link `{text}` in the buffer")
+
+
+def episode(base_url: str, state_store, think: float) -> dict:
+    # search, open a result and read it, the way the agent does: every step
+    # is a parse, `think` seconds of model time and an action. a cookie banner
+    # in the way costs a step of its own
+    crawler = Crawler(headless=True, state_store=state_store)
+    steps = consent_steps = 0
+
+    def step():
+        nonlocal steps, consent_steps
+        while True:
+            buffer = crawler.parse()
+            time.sleep(think)
+            steps += 1
+            if (key := consent_button(buffer)) is None:
+                return buffer
+            crawler.click(key)
+            consent_steps += 1
+
+    st = time.perf_counter()
+    try:
+        crawler.go_to_page(base_url)
+        step()
+        crawler.go_to_page(base_url + "search?q=bad+words")
+        crawler.click(find_link(step(), "Result 0 "))
+        step()
+    finally:
+        crawler.close()
+    return {
+        "steps": steps,
+        "consent steps": consent_steps,
+        "s": time.perf_counter() - st,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="episodes on a site with a cookie banner, with and without "
+        "keeping the browser state across episodes"
+    )
+    parser.add_argument("--episodes", type=int, default=5)
+    parser.add_argument("--think", type=float, default=1.0, help="model time per step")
+    args = parser.parse_args()
+
+    httpd, base_url = serve(consent=True)
+    print(f"{'state':>6} {'steps':>6} {'consent steps':>14} {'s / episode':>12}")
+    for store in (None, StateStore()):
+        runs = [episode(base_url, store, args.think) for _ in range(args.episodes)]
+        print(
+            f"{str(store is not None):>6} "
+            f"{sum(r['steps'] for r in runs) / len(runs):>6.1f} "
+            f"{sum(r['consent steps'] for r in runs) / len(runs):>14.1f} "
+            f"{sum(r['s'] for r in runs) / len(runs):>12.2f}"
+        )
+    httpd.shutdown()
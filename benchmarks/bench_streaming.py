@@ -0,0 +1,70 @@
+import argparse
+import os
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from decoding import Decoding
+from dom_parser import parse_snapshot
+from llm import HTTPBackend
+from snapshots import VIEWPORT, generate_snapshot
+from stub_model_server import serve
+from webgpt import get_gpt_instruction, set_backend, stream_completion
+
+OBJECTIVE = "Why are certain words considered bad in social settings?"
+
+
+def bench(server, steps: int, buffer, stream) -> dict:
+    server.reset()
+    commands = []
+    st = time.perf_counter()
+    for _ in range(steps):
+        ins = get_gpt_instruction(
+            OBJECTIVE,
+            "https://example.com/",
+            deque(),
+            [],
+            buffer,
+            VIEWPORT,
+            decoding=Decoding("greedy"),
+            stream=stream,
+        )
+        commands.append(ins.strip().split("\n")[0])
+    elapsed = time.perf_counter() - st
+    return {
+        "step ms": elapsed / steps * 1000.0,
+        "compl tok": server.completion_tokens / steps,
+        "commands": commands,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="whole vs streamed instructions cut off after the command"
+    )
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--nodes", type=int, default=2000)
+    parser.add_argument(
+        "--trailing-tokens", type=int, default=200,
+        help="tokens the stub model generates after the command",
+    )
+    args = parser.parse_args()
+
+    buffer = parse_snapshot(generate_snapshot(args.nodes, seed=0), VIEWPORT)
+    print(f"{'mode':>8} {'step ms':>9} {'compl tok':>10}")
+    results = {}
+    for name, stream in (("whole", None), ("stream", stream_completion)):
+        # same seed for both runs, so they see the same commands
+        server, api_base = serve(
+            error_rate=0.0, trailing_tokens=args.trailing_tokens, seed=0
+        )
+        set_backend(HTTPBackend(api_base=api_base))
+        results[name] = r = bench(server, args.steps, buffer, stream)
+        server.shutdown()
+        print(f"{name:>8} {r['step ms']:>9.1f} {r['compl tok']:>10.1f}")
+
+    if results["whole"]["commands"] != results["stream"]["commands"]:
+        print(" > streamed commands differ from the whole completions")
+        sys.exit(1)
@@ -0,0 +1,78 @@
+import argparse
+import os
+import sys
+import time
+from queue import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from dom_parser import IGNORED_ELEMENTS, NodeStore
+from snapshots import generate_nested_snapshot
+
+QUERIED = ("BUTTON", "A", "DIV", "TD", "TH")
+KINDS = ["BUTTON", "A", "INPUT", "IMG", "TABLE", "SELECT"]
+
+
+def bfs_text(store: NodeStore, element_idx: int) -> str:
+    # per-node breadth-first walk the parser used before the subtree index
+    text_values = []
+    q = Queue()
+    q.put(element_idx)
+    while not q.empty():
+        p = q.get()
+        name = store.node_name(p)
+        if name not in IGNORED_ELEMENTS:
+            if name == "#text":
+                text_values.append(store.node_value(p))
+            for child in store.children(p):
+                q.put(child)
+    return " ".join(v.strip() for v in text_values if v.strip())
+
+
+def bfs_is_ancestor_of(store: NodeStore, element_idx: int) -> bool:
+    q = Queue()
+    for child in store.children(element_idx):
+        q.put(child)
+    while not q.empty():
+        p = q.get()
+        if store.node_name(p) in KINDS:
+            return True
+        for child in store.children(p):
+            q.put(child)
+    return False
+
+
+def timed(fn) -> float:
+    st = time.perf_counter()
+    fn()
+    return (time.perf_counter() - st) * 1000.0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="subtree text/ancestor lookups")
+    parser.add_argument("--depths", type=int, nargs="+", default=[25, 50, 100])
+    parser.add_argument("--width", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'depth':>6} {'nodes':>7} {'index ms':>9} {'bfs ms':>9} {'cached ms':>9}")
+    for depth in args.depths:
+        tree = generate_nested_snapshot(depth, args.width)
+        st = time.perf_counter()
+        store = NodeStore(tree)
+        index_ms = (time.perf_counter() - st) * 1000.0
+        queried = [i for i in range(len(store)) if store.node_name(i) in QUERIED]
+
+        def walk():
+            for i in queried:
+                bfs_text(store, i)
+                bfs_is_ancestor_of(store, i)
+
+        def lookup():
+            for i in queried:
+                store.subtree_text(i)
+                store.is_ancestor_of(i, KINDS)
+
+        print(
+            f"{depth:>6} {len(store):>7} {index_ms:>9.2f} "
+            f"{timed(walk):>9.2f} {timed(lookup):>9.2f}"
+        )
@@ -0,0 +1,119 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+from urllib.parse import parse_qs, urlparse
+
+# a tiny static "search engine" and a handful of articles, enough for an agent
+# to search, open a result, quote it and answer without touching the internet
+
+N_ARTICLES = 10
+# images per article and their size; the parser only reads their alt text
+N_IMAGES = 5
+IMAGE_BYTES = 200_000
+
+# a cookie banner in front of every page until its button is clicked, which
+# sets a consent cookie for the whole site
+CONSENT_BANNER = """<div id="consent"><button onclick="document.cookie = \
+'consent=yes; max-age=31536000; path=/'; this.parentNode.remove()">\
+Accept all cookies</button></div>"""
+
+# a paragraph added to every page a moment after it loaded, like content that
+# arrives late while the agent waits for the model
+LATE_CONTENT = """<script>setTimeout(() => {
+const p = document.createElement("p");
+p.textContent = "Breaking: this article was updated.";
+document.body.insertBefore(p, document.body.firstChild);
+}, 200);</script>"""
+
+HOME = """<html><head><title>Fixture Search</title></head><body>
+<div><form action="/search"><input type="text" name="q" aria-label="Search">
+<input type="submit" aria-label="Search"></form></div>
+</body></html>"""
+
+
+def results_page(query: str) -> str:
+    items = "".join(
+        f'<div><a href="/article/{i}">Result {i} about {query}</a>'
+        f"<div>Snippet {i}: a short summary of article {i}.</div></div>"
+        for i in range(N_ARTICLES)
+    )
+    return (
+        f"<html><head><title>{query} - Fixture Search</title></head>"
+        f"<body>{items}</body></html>"
+    )
+
+
+def article_page(i: int) -> str:
+    paragraphs = "".join(
+        f"<div><p>Article {i}, paragraph {j}: words are considered bad when a "
+        f"community agrees they are offensive in social settings.</p></div>"
+        for j in range(30)
+    )
+    images = "".join(
+        f'<div><img src="/image/{i}-{j}.png" alt="Figure {j} of article {i}" '
+        f'width="400" height="300"></div>'
+        for j in range(N_IMAGES)
+    )
+    following = f"/article/{(i + 1) % N_ARTICLES}"
+    return (
+        f"<html><head><title>Article {i}</title></head><body>"
+        f'<div><a href="/">Home</a> <a href="{following}">Next article</a> '
+        f'<a href="{following}" target="_blank">Open next article</a></div>'
+        f"{images}{paragraphs}"
+        f'<div><a href="{following}">Further reading on offensive words</a></div>'
+        "</body></html>"
+    )
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == "/":
+            body = HOME
+        elif url.path == "/search":
+            body = results_page(parse_qs(url.query).get("q", [""])[0])
+        elif url.path.startswith("/article/"):
+            time.sleep(self.server.delay)
+            body = article_page(int(url.path.rsplit("/", 1)[1]))
+        elif url.path.startswith("/image/"):
+            time.sleep(self.server.delay)
+            self.respond(b"\0" * IMAGE_BYTES, "image/png")
+            return
+        else:
+            self.send_error(404)
+            return
+        cookies = self.headers.get("Cookie", "")
+        if self.server.consent and "consent=yes" not in cookies:
+            body = body.replace("<body>", "<body>" + CONSENT_BANNER, 1)
+        if self.server.late_content:
+            body = body.replace("</body>", LATE_CONTENT + "</body>", 1)
+        self.respond(body.encode(), "text/html; charset=utf-8")
+
+    def respond(self, data: bytes, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def serve(
+    port: int = 0,
+    delay: float = 0.0,
+    consent: bool = False,
+    late_content: bool = False,
+) -> Tuple[ThreadingHTTPServer, str]:
+    # starts the site on a background thread; returns the server and its base url.
+    # articles and images take `delay` seconds to respond, like a real site.
+    # with `consent` every page shows a cookie banner until it is accepted, with
+    # `late_content` every page changes shortly after loading
+    server = ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler)
+    server.delay = delay
+    server.consent = consent
+    server.late_content = late_content
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
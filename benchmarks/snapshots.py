@@ -0,0 +1,228 @@
+import os
+import random
+from typing import Dict, List, Optional
+
+from dom_parser import load_recording, save_recording
+
+# synthetic `DOMSnapshot.captureSnapshot` payloads that mimic the shape chromium
+# returns: nodes in document order, a shared `strings` table and layout entries
+# for rendered nodes only
+
+VIEWPORT = {
+    "device_pixel_ratio": 1.0,
+    "width": 1800,
+    "height": 1000,
+    "page_x_offset": 0,
+    "page_y_offset": 0,
+}
+
+_WORDS = (
+    "the quick brown fox jumps over lazy dog search result news page article "
+    "cookie accept privacy policy weather today price table option menu"
+).split()
+
+
+class SnapshotBuilder:
+    def __init__(self, seed: int = 0) -> None:
+        self.rng = random.Random(seed)
+        self.strings: List[str] = []
+        self.string_idx: Dict[str, int] = {}
+        self.parents: List[int] = []
+        self.names: List[int] = []
+        self.values: List[int] = []
+        self.attributes: List[List[int]] = []
+        self.clickable: List[int] = []
+        self.layout_nodes: List[int] = []
+        self.bounds: List[List[float]] = []
+        self.y = 0.0
+
+    def intern(self, s: str) -> int:
+        if s not in self.string_idx:
+            self.string_idx[s] = len(self.strings)
+            self.strings.append(s)
+        return self.string_idx[s]
+
+    def add(
+        self,
+        parent: int,
+        name: str,
+        value: Optional[str] = None,
+        attrs: Optional[Dict[str, str]] = None,
+        clickable: bool = False,
+        rendered: bool = True,
+    ) -> int:
+        idx = len(self.parents)
+        self.parents.append(parent)
+        self.names.append(self.intern(name))
+        self.values.append(self.intern(value) if value is not None else -1)
+        flat = []
+        for k, v in (attrs or {}).items():
+            flat += [self.intern(k), self.intern(v)]
+        self.attributes.append(flat)
+        if clickable:
+            self.clickable.append(idx)
+        if rendered:
+            self.layout_nodes.append(idx)
+            self.bounds.append([self.rng.uniform(0, 1500), self.y, 200.0, 20.0])
+            self.y += 7.0
+        return idx
+
+    def words(self, n: int) -> str:
+        return " ".join(self.rng.choice(_WORDS) for _ in range(n))
+
+    def text(self, parent: int) -> int:
+        return self.add(parent, "#text", self.words(self.rng.randint(1, 8)))
+
+    def snapshot(self) -> Dict:
+        return {
+            "documents": [
+                {
+                    "nodes": {
+                        "parentIndex": self.parents,
+                        "nodeName": self.names,
+                        "nodeValue": self.values,
+                        "attributes": self.attributes,
+                        "isClickable": {"index": self.clickable},
+                    },
+                    "layout": {
+                        "nodeIndex": self.layout_nodes,
+                        "bounds": self.bounds,
+                    },
+                }
+            ],
+            "strings": self.strings,
+        }
+
+
+def _block(b: SnapshotBuilder, parent: int) -> None:
+    kind = b.rng.random()
+    if kind < 0.35:
+        p = b.add(parent, "P")
+        b.text(p)
+        span = b.add(p, "SPAN")
+        b.text(span)
+        b.add(b.add(p, "I"), "#text", b.words(2))
+    elif kind < 0.55:
+        a = b.add(parent, "A", attrs={"href": "https://example.com/"}, clickable=True)
+        b.text(b.add(a, "SPAN"))
+        b.text(a)
+    elif kind < 0.65:
+        btn = b.add(parent, "BUTTON", clickable=True)
+        b.text(btn)
+    elif kind < 0.72:
+        b.add(parent, "INPUT", attrs={"type": "text", "aria-label": b.words(2)})
+    elif kind < 0.78:
+        b.add(parent, "IMG", attrs={"alt": b.words(3)})
+    elif kind < 0.85:
+        div = b.add(parent, "DIV", clickable=True)
+        b.text(b.add(div, "SPAN"))
+    elif kind < 0.90:
+        table = b.add(parent, "TABLE")
+        tbody = b.add(table, "TBODY")
+        for _ in range(b.rng.randint(1, 3)):
+            tr = b.add(tbody, "TR")
+            for _ in range(b.rng.randint(1, 3)):
+                td = b.add(tr, "TD", clickable=b.rng.random() < 0.2)
+                b.text(td)
+    elif kind < 0.93:
+        select = b.add(parent, "SELECT", attrs={"name": "adults"})
+        for i in range(b.rng.randint(2, 4)):
+            option = b.add(select, "OPTION", attrs={"value": str(i)})
+            b.add(option, "#text", str(i), rendered=False)
+    elif kind < 0.96:
+        script = b.add(parent, "SCRIPT", rendered=False)
+        b.add(script, "#text", "var x = 1;", rendered=False)
+    else:
+        svg = b.add(parent, "svg")
+        b.add(svg, "path")
+
+
+def generate_snapshot(n_nodes: int, seed: int = 0) -> Dict:
+    # a page of nested DIV sections filled with mixed content blocks
+    b = SnapshotBuilder(seed)
+    html = b.add(-1, "#document", rendered=False)
+    body = b.add(b.add(html, "HTML"), "BODY")
+    containers = [body]
+    while len(b.parents) < n_nodes:
+        parent = b.rng.choice(containers[-50:])
+        if b.rng.random() < 0.15:
+            containers.append(b.add(parent, "DIV"))
+        else:
+            _block(b, parent)
+    return b.snapshot()
+
+
+def load_or_generate(n_nodes: int, directory: str, seed: int = 0) -> Dict:
+    # snapshots are recorded to disk once so repeated runs parse identical input;
+    # the files can also be replayed with `python src/dom_parser.py <directory>`
+    path = os.path.join(directory, f"snapshot_{n_nodes}.json")
+    if os.path.exists(path):
+        return load_recording(path)["snapshot"]
+    tree = generate_snapshot(n_nodes, seed)
+    save_recording(path, tree, VIEWPORT)
+    return tree
+
+
+def generate_nested_snapshot(depth: int, width: int = 1, seed: int = 0) -> Dict:
+    # `width` towers of clickable DIVs nested `depth` levels deep with a bit of
+    # text on every level; each tower ends in a link, so no DIV collapses and
+    # every level asks questions about its whole subtree
+    b = SnapshotBuilder(seed)
+    html = b.add(-1, "#document", rendered=False)
+    body = b.add(b.add(html, "HTML"), "BODY")
+    for _ in range(width):
+        parent = body
+        for _ in range(depth):
+            parent = b.add(parent, "DIV", clickable=True)
+            b.text(b.add(parent, "SPAN"))
+        a = b.add(parent, "A", attrs={"href": "https://example.com/"}, clickable=True)
+        b.text(a)
+    return b.snapshot()
+
+
+def _deep_div_chain(b: SnapshotBuilder, parent: int, depth: int) -> None:
+    for _ in range(depth):
+        parent = b.add(parent, "DIV")
+        b.text(parent)
+
+
+def _deep_link(b: SnapshotBuilder, parent: int, depth: int) -> None:
+    # a single link whose label sits at the bottom of a long SPAN chain
+    parent = b.add(parent, "A", attrs={"href": "https://example.com/"}, clickable=True)
+    for _ in range(depth):
+        parent = b.add(parent, "SPAN")
+    b.text(parent)
+
+
+def _deep_tables(b: SnapshotBuilder, parent: int, depth: int) -> None:
+    # tables nested through their cells' wrappers: TABLE > TR > DIV > TABLE ...
+    for _ in range(depth // 3):
+        tr = b.add(b.add(parent, "TABLE"), "TR")
+        b.text(b.add(tr, "TD"))
+        parent = b.add(tr, "DIV")
+
+
+def _deep_clickable_divs(b: SnapshotBuilder, parent: int, depth: int) -> None:
+    for _ in range(depth):
+        parent = b.add(parent, "DIV", clickable=True)
+        b.text(b.add(parent, "SPAN"))
+    b.add(parent, "BUTTON", clickable=True)
+
+
+DEEP_FIXTURES = {
+    "div-chain": _deep_div_chain,
+    "deep-link": _deep_link,
+    "nested-tables": _deep_tables,
+    "clickable-divs": _deep_clickable_divs,
+}
+
+
+def generate_deep_snapshot(kind: str, depth: int = 10000, seed: int = 0) -> Dict:
+    b = SnapshotBuilder(seed)
+    html = b.add(-1, "#document", rendered=False)
+    body = b.add(b.add(html, "HTML"), "BODY")
+    DEEP_FIXTURES[kind](b, body, depth)
+    # some regular content after the deep part, so traversal has to climb back out
+    _block(b, body)
+    b.text(body)
+    return b.snapshot()
@@ -0,0 +1,41 @@
+import re
+
+# a scripted stand-in for the completion API that walks the fixture site:
+# search, open a result, quote the first passage, answer
+
+CONTENT_START = "CURRENT BROWSER CONTENT:\n------------------"
+
+
+def section(prompt: str, name: str, end: str) -> str:
+    # the last occurrence belongs to the current step, the earlier ones to the
+    # few-shot examples in the prompt
+    start = prompt.rfind(name)
+    if start < 0:
+        return ""
+    start += len(name)
+    stop = prompt.find(end, start)
+    return prompt[start : stop if stop >= 0 else len(prompt)].strip()
+
+
+def scripted_completion(prompt: str) -> str:
+    if "CURRENT BROWSER CONTENT:" not in prompt:
+        # answering or welcome prompt
+        return "This is a stub answer."
+
+    quotes = section(prompt, "\nQUOTES:", "PREVIOUS COMMANDS:")
+    url = section(prompt, "CURRENT URL:", "\n")
+    content = section(prompt, CONTENT_START, "------------------")
+
+    if quotes:
+        return "ANSWER"
+    if "/search" in url:
+        if link := re.search(r"<link id=(\d+)>Result", content):
+            return f"CLICK: {link.group(1)}"
+    if "/article/" in url:
+        if text := re.search(r"<text>([^<]+)</text>", content):
+            return f"QUOTE: {text.group(1)[:200]}"
+        return "SCROLL DOWN"
+    if field := re.search(r"<input id=(\d+)", content):
+        question = section(prompt, "\nQUESTION:", "\n")
+        return f"SUBMIT {field.group(1)}: {question}"
+    return "BACK"
@@ -0,0 +1,168 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+
+from packing import count_tokens
+from stub_llm import scripted_completion
+
+# a local stand-in for the completions endpoint (use its url as api_base).
+# every request generates max(best_of, n) samples of the scripted command,
+# `error_rate` of which are commands the page cannot carry out. best_of ranks
+# the valid samples first, like a model that is more confident when right.
+# latency grows with the prompt length and with every generated token, and
+# usage counts all generated samples as the real API bills them.
+# `trailing_tokens` makes the model ramble on after the command like a real
+# completion that is not stopped; with "stream": true the tokens are sent as
+# server-sent events and generation stops when the client hangs up
+
+INVALID_COMMANDS = ("CLICK: 999999", "TYPE 999999: hello", "OPEN THE PAGE")
+RAMBLE = "the page shows what the question asks about so this is the next step"
+TOKEN = re.compile(r"\s*\S+|\s+")
+
+
+def tokenize(text: str) -> List[str]:
+    # one "token" per word, good enough to pace and bill the stub
+    return TOKEN.findall(text)
+
+
+class StubModelServer(ThreadingHTTPServer):
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        error_rate: float = 0.3,
+        prefill_ms: float = 0.05,
+        decode_ms: float = 2.0,
+        trailing_tokens: int = 0,
+        seed: int = 0,
+    ) -> None:
+        super().__init__(address, StubModelHandler)
+        self.error_rate = error_rate
+        self.prefill_ms = prefill_ms
+        self.decode_ms = decode_ms
+        self.trailing_tokens = trailing_tokens
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def sample(self, prompt: str) -> Tuple[str, bool]:
+        with self.lock:
+            if self.random.random() < self.error_rate:
+                command, valid = self.random.choice(INVALID_COMMANDS), False
+            else:
+                command, valid = scripted_completion(prompt), True
+        if self.trailing_tokens:
+            words = RAMBLE.split()
+            ramble = (words[i % len(words)] for i in range(self.trailing_tokens))
+            command += "\n\n" + " ".join(ramble)
+        return command, valid
+
+    def record(self, prompt_tokens: int, completion_tokens: int) -> None:
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def complete(self, request: dict) -> dict:
+        prompt = request["prompt"]
+        n = request.get("n", 1)
+        best_of = max(request.get("best_of", 1), n)
+
+        samples = [self.sample(prompt) for _ in range(best_of)]
+        if request.get("best_of", 1) > 1:
+            samples.sort(key=lambda s: not s[1])
+        choices = [text for text, _ in samples[:n]]
+
+        prompt_tokens = count_tokens(prompt)
+        completion_tokens = sum(len(tokenize(text)) for text, _ in samples)
+        time.sleep(
+            (prompt_tokens * self.prefill_ms + completion_tokens * self.decode_ms)
+            / 1000.0
+        )
+        self.record(prompt_tokens, completion_tokens)
+
+        return {
+            "id": f"cmpl-stub-{self.requests}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [
+                {"text": text, "index": i, "logprobs": None, "finish_reason": "stop"}
+                for i, text in enumerate(choices)
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+
+    def stream(self, request: dict, write) -> None:
+        # writes the completion token by token with `write(chunk dict)` until it
+        # is done or the client is gone
+        prompt = request["prompt"]
+        text, _ = self.sample(prompt)
+        prompt_tokens = count_tokens(prompt)
+        time.sleep(prompt_tokens * self.prefill_ms / 1000.0)
+
+        generated = 0
+        try:
+            for token in tokenize(text):
+                time.sleep(self.decode_ms / 1000.0)
+                generated += 1
+                choice = {"text": token, "index": 0, "finish_reason": None}
+                write({"object": "text_completion", "choices": [choice]})
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.record(prompt_tokens, generated)
+
+
+class StubModelHandler(BaseHTTPRequestHandler):
+    def do_POST(self) -> None:
+        if not re.search(r"/completions$", self.path):
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length))
+        if request.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+
+            def write(chunk: dict) -> None:
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+
+            self.server.stream(request, write)
+            try:
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            return
+
+        data = json.dumps(self.server.complete(request)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def serve(port: int = 0, **kwargs) -> Tuple[StubModelServer, str]:
+    # starts the model on a background thread; returns the server and the
+    # api base to configure an HTTPBackend with
+    server = StubModelServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
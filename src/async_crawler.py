@@ -0,0 +1,597 @@
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urldefrag, urljoin
+import asyncio
+import re
+import time
+import weakref
+from playwright.async_api import async_playwright
+from playwright.async_api import Error as PlaywrightError
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from crawler import (
+    BLOCK_DOMAINS,
+    BLOCK_RESOURCE_TYPES,
+    CLEAR_INPUTS_JS,
+    DOCUMENT_ID_JS,
+    DOM_QUIET_JS,
+    DOM_VERSION_JS,
+    NAVIGATION_ERROR,
+    NAVIGATION_RETRY_S,
+    NEW_DOCUMENT_JS,
+    PageCache,
+    RequestBlocker,
+    SCROLL_JS,
+    SCROLL_TO_JS,
+    SETTLE_CONDITIONS,
+    SNAPSHOT_PARAMS,
+    VIEWPORT_METRICS_JS,
+    report_parse_timings,
+    report_settle,
+    same_document,
+    viewport_point,
+)
+from dom_parser import NodeStore, build_buffer, collapse_tree
+from packing import CONSENT, element_priority
+from search_index import PageIndex
+from state_store import StateStore
+
+# pages whose result links are prefetched, and links never worth prefetching
+# (the search engine's own pages)
+RESULTS_URL = re.compile(r"/search\?")
+SKIP_PREFETCH_URL = re.compile(r"://([^/]*\.)?(google|gstatic|youtube)\.[^/]+/")
+
+
+async def launch_browser(playwright, headless: bool = False):
+    return await playwright.chromium.launch(
+        # channel="msedge",
+        headless=headless,
+        args=["--accept-lang=en-GB", "--lang=en-US"],
+    )
+
+
+def result_links(buffer: Dict[str, dict], base_url: str, k: int) -> List[str]:
+    # the first `k` distinct links of a results page, as absolute urls
+    links = []
+    for node in buffer.values():
+        if node["node_type"] != "link" or not (href := node.get("href")):
+            continue
+        url = urldefrag(urljoin(base_url, href))[0]
+        if (
+            not url.startswith(("http://", "https://"))
+            or url == base_url
+            or RESULTS_URL.search(url)
+            or SKIP_PREFETCH_URL.search(url)
+            or url in links
+        ):
+            continue
+        links.append(url)
+        if len(links) == k:
+            break
+    return links
+
+
+class AsyncCDPSessions:
+    # asyncio counterpart of `CDPSessions`
+    def __init__(self, context) -> None:
+        self.context = context
+        self.sessions = {}
+
+    async def get(self, page):
+        if (session := self.sessions.get(page)) is None:
+            session = await self.context.new_cdp_session(page)
+            self.sessions[page] = session
+            page.once("close", lambda _: self.sessions.pop(page, None))
+        return session
+
+    async def detach(self, page) -> None:
+        if (session := self.sessions.pop(page, None)) is not None:
+            try:
+                await session.detach()
+            except PlaywrightError:
+                # the page is already gone
+                pass
+
+    async def detach_all(self) -> None:
+        for page in list(self.sessions):
+            await self.detach(page)
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+
+class AsyncCrawler:
+    # asyncio counterpart of `Crawler`; create it with `await AsyncCrawler.create()`
+    def __init__(
+        self,
+        limit_to_viewport: bool = True,
+        viewport_width: int = 1800,
+        viewport_height: int = 1000,
+        incremental: bool = True,
+        settle_condition: str = "dom-quiet",
+        settle_timeout: float = 4.0,
+        settle_quiet_ms: int = 500,
+        settle_grace_ms: int = 300,
+        prefetch: int = 3,
+        page_cache_bytes: int = 256 * 2**20,
+        headless: bool = False,
+        block_resource_types: Iterable[str] = BLOCK_RESOURCE_TYPES,
+        block_domains: Iterable[str] = BLOCK_DOMAINS,
+        state_store: Optional[StateStore] = None,
+        index_pages: bool = True,
+    ) -> None:
+        if settle_condition not in SETTLE_CONDITIONS:
+            raise ValueError(f"unknown settle condition: {settle_condition}")
+        self.viewport_width = viewport_width
+        self.viewport_height = viewport_height
+        self.limit_to_viewport = limit_to_viewport
+        self.incremental = incremental
+        # only used when the crawler launches its own browser
+        self.headless = headless
+        self.blocker = RequestBlocker(block_resource_types, block_domains)
+        # see `Crawler.__init__`; one store can be shared by many crawlers
+        self.state_store = state_store
+
+        self.playwright = None
+        self.browser = None
+        self.context = None
+        self.sessions = None
+        self.page = None
+        self.client = None
+        self.page_buffer = {}
+        self.parse_timings = {}
+        self.store = None
+        self.store_version = None
+        # a store `warm` captured since the last parse, and its dom_version
+        self.warmed = None
+        self.warmed_version = None
+        # viewport metrics of the last parse
+        self.viewport = None
+        self.page_cache = PageCache(page_cache_bytes) if page_cache_bytes else None
+        # see `Crawler.__init__`
+        self.index_pages = index_pages
+        self.page_indexes = weakref.WeakKeyDictionary()
+        self.settle_condition = settle_condition
+        self.settle_timeout = settle_timeout
+        self.settle_quiet_ms = settle_quiet_ms
+        self.settle_grace_ms = settle_grace_ms
+        self.settle_log = []
+
+        # on a results page the first `prefetch` result links are opened and
+        # parsed in background pages of the same context; clicking one of
+        # them swaps its page in instead of navigating
+        self.prefetch = prefetch
+        self.prefetched = {}
+        self.prefetch_source = None
+        self.prefetch_pages = set()
+        # pages a prefetched page was swapped in for, to go back to, each with
+        # the history index the swapped-in page had then
+        self.page_stack = []
+
+    @classmethod
+    async def create(cls, browser=None, **kwargs) -> "AsyncCrawler":
+        crawler = cls(**kwargs)
+        await crawler.start(browser)
+        return crawler
+
+    async def start(self, browser=None) -> None:
+        # with a shared `browser` the crawler only owns its own context, which
+        # keeps cookies, storage and pages isolated from other crawlers
+        if browser is None:
+            self.playwright = await async_playwright().start()
+            self.browser = await launch_browser(self.playwright, self.headless)
+        else:
+            self.browser = browser
+        self.context = await self.browser.new_context(
+            storage_state=self.state_store.load() if self.state_store else None
+        )
+        await self.context.add_init_script(DOM_VERSION_JS)
+        # see `Crawler.__init__`
+        if self.blocker.active:
+            for pattern in self.blocker.patterns():
+                await self.context.route(pattern, self.route)
+        self.context.on("request", self.blocker.record_request)
+        self.context.on("response", self.blocker.record_response)
+        self.sessions = AsyncCDPSessions(self.context)
+        self.page = await self.context.new_page()
+        await self.page.set_viewport_size(
+            {"width": self.viewport_width, "height": self.viewport_height}
+        )
+        # pages opened by a click (e.g. target=_blank links) become the active page
+        self.context.on("page", self.handle_page)
+
+    async def close(self) -> None:
+        await self.save_state()
+        await self.clear_prefetch()
+        await self.sessions.detach_all()
+        await self.context.close()
+        if self.playwright is not None:
+            await self.browser.close()
+            await self.playwright.stop()
+
+    async def save_state(self) -> None:
+        if self.state_store is not None:
+            self.state_store.save(await self.context.storage_state())
+
+    async def route(self, route) -> None:
+        if self.blocker.check(route.request):
+            await route.abort("blockedbyclient")
+        else:
+            await route.continue_()
+
+    async def handle_page(self, page) -> None:
+        await page.wait_for_load_state()
+        # prefetch pages stay in the background
+        if page in self.prefetch_pages:
+            return
+        print(" > switching to:", await page.title())
+
+        self.page = page
+        await self.page.set_viewport_size(
+            {"width": self.viewport_width, "height": self.viewport_height}
+        )
+        self.client = await self.sessions.get(self.page)
+        self.page_buffer = {}
+
+    async def go_to_page(self, url: str) -> None:
+        if not url.startswith(("http://", "https://")):
+            url = "http://" + url
+        try:
+            await self.page.goto(url, timeout=0)
+        except Exception as er:
+            print(er)
+            return
+        await self.clear_prefetch()
+        await self.clear_page_stack()
+        self.client = await self.sessions.get(self.page)
+        self.page_buffer = {}
+
+    async def click(self, _id: str) -> None:
+        if element := self.page_buffer.get(str(_id)):
+            if await self.swap_in(element.get("href")):
+                return
+            if (point := viewport_point(element, self.viewport)) is None:
+                print(f" > element {_id} has no position on the page")
+                return
+            await self.act(lambda: self.page.mouse.click(*point))
+            if element_priority(element) == CONSENT:
+                await self.save_state()
+        elif await self.reveal(_id):
+            await self.click(_id)
+        else:
+            print(f" > there is no element {_id} in the page buffer")
+
+    async def reveal(self, _id: str) -> bool:
+        # see `Crawler.reveal`
+        store = self.store
+        index = self.page_index()
+        if index is None or self.viewport is None:
+            return False
+        y = index.y(str(_id), self.viewport["device_pixel_ratio"])
+        if y is None:
+            return False
+        await self.page.evaluate(SCROLL_TO_JS, y)
+        await self.settle()
+        viewport = await self.metrics()
+        if not same_document(viewport.get("dom_version"), self.store_version):
+            return False
+        if not store.reusable_at(viewport):
+            return False
+        self.viewport = viewport
+        self.page_buffer = await asyncio.to_thread(
+            build_buffer, store, viewport, self.limit_to_viewport
+        )
+        return str(_id) in self.page_buffer
+
+    async def back(self) -> None:
+        if self.page_stack and await self.history_index() <= self.page_stack[-1][-1]:
+            # the swapped-in page is where it was swapped in, so BACK returns
+            # to the page it was opened from, whose snapshot is still valid
+            await self.page.close()
+            self.page, self.client, self.store, self.store_version, _ = (
+                self.page_stack.pop()
+            )
+            self.page_buffer = {}
+            await self.page.bring_to_front()
+            return
+        await self.page.go_back()
+        await self.settle()
+
+    async def history_index(self) -> int:
+        # where the active page is in its own history; unlike the return value
+        # of go_back, this also tells same-document (hash, pushState) steps
+        history = await self.client.send("Page.getNavigationHistory")
+        return history["currentIndex"]
+
+    async def select(self, _id: str, value: str) -> None:
+        # option: value attribute of an option
+        if element := self.page_buffer.get(str(_id)):
+            await self.page.select_option(
+                f"select#{element['inner_text']}", str(value)
+            )
+
+    async def type(self, _id: str, text: str) -> None:
+        await self.page.evaluate(CLEAR_INPUTS_JS)
+        await self.click(_id)
+        await self.page.keyboard.type(text)
+
+    async def enter(self) -> None:
+        await self.act(lambda: self.page.keyboard.press("Enter"))
+
+    async def act(self, action: Callable[[], Awaitable]) -> None:
+        # see `Crawler.act`
+        page = self.page
+        document_id = await page.evaluate(DOCUMENT_ID_JS)
+        try:
+            async with page.expect_request(
+                lambda r: r.is_navigation_request() and r.frame == page.main_frame,
+                timeout=self.settle_grace_ms,
+            ):
+                await action()
+        except PlaywrightTimeoutError:
+            document_id = None
+        await self.settle(document_id=document_id)
+
+    async def scroll(self, direction: str) -> None:
+        if js := SCROLL_JS.get(direction):
+            await self.page.evaluate(js)
+            await self.settle()
+
+    async def settle(
+        self,
+        condition: Optional[str] = None,
+        page=None,
+        document_id: Optional[str] = None,
+    ) -> float:
+        # see `Crawler.settle`; `page` defaults to the active page. only the
+        # active page's waits go to settle_log, which the step traces sum up;
+        # prefetch pages settle in the background
+        condition = condition or self.settle_condition
+        background = page is not None and page is not self.page
+        page = page or self.page
+        st = time.monotonic()
+        deadline = st + self.settle_timeout
+        timed_out = False
+
+        while True:
+            remaining_ms = max((deadline - time.monotonic()) * 1000.0, 1.0)
+            try:
+                if document_id is not None:
+                    await page.wait_for_function(
+                        NEW_DOCUMENT_JS, arg=document_id, timeout=remaining_ms
+                    )
+                    document_id = None
+                if condition == "sleep":
+                    await asyncio.sleep(self.settle_timeout)
+                elif condition == "dom-quiet":
+                    await page.wait_for_load_state(
+                        "domcontentloaded", timeout=remaining_ms
+                    )
+                    await page.wait_for_function(
+                        DOM_QUIET_JS, arg=self.settle_quiet_ms, timeout=remaining_ms
+                    )
+                else:
+                    await page.wait_for_load_state(condition, timeout=remaining_ms)
+                break
+            except PlaywrightTimeoutError:
+                timed_out = True
+                break
+            except PlaywrightError as er:
+                if not NAVIGATION_ERROR.search(str(er)):
+                    raise
+                await asyncio.sleep(NAVIGATION_RETRY_S)
+                if time.monotonic() >= deadline:
+                    timed_out = True
+                    break
+
+        record = report_settle(page.url, condition, st, timed_out)
+        if not background:
+            self.settle_log.append(record)
+        return record["ms"]
+
+    async def capture(self) -> NodeStore:
+        tree = await self.client.send("DOMSnapshot.captureSnapshot", SNAPSHOT_PARAMS)
+        # building the tree is pure python; run it off the event loop so other
+        # agents sharing the loop keep making progress
+        return await asyncio.to_thread(NodeStore, tree)
+
+    def use(self, store: NodeStore, viewport: Dict, cache: bool = False) -> None:
+        # makes `store` the one the page buffer, passages and ids refer to
+        self.store = store
+        self.store_version = viewport.get("dom_version")
+        if cache and self.page_cache is not None:
+            self.page_cache.put(self.page.url, viewport, store)
+
+    def cached(self, viewport: Dict) -> Optional[NodeStore]:
+        # the store of a page parsed before (e.g. the results page after BACK)
+        # whose content still has the same fingerprint. only for a new document:
+        # mutations of the current one can keep the fingerprint
+        if not self.incremental or self.page_cache is None:
+            return None
+        if same_document(viewport.get("dom_version"), self.store_version):
+            return None
+        store = self.page_cache.get(self.page.url, viewport)
+        if store is not None and not store.reusable_at(viewport):
+            return None
+        return store
+
+    def warmed_at(self, viewport: Dict) -> Optional[NodeStore]:
+        # the store `warm` captured, if the page did not change since
+        dom_version = viewport.get("dom_version")
+        if (
+            self.warmed is None
+            or dom_version is None
+            or dom_version != self.warmed_version
+            or not self.warmed.reusable_at(viewport)
+        ):
+            return None
+        return self.warmed
+
+    def is_current(self, viewport: Dict) -> bool:
+        dom_version = viewport.get("dom_version")
+        return (
+            self.incremental
+            and self.store is not None
+            and dom_version is not None
+            and dom_version == self.store_version
+            and self.store.reusable_at(viewport)
+        )
+
+    async def metrics(self) -> Dict:
+        # see `Crawler.metrics`
+        try:
+            return await self.page.evaluate(VIEWPORT_METRICS_JS)
+        except PlaywrightError:
+            await self.settle()
+            return await self.page.evaluate(VIEWPORT_METRICS_JS)
+
+    async def parse(self) -> Dict[str, dict]:
+        timings = {}
+        st = time.monotonic()
+
+        viewport = await self.metrics()
+        timings["metrics"] = time.monotonic()
+        self.viewport = viewport
+
+        if self.is_current(viewport):
+            store = self.store
+        elif (store := self.warmed_at(viewport)) is not None:
+            # the warmed snapshot is what the agent acts on after all
+            self.use(store, viewport, cache=True)
+        elif (store := self.cached(viewport)) is not None:
+            self.use(store, viewport)
+        else:
+            store = await self.capture()
+            timings["snapshot"] = time.monotonic()
+            self.use(store, viewport, cache=True)
+
+        buffer = await asyncio.to_thread(
+            build_buffer, store, viewport, self.limit_to_viewport
+        )
+        self.page_buffer = buffer
+        self.warmed = None
+        timings["collapse"] = time.monotonic()
+
+        if self.index_pages and store not in self.page_indexes:
+            self.page_indexes[store] = await asyncio.to_thread(PageIndex, store)
+            timings["index"] = time.monotonic()
+
+        self.parse_timings = report_parse_timings(st, timings)
+
+        await self.start_prefetch(buffer)
+
+        return buffer
+
+    def page_index(self) -> Optional[PageIndex]:
+        if self.store is None:
+            return None
+        return self.page_indexes.get(self.store)
+
+    def relevant_passages(self, query: str, k: int = 3) -> Dict[str, dict]:
+        # see `Crawler.relevant_passages`
+        index = self.page_index()
+        if index is None:
+            return {}
+        return index.passage_buffer(query, k, exclude=self.page_buffer)
+
+    async def start_prefetch(self, buffer: Dict[str, dict]) -> None:
+        url = self.page.url
+        if not self.prefetch or not RESULTS_URL.search(url):
+            return
+        if url == self.prefetch_source:
+            return
+        await self.clear_prefetch()
+        self.prefetch_source = url
+        for link in result_links(buffer, url, self.prefetch):
+            self.prefetched[link] = asyncio.create_task(self.prefetch_page(link))
+
+    async def prefetch_page(self, url: str) -> Dict:
+        page = await self.context.new_page()
+        self.prefetch_pages.add(page)
+        await page.set_viewport_size(
+            {"width": self.viewport_width, "height": self.viewport_height}
+        )
+        await page.goto(url)
+        await self.settle(page=page)
+        client = await self.sessions.get(page)
+        viewport = await page.evaluate(VIEWPORT_METRICS_JS)
+        tree = await client.send("DOMSnapshot.captureSnapshot", SNAPSHOT_PARAMS)
+        store = await asyncio.to_thread(NodeStore, tree)
+        store.entries = await asyncio.to_thread(collapse_tree, store)
+        if self.index_pages:
+            self.page_indexes[store] = await asyncio.to_thread(PageIndex, store)
+        return {"page": page, "client": client, "store": store, "viewport": viewport}
+
+    async def swap_in(self, href: Optional[str]) -> bool:
+        # makes the prefetched page of `href` the active page, waiting for it
+        # if it is still loading; False if there is none
+        if not href:
+            return False
+        url = urldefrag(urljoin(self.page.url, href))[0]
+        if (task := self.prefetched.pop(url, None)) is None:
+            return False
+        try:
+            prefetched = await task
+        except Exception as er:
+            print(f" > could not prefetch {url}: {er}")
+            return False
+
+        page = prefetched["page"]
+        self.prefetch_pages.discard(page)
+        previous = (self.page, self.client, self.store, self.store_version)
+        self.page = page
+        self.client = prefetched["client"]
+        self.page_stack.append(previous + (await self.history_index(),))
+        self.store = prefetched["store"]
+        self.store_version = prefetched["viewport"].get("dom_version")
+        if self.page_cache is not None:
+            self.page_cache.put(page.url, prefetched["viewport"], self.store)
+        self.page_buffer = {}
+        await page.bring_to_front()
+        print(" > switching to prefetched:", url)
+        return True
+
+    async def clear_prefetch(self) -> None:
+        # drops the prefetched pages nobody clicked
+        for task in self.prefetched.values():
+            task.cancel()
+        await asyncio.gather(*self.prefetched.values(), return_exceptions=True)
+        for page in self.prefetch_pages:
+            try:
+                await page.close()
+            except Exception:
+                pass
+        self.prefetched = {}
+        self.prefetch_pages = set()
+        self.prefetch_source = None
+
+    async def clear_page_stack(self) -> None:
+        # closes the pages BACK could have returned to
+        for page, *_ in self.page_stack:
+            try:
+                await page.close()
+            except PlaywrightError:
+                pass
+        self.page_stack = []
+
+    async def warm(self) -> None:
+        # snapshot the page in the background (e.g. while the model is
+        # generating) if it changed since the last parse, so the next parse
+        # only has to cull the viewport. the store is only used from that
+        # parse on: until then the ids the model answers with, passages
+        # included, are those of the store the prompt was built from
+        try:
+            viewport = await self.page.evaluate(VIEWPORT_METRICS_JS)
+            if (
+                self.client is None
+                or self.is_current(viewport)
+                or self.warmed_at(viewport) is not None
+                or self.cached(viewport) is not None
+            ):
+                return
+            # kept out of the page cache until a parse uses it, so a page that
+            # keeps changing cannot evict the pages BACK needs
+            store = await self.capture()
+            store.entries = await asyncio.to_thread(collapse_tree, store)
+            self.warmed = store
+            self.warmed_version = viewport.get("dom_version")
+        except Exception as er:
+            print(f" > could not warm the page snapshot: {er}")
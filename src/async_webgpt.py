@@ -0,0 +1,285 @@
+import asyncio
+import os
+import sys
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from async_crawler import AsyncCrawler
+from decoding import Decoding, afirst_line
+from quotes import QuoteStore
+from tracing import NO_TRACER, NULL_STEP, Tracer
+from webgpt import (
+    ALREADY_QUOTED,
+    answer_decoding,
+    answer_params,
+    answer_prompt,
+    budget_from_env,
+    cache_from_env,
+    get_backend,
+    hist_len,
+    is_done,
+    instruction_decoding,
+    instruction_params,
+    instruction_prompt,
+    parse_command,
+    quote_buffer_to_string,
+    state_store_from_env,
+    step_limit,
+    trace_tokens,
+    tracer_from_env,
+    validate_command,
+    welcome_params,
+    welcome_prompt,
+)
+
+default_objective = """Why did we decide that certain words were "bad" and shouldn't be used in social settings?"""
+
+# (prompt, **completion params) -> completion choices
+Complete = Callable[..., Awaitable[List[str]]]
+
+
+async def acomplete(prompt: str, **params) -> List[str]:
+    return await get_backend().acomplete(prompt, **params)
+
+
+# (prompt, **completion params) -> streamed text chunks
+Stream = Callable[..., AsyncIterator[str]]
+
+
+def astream(prompt: str, **params) -> AsyncIterator[str]:
+    return get_backend().astream(prompt, **params)
+
+
+async def aget_gpt_instruction(
+    objective: str,
+    url: str,
+    command_history: deque,
+    quote_buffer: List,
+    buffer: Dict,
+    viewport: Optional[Dict] = None,
+    complete: Complete = acomplete,
+    decoding: Decoding = instruction_decoding,
+    stream: Optional[Stream] = None,
+    step=NULL_STEP,
+    passages: Optional[Dict] = None,
+    budget: Optional[int] = None,
+) -> str:
+    with step.phase("serialize"):
+        prompt = instruction_prompt(
+            objective,
+            url,
+            command_history,
+            quote_buffer,
+            buffer,
+            viewport,
+            budget=budget,
+            passages=passages,
+        )
+    known = dict(buffer, **passages) if passages else buffer
+    with step.phase("llm"):
+        if stream is not None and decoding.streamable:
+            chunks = stream(prompt, **decoding.params(instruction_params))
+            ins = await afirst_line(chunks)
+        else:
+            choices = await complete(prompt, **decoding.params(instruction_params))
+            ins = decoding.choose(choices, lambda c: validate_command(c, known))
+    trace_tokens(step, prompt, ins)
+    return ins
+
+
+async def aget_gpt_answer(
+    objective: str,
+    quote_buffer: List[Dict[str, str]],
+    complete: Complete = acomplete,
+    decoding: Decoding = answer_decoding,
+) -> str:
+    prompt = answer_prompt(objective, quote_buffer)
+    return decoding.choose(await complete(prompt, **decoding.params(answer_params)))
+
+
+async def aget_gpt_welcome_msg(
+    current_time: str, user_name: str = "Eric", complete: Complete = acomplete
+) -> str:
+    prompt = welcome_prompt(current_time, user_name)
+    return (await complete(prompt, **welcome_params))[0]
+
+
+async def instruct(
+    crawler: AsyncCrawler, ins: str, quote_buffer: QuoteStore
+) -> bool:
+    command = parse_command(ins)
+    if command is None:
+        first_line = ins.split("\n")[0]
+        print(f" > Command: `{first_line}` is not recognized")
+        return False
+    action, *args = command
+
+    if action == "SCROLL":
+        await crawler.scroll(args[0])
+    elif action == "CLICK":
+        await crawler.click(args[0])
+    elif action in ("TYPE", "SUBMIT"):
+        _id, text = args
+        await crawler.type(_id, text)
+        if not text:
+            print(f" > Passed empty string to TYPE command")
+            return False
+        if action == "SUBMIT":
+            await crawler.enter()
+    elif action == "SELECT":
+        await crawler.select(*args)
+    elif action == "QUOTE":
+        quote = args[0]
+        if quote_buffer.add(await crawler.page.title(), crawler.page.url, quote):
+            print(f" > memorized: {quote}")
+        else:
+            print(f" > already memorized: {quote}")
+    elif action == "BACK":
+        await crawler.back()
+    elif action == "ANSWER":
+        print(" > Switching to answering mode...")
+    return True
+
+
+async def warm_while(crawler: AsyncCrawler, task: asyncio.Task, delay: float = 0.5):
+    # the page sits idle while the model generates, so refresh its snapshot once
+    # (late-loading content, consent banners appearing, ...) if `task` is still
+    # running after `delay` seconds. only once: on pages that never stop
+    # changing (tickers, ads) repeated captures would hog the GIL
+    try:
+        await asyncio.wait({task}, timeout=delay)
+        if not task.done():
+            await crawler.warm()
+        return await task
+    finally:
+        # e.g. the agent timed out (see AgentServer): stop the model call too
+        task.cancel()
+
+
+async def run_agent(
+    crawler: AsyncCrawler,
+    objective: str,
+    start_url: str = "https://www.google.com/",
+    complete: Complete = acomplete,
+    decoding: Decoding = instruction_decoding,
+    stream: Optional[Stream] = None,
+    tracer: Tracer = NO_TRACER,
+    budget: Optional[int] = None,
+    max_steps: Optional[int] = step_limit,
+) -> str:
+    # history and quotes are local to the run, so concurrent agents never
+    # share them; the page buffer lives on the agent's own crawler. see
+    # webgpt.run_agent for `max_steps`
+    history = deque(maxlen=hist_len)
+    quote_buffer = QuoteStore(objective)
+
+    await crawler.go_to_page(start_url)
+
+    n_steps = 0
+    while True:
+        with tracer.step(crawler.page.url) as step:
+            buffer = await crawler.parse()
+            step.add_phases(crawler.parse_timings)
+            with step.phase("search"):
+                passages = crawler.relevant_passages(objective)
+
+            gpt_ins = await warm_while(
+                crawler,
+                asyncio.create_task(
+                    aget_gpt_instruction(
+                        objective,
+                        crawler.page.url,
+                        history,
+                        quote_buffer,
+                        buffer,
+                        crawler.viewport,
+                        complete,
+                        decoding,
+                        stream,
+                        step,
+                        passages,
+                        budget,
+                    )
+                ),
+            )
+            gpt_ins = gpt_ins.strip()
+            print(" > issued instruction:\n" + gpt_ins + "\n")
+
+            quote_buffer_str = quote_buffer_to_string(quote_buffer)
+            settles = len(crawler.settle_log)
+            duplicates = quote_buffer.duplicates
+            with step.phase("action"):
+                ok = await instruct(crawler, gpt_ins, quote_buffer)
+            step.split_phase(
+                "action", "settle", sum(r["ms"] for r in crawler.settle_log[settles:])
+            )
+            step.set(command=gpt_ins.split(" ", 1)[0], ok=bool(ok))
+
+        n_steps += 1
+        if ok:
+            rejected = quote_buffer.duplicates > duplicates
+            history.append(gpt_ins + ALREADY_QUOTED if rejected else gpt_ins)
+        if is_done(ok, gpt_ins, quote_buffer_str, n_steps, max_steps):
+            return await aget_gpt_answer(objective, quote_buffer, complete)
+
+
+async def main(objectives: List[str]) -> None:
+    current_time_str = datetime.today().strftime("%I:%M %p")
+    state_store = state_store_from_env()
+    tracer = tracer_from_env()
+    complete = acomplete
+    stream = astream
+    if cache := cache_from_env():
+        complete = cache.wrap_async(acomplete)
+        stream = None
+
+    # launch the browsers while the welcome message is being generated
+    welcome, crawlers = await asyncio.gather(
+        aget_gpt_welcome_msg(current_time_str, complete=complete),
+        asyncio.gather(
+            *(
+                AsyncCrawler.create(
+                    limit_to_viewport=True,
+                    viewport_height=750,
+                    headless=os.environ.get("WEBGPT_HEADLESS") == "1",
+                    state_store=state_store,
+                )
+                for _ in objectives or [default_objective]
+            )
+        ),
+    )
+
+    if not objectives:
+        print(welcome)
+        i = await asyncio.to_thread(input, "\n")
+        objectives = [i or default_objective]
+        if not i:
+            print(default_objective, "\n")
+
+    try:
+        # one agent loop per objective, all sharing this event loop
+        budget = budget_from_env()
+        answers = await asyncio.gather(
+            *(
+                run_agent(
+                    c, o, complete=complete, stream=stream, tracer=tracer, budget=budget
+                )
+                for c, o in zip(crawlers, objectives)
+            )
+        )
+        for objective, answer in zip(objectives, answers):
+            print(f"\nQUESTION: {objective}\nANSWER:\n{answer}\n")
+    finally:
+        for crawler in crawlers:
+            await crawler.close()
+        tracer.close()
+        print(get_backend().metrics.report())
+        await get_backend().aclose()
+
+
+if __name__ == "__main__":
+    # python src/async_webgpt.py ["objective" ...]
+    try:
+        asyncio.run(main(sys.argv[1:]))
+    except KeyboardInterrupt:
+        print("\nBye!")
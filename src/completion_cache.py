@@ -0,0 +1,196 @@
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# hard-coded prompts are full of indentation and blank lines; whitespace
+# differences should not make two prompts different
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    return WHITESPACE.sub(" ", prompt).strip()
+
+
+def cache_key(prompt: str, params: Dict) -> str:
+    payload = json.dumps(
+        {"params": params, "prompt": normalize_prompt(prompt)},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    # completions keyed by model, parameters and the normalized prompt. lookups
+    # go through an in-memory LRU first and then, if `path` is given, an SQLite
+    # file shared across runs. entries older than `ttl` seconds are misses.
+    # sampled completions (temperature > 0) are only cached with
+    # cache_sampled=True, e.g. for regression runs over the same questions
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_entries: int = 1024,
+        max_disk_entries: int = 100_000,
+        ttl: Optional[float] = 7 * 24 * 3600,
+        cache_sampled: bool = False,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.cache_sampled = cache_sampled
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        # rows in the SQLite file, as far as this process knows; recounted
+        # whenever it goes over max_disk_entries
+        self.disk_entries = 0
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, text TEXT, created REAL, accessed REAL)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS completions_accessed "
+                "ON completions (accessed)"
+            )
+            self.db.commit()
+            self.disk_entries = self.count()
+
+    def cacheable(self, params: Dict) -> bool:
+        return self.cache_sampled or not params.get("temperature", 1.0)
+
+    def expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, prompt: str, params: Dict) -> Optional[List[str]]:
+        if not self.cacheable(params):
+            return None
+        key = cache_key(prompt, params)
+        now = time.time()
+
+        with self.lock:
+            if (item := self.memory.get(key)) is not None:
+                text, created = item
+                if not self.expired(created, now):
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(text)
+                del self.memory[key]
+
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT text, created FROM completions WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self.expired(row[1], now):
+                    self.db.execute(
+                        "UPDATE completions SET accessed = ? WHERE key = ?", (now, key)
+                    )
+                    self.db.commit()
+                    self.remember(key, row[0], row[1])
+                    self.hits += 1
+                    return json.loads(row[0])
+
+            self.misses += 1
+            return None
+
+    def put(self, prompt: str, params: Dict, choices: List[str]) -> None:
+        if not self.cacheable(params):
+            return
+        key = cache_key(prompt, params)
+        text = json.dumps(choices)
+        now = time.time()
+
+        with self.lock:
+            self.remember(key, text, now)
+            if self.db is not None:
+                known = self.db.execute(
+                    "SELECT 1 FROM completions WHERE key = ?", (key,)
+                ).fetchone()
+                self.db.execute(
+                    "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                    (key, text, now, now),
+                )
+                if known is None:
+                    self.disk_entries += 1
+                if self.disk_entries > self.max_disk_entries:
+                    self.evict(now)
+                self.db.commit()
+
+    def remember(self, key: str, text: str, created: float) -> None:
+        self.memory[key] = (text, created)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def evict(self, now: float) -> None:
+        # drops expired entries and then the least recently used ones, down to
+        # 90% of max_disk_entries, so the next evictions are many puts away.
+        # other processes may share the file, so the rows are counted again
+        if self.ttl is not None:
+            self.db.execute(
+                "DELETE FROM completions WHERE created < ?", (now - self.ttl,)
+            )
+        excess = self.count() - int(self.max_disk_entries * 0.9)
+        if excess > 0:
+            self.db.execute(
+                "DELETE FROM completions WHERE key IN ("
+                "SELECT key FROM completions ORDER BY accessed LIMIT ?)",
+                (excess,),
+            )
+        self.disk_entries = self.count()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.memory.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM completions")
+                self.db.commit()
+                self.disk_entries = 0
+
+    def close(self) -> None:
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def wrap(self, complete: Callable[..., List[str]]) -> Callable[..., List[str]]:
+        # (prompt, **params) -> choices, served from the cache when possible
+        def cached_complete(prompt: str, **params) -> List[str]:
+            choices = self.get(prompt, params)
+            if choices is None:
+                choices = complete(prompt, **params)
+                self.put(prompt, params, choices)
+            return choices
+
+        return cached_complete
+
+    def wrap_async(
+        self, complete: Callable[..., Awaitable[List[str]]]
+    ) -> Callable[..., Awaitable[List[str]]]:
+        async def cached_complete(prompt: str, **params) -> List[str]:
+            choices = self.get(prompt, params)
+            if choices is None:
+                choices = await complete(prompt, **params)
+                self.put(prompt, params, choices)
+            return choices
+
+        return cached_complete
@@ -1,9 +1,331 @@
-from typing import List, Dict
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+import os
+import re
 import time
+import weakref
 from playwright.sync_api import sync_playwright
-from queue import Queue
-import copy
-import json
+from playwright.sync_api import Error as PlaywrightError
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+from dom_parser import NodeStore, build_buffer, save_recording
+from packing import CONSENT, element_priority
+from search_index import PageIndex
+from state_store import StateStore
+
+# counts DOM mutations per document, so the crawler can tell whether the last
+# snapshot is still current without capturing a new one
+DOM_VERSION_JS = """(() => {
+    window.__webgptDocumentId = Math.random().toString(36).slice(2);
+    window.__webgptDomVersion = 0;
+    window.__webgptLastMutation = performance.now();
+    new MutationObserver(() => {
+        window.__webgptDomVersion++;
+        window.__webgptLastMutation = performance.now();
+    }).observe(document, {
+        subtree: true, childList: true, attributes: true, characterData: true,
+    });
+})();"""
+
+# true once the document has been parsed and nothing mutated for `quietMs`
+DOM_QUIET_JS = """(quietMs) => document.readyState !== "loading" && (
+    window.__webgptLastMutation === undefined
+    || performance.now() - window.__webgptLastMutation >= quietMs
+)"""
+
+# the id DOM_VERSION_JS gave the current document, and whether another document
+# replaced the one with `documentId`
+DOCUMENT_ID_JS = "() => window.__webgptDocumentId"
+NEW_DOCUMENT_JS = """(documentId) => window.__webgptDocumentId !== undefined
+    && window.__webgptDocumentId !== documentId"""
+
+# errors of a wait whose document a navigation destroyed; Crawler.settle waits
+# on the new document instead
+NAVIGATION_ERROR = re.compile(
+    r"execution context was destroyed|cannot find context|navigat", re.I
+)
+# how long settle pauses before waiting on the new document
+NAVIGATION_RETRY_S = 0.05
+
+# what Crawler.settle can wait for after an action: a playwright load state,
+# a period without DOM mutations, or a plain sleep for the whole timeout
+SETTLE_CONDITIONS = ("load", "domcontentloaded", "networkidle", "dom-quiet", "sleep")
+
+# every viewport metric the parser needs, collected in a single round-trip.
+# scrollHeight is part of the version to catch reflows that mutate nothing,
+# e.g. images finishing loading
+VIEWPORT_METRICS_JS = """() => ({
+    device_pixel_ratio: window.devicePixelRatio,
+    width: window.screen.width,
+    height: window.screen.height,
+    page_x_offset: window.pageXOffset,
+    page_y_offset: window.pageYOffset,
+    dom_version: window.__webgptDocumentId === undefined ? null : [
+        window.__webgptDocumentId,
+        window.__webgptDomVersion,
+        document.documentElement.scrollHeight,
+    ].join(":"),
+    // unlike dom_version this survives reloads, so a page visited again (e.g.
+    // after BACK) can be recognised if its content did not change
+    dom_fingerprint: [
+        document.getElementsByTagName("*").length,
+        document.body ? document.body.textContent.length : 0,
+        document.documentElement.scrollHeight,
+    ].join(":"),
+})"""
+
+# https://chromedevtools.github.io/devtools-protocol/tot/DOMSnapshot/
+SNAPSHOT_PARAMS = {
+    # see NodeStore.fixed
+    "computedStyles": ["position"],
+    "includeDOMRects": True,
+    "includePaintOrder": True,
+}
+
+CLEAR_INPUTS_JS = """
+const inputElements = document.querySelectorAll('input');
+
+for (const input of inputElements) {
+    input.value = '';
+}
+"""
+
+SCROLL_JS = {
+    "up": "(document.scrollingElement || document.body).scrollTop = (document.scrollingElement || document.body).scrollTop - (window.innerHeight / 2);",
+    "down": "(document.scrollingElement || document.body).scrollTop = (document.scrollingElement || document.body).scrollTop + (window.innerHeight / 2);",
+}
+# centres the viewport on a page coordinate
+SCROLL_TO_JS = "(y) => window.scrollTo(0, y - window.innerHeight / 2)"
+
+# resource types the parser never reads (it only looks at DOM structure, alt
+# text and layout), and ad / tracker hosts, subdomains included
+BLOCK_RESOURCE_TYPES = ("image", "media", "font")
+BLOCK_DOMAINS = (
+    "adnxs.com",
+    "adservice.google.com",
+    "amazon-adsystem.com",
+    "chartbeat.com",
+    "criteo.com",
+    "doubleclick.net",
+    "facebook.net",
+    "google-analytics.com",
+    "googleadservices.com",
+    "googlesyndication.com",
+    "googletagmanager.com",
+    "hotjar.com",
+    "outbrain.com",
+    "quantserve.com",
+    "scorecardresearch.com",
+    "taboola.com",
+)
+# file extensions of the resource types that can be blocked by url, so only
+# their requests are routed (see RequestBlocker.patterns)
+RESOURCE_EXTENSIONS = {
+    "image": ("apng", "avif", "bmp", "gif", "ico", "jpeg", "jpg", "png", "svg", "webp"),
+    "media": ("m4a", "mp3", "mp4", "oga", "ogg", "wav", "webm"),
+    "font": ("eot", "otf", "ttf", "woff", "woff2"),
+}
+
+
+def report_parse_timings(st: float, timings: Dict[str, float]) -> Dict[str, float]:
+    # `timings` maps each phase to the monotonic time it finished at; returns
+    # per-phase durations in ms, in the order they ran
+    durations = {}
+    for phase, et in timings.items():
+        durations[phase] = (et - st) * 1000.0
+        st = et
+    print(
+        f" > ran parser in {sum(durations.values()):.2f} ms ("
+        + ", ".join(f"{k} {v:.2f} ms" for k, v in durations.items())
+        + ")"
+    )
+    return durations
+
+
+def same_document(dom_version: Optional[str], other: Optional[str]) -> bool:
+    # whether two dom_versions are of the same document (their id part)
+    if dom_version is None or other is None:
+        return False
+    return dom_version.split(":", 1)[0] == other.split(":", 1)[0]
+
+
+def viewport_point(element: Dict, viewport: Dict) -> Optional[Tuple[float, float]]:
+    # buffer positions are page coordinates (so a store can be reused after
+    # scrolling), the mouse takes viewport coordinates
+    if element.get("x_mid") is None or element.get("y_mid") is None:
+        return None
+    return (
+        element["x_mid"] - viewport["page_x_offset"],
+        element["y_mid"] - viewport["page_y_offset"],
+    )
+
+
+def report_settle(url: str, condition: str, st: float, timed_out: bool) -> Dict:
+    settle_ms = (time.monotonic() - st) * 1000.0
+    print(
+        f" > page settled in {settle_ms:.0f} ms ({condition}"
+        + (", timed out" if timed_out else "")
+        + ")"
+    )
+    return {"url": url, "condition": condition, "ms": settle_ms, "timed_out": timed_out}
+
+
+class PageCache:
+    # LRU of parsed pages (NodeStores) keyed by url and DOM fingerprint, so
+    # BACK and revisits skip the snapshot. stores do not depend on the scroll
+    # offset, so one entry serves every offset of a page. bounded by the
+    # estimated memory of the stores and by the number of entries
+    def __init__(self, max_bytes: int = 256 * 2**20, max_entries: int = 32) -> None:
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(url: str, viewport: Dict) -> Optional[Tuple[str, str]]:
+        fingerprint = viewport.get("dom_fingerprint")
+        return None if fingerprint is None else (url, fingerprint)
+
+    def get(self, url: str, viewport: Dict) -> Optional[NodeStore]:
+        if (key := self.key(url, viewport)) is None or key not in self.entries:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return self.entries[key][0]
+
+    def put(self, url: str, viewport: Dict, store: NodeStore) -> None:
+        if (key := self.key(url, viewport)) is None:
+            return
+        size = store.nbytes()
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+        self.entries[key] = (store, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes or len(self.entries) > self.max_entries:
+            self.nbytes -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.nbytes = 0
+
+
+class RequestBlocker:
+    # decides which requests of a browser context are aborted. counts all
+    # requests, the blocked ones by reason (resource type or domain), and the
+    # response bytes that were loaded, as declared by Content-Length
+    def __init__(
+        self,
+        resource_types: Iterable[str] = BLOCK_RESOURCE_TYPES,
+        domains: Iterable[str] = BLOCK_DOMAINS,
+    ) -> None:
+        self.resource_types = frozenset(resource_types)
+        self.domains = tuple(d.lower().strip(".") for d in domains)
+        self.requests = 0
+        self.blocked = Counter()
+        self.loaded_bytes = 0
+
+    @property
+    def active(self) -> bool:
+        # routing turns off the browser's http cache, so only route when
+        # something is to be blocked
+        return bool(self.resource_types or self.domains)
+
+    def patterns(self) -> List:
+        # the urls to route: those of the blocked hosts and the file extensions
+        # of the blocked resource types. every routed request waits for the
+        # python handler, which the sync API only runs inside a playwright
+        # call, so the others must go straight to the network. resources
+        # without an extension (e.g. images from an endpoint) are not blocked,
+        # and a resource type without known extensions routes everything
+        patterns = []
+        if self.domains:
+            hosts = "|".join(re.escape(domain) for domain in self.domains)
+            host = rf"^[^:/?#]+://([^/?#]*[.@])?({hosts})(:\d+)?([/?#]|$)"
+            patterns.append(re.compile(host, re.I))
+        extensions = []
+        for resource_type in sorted(self.resource_types):
+            if resource_type not in RESOURCE_EXTENSIONS:
+                return ["**/*"]
+            extensions.extend(RESOURCE_EXTENSIONS[resource_type])
+        if extensions:
+            patterns.append(re.compile(rf"\.({'|'.join(extensions)})([?#]|$)", re.I))
+        return patterns
+
+    def reason(self, url: str, resource_type: str) -> Optional[str]:
+        if resource_type in self.resource_types:
+            return resource_type
+        host = (urlparse(url).hostname or "").lower()
+        for domain in self.domains:
+            if host == domain or host.endswith("." + domain):
+                return domain
+        return None
+
+    def check(self, request) -> bool:
+        # True if `request` is to be aborted
+        if (reason := self.reason(request.url, request.resource_type)) is None:
+            return False
+        self.blocked[reason] += 1
+        return True
+
+    def record_request(self, request) -> None:
+        self.requests += 1
+
+    def record_response(self, response) -> None:
+        try:
+            self.loaded_bytes += int(response.headers.get("content-length", 0))
+        except ValueError:
+            pass
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "blocked": sum(self.blocked.values()),
+            "loaded_bytes": self.loaded_bytes,
+        }
+
+    def report(self) -> str:
+        s = self.summary()
+        reasons = ", ".join(f"{k} {v}" for k, v in self.blocked.most_common(5))
+        return (
+            f" > blocked {s['blocked']}/{s['requests']} requests"
+            + (f" ({reasons})" if reasons else "")
+            + f", loaded {s['loaded_bytes'] / 2**20:.1f} MB"
+        )
+
+
+class CDPSessions:
+    # one CDP session per page, opened on first use and kept across the page's
+    # navigations. a closed page takes its session with it
+    def __init__(self, context) -> None:
+        self.context = context
+        self.sessions = {}
+
+    def get(self, page):
+        if (session := self.sessions.get(page)) is None:
+            session = self.context.new_cdp_session(page)
+            self.sessions[page] = session
+            page.once("close", lambda _: self.sessions.pop(page, None))
+        return session
+
+    def detach(self, page) -> None:
+        if (session := self.sessions.pop(page, None)) is not None:
+            try:
+                session.detach()
+            except PlaywrightError:
+                # the page is already gone
+                pass
+
+    def detach_all(self) -> None:
+        for page in list(self.sessions):
+            self.detach(page)
+
+    def __len__(self) -> int:
+        return len(self.sessions)
 
 
 class Crawler:
@@ -12,25 +334,134 @@ class Crawler:
         limit_to_viewport: bool = True,
         viewport_width: int = 1800,
         viewport_height: int = 1000,
+        snapshot_dir: Optional[str] = None,
+        incremental: bool = True,
+        settle_condition: str = "dom-quiet",
+        settle_timeout: float = 4.0,
+        settle_quiet_ms: int = 500,
+        settle_grace_ms: int = 300,
+        page_cache_bytes: int = 256 * 2**20,
+        headless: bool = False,
+        block_resource_types: Iterable[str] = BLOCK_RESOURCE_TYPES,
+        block_domains: Iterable[str] = BLOCK_DOMAINS,
+        state_store: Optional[StateStore] = None,
+        index_pages: bool = True,
     ) -> None:
+        if settle_condition not in SETTLE_CONDITIONS:
+            raise ValueError(f"unknown settle condition: {settle_condition}")
         self.viewport_width = viewport_width
         self.viewport_height = viewport_height
-
-        self.browser = (
-            sync_playwright()
-            .start()
-            .chromium.launch(
-                # channel="msedge",
-                headless=False,
-                args=["--accept-lang=en-GB", "--lang=en-US"],
-            )
+        self.headless = headless
+        # cookies and localStorage from earlier runs, so consent banners that
+        # were answered once do not come back; saved after consent clicks and
+        # on close
+        self.state_store = state_store
+        # requests for resources the parser never reads are aborted; pass
+        # empty blocklists to load everything
+        self.blocker = RequestBlocker(block_resource_types, block_domains)
+        self.page_buffer = {}
+        self.limit_to_viewport = limit_to_viewport
+        # when set, every captured snapshot is saved there for offline replay
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_count = 0
+        # an episodes.EpisodeRecorder that gets every captured snapshot
+        self.recorder = None
+        self.parse_timings = {}
+        # reuse the last snapshot's tree while the DOM version is unchanged
+        # (e.g. after scrolling) and only redo the viewport culling
+        self.incremental = incremental
+        self.store = None
+        self.store_version = None
+        # viewport metrics of the last parse
+        self.viewport = None
+        # parsed pages to reuse on BACK and revisits; 0 bytes turns it off
+        self.page_cache = PageCache(page_cache_bytes) if page_cache_bytes else None
+        # a BM25 index over the text of the whole page, built once per store, so
+        # relevant_passages can find content outside the viewport
+        self.index_pages = index_pages
+        self.page_indexes = weakref.WeakKeyDictionary()
+        # how the crawler waits for the page after click, enter, back and scroll;
+        # settle_timeout (seconds) caps every wait. a click or Enter counts as
+        # navigating if a navigation request starts within settle_grace_ms
+        self.settle_condition = settle_condition
+        self.settle_timeout = settle_timeout
+        self.settle_quiet_ms = settle_quiet_ms
+        self.settle_grace_ms = settle_grace_ms
+        self.settle_log = []
+
+        self.open_browser()
+
+    def open_browser(self) -> None:
+        # launches the browser and opens the page the crawler drives; replay.py
+        # overrides it to stand in for both
+        self.playwright = sync_playwright().start()
+        self.browser = self.playwright.chromium.launch(
+            # channel="msedge",
+            headless=self.headless,
+            args=["--accept-lang=en-GB", "--lang=en-US"],
         )
-        self.context = self.browser.new_context()
+        self.context = self.browser.new_context(
+            storage_state=self.state_store.load() if self.state_store else None
+        )
+        self.context.add_init_script(DOM_VERSION_JS)
+        if self.blocker.active:
+            for pattern in self.blocker.patterns():
+                self.context.route(pattern, self.route)
+        self.context.on("request", self.blocker.record_request)
+        self.context.on("response", self.blocker.record_response)
+        self.sessions = CDPSessions(self.context)
         self.page = self.context.new_page()
         self.page.set_viewport_size(
-            {"width": viewport_width, "height": viewport_height}
+            {"width": self.viewport_width, "height": self.viewport_height}
         )
-        self.limit_to_viewport = limit_to_viewport
+        # pages opened by a click (e.g. target=_blank links) become the active
+        # page. registered once, so long episodes do not pile up handlers
+        self.context.on("page", self.handle_page)
+
+    @property
+    def client(self):
+        # the CDP session of the active page
+        return self.sessions.get(self.page)
+
+    def close(self) -> None:
+        self.save_state()
+        self.sessions.detach_all()
+        self.context.close()
+        self.browser.close()
+        self.playwright.stop()
+
+    def save_state(self) -> None:
+        if self.state_store is not None:
+            self.state_store.save(self.context.storage_state())
+
+    def route(self, route) -> None:
+        if self.blocker.check(route.request):
+            route.abort("blockedbyclient")
+        else:
+            route.continue_()
+
+    def handle_page(self, page) -> None:
+        page.wait_for_load_state()
+        print(" > switching to:", page.title())
+
+        self.page = page
+        self.page.set_viewport_size(
+            {"width": self.viewport_width, "height": self.viewport_height}
+        )
+        self.page_buffer = {}
+
+    def page_index(self) -> Optional[PageIndex]:
+        if self.store is None:
+            return None
+        return self.page_indexes.get(self.store)
+
+    def relevant_passages(self, query: str, k: int = 3) -> Dict[str, dict]:
+        # the passages of the current page that match `query` best and are not
+        # in the page buffer already (see PageIndex.passage_buffer)
+        index = self.page_index()
+        if index is None:
+            return {}
+        return index.passage_buffer(query, k, exclude=self.page_buffer)
 
     def go_to_page(self, url) -> None:
         if not url.startswith(("http://", "https://")):
@@ -40,46 +471,49 @@ class Crawler:
         except Exception as er:
             print(er)
             return
-        self.client = self.page.context.new_cdp_session(self.page)
         self.page_buffer = {}
 
     def click(self, _id: str) -> None:
-        def handle_page(page):
-            page.wait_for_load_state()
-            print(" > switching to:", page.title())
-
-            self.page = page
-            self.page.set_viewport_size(
-                {"width": self.viewport_width, "height": self.viewport_height}
-            )
-            self.client = self.page.context.new_cdp_session(self.page)
-            self.page_buffer = {}
-
         if element := self.page_buffer.get(str(_id)):
-            x = element.get("x_mid")
-            y = element.get("y_mid")
-
-            self.page.mouse.click(x, y)
-            self.page.wait_for_load_state()
-            self.context.on("page", handle_page)
-
+            if (point := viewport_point(element, self.viewport)) is None:
+                print(f" > element {_id} has no position on the page")
+                return
+            self.act(lambda: self.page.mouse.click(*point))
+            if element_priority(element) == CONSENT:
+                self.save_state()
+
+        elif self.reveal(_id):
+            self.click(_id)
         else:
             print(f" > there is no element {_id} in the page buffer")
 
-    def back(self) -> None:
-        def handle_page(page):
-            page.wait_for_load_state()
-            print(" > switching to:", page.title())
-
-            self.page = page
-            self.page.set_viewport_size(
-                {"width": self.viewport_width, "height": self.viewport_height}
-            )
-            self.client = self.page.context.new_cdp_session(self.page)
-            self.page_buffer = {}
+    def reveal(self, _id: str) -> bool:
+        # scrolls an element of the current page that is outside the viewport
+        # (e.g. one of the relevant_passages) into it and culls the store the
+        # prompt was built from at the new offset: ids belong to that store,
+        # even if the DOM changed since. False if the element is unknown, the
+        # document was replaced or the store cannot be reused at the offset
+        store = self.store
+        index = self.page_index()
+        if index is None or self.viewport is None:
+            return False
+        y = index.y(str(_id), self.viewport["device_pixel_ratio"])
+        if y is None:
+            return False
+        self.page.evaluate(SCROLL_TO_JS, y)
+        self.settle()
+        viewport = self.metrics()
+        if not same_document(viewport.get("dom_version"), self.store_version):
+            return False
+        if not store.reusable_at(viewport):
+            return False
+        self.viewport = viewport
+        self.page_buffer = build_buffer(store, viewport, self.limit_to_viewport)
+        return str(_id) in self.page_buffer
 
+    def back(self) -> None:
         self.page.go_back()
-        self.context.on("page", handle_page)
+        self.settle()
 
     def select(self, _id: str, value: str) -> None:
         # option: value attribute of an option
@@ -88,397 +522,152 @@ class Crawler:
             self.page.select_option(f"select#{element['inner_text']}", str(value))
 
     def type(self, _id: str, text: str) -> None:
-        js = """
-        const inputElements = document.querySelectorAll('input');
-
-        for (const input of inputElements) {
-            input.value = '';
-        }
-        """
-        self.page.evaluate(js)
+        self.page.evaluate(CLEAR_INPUTS_JS)
         self.click(_id)
         self.page.keyboard.type(text)
 
     def enter(self) -> None:
-        self.page.keyboard.press("Enter")
+        self.act(lambda: self.page.keyboard.press("Enter"))
+
+    def act(self, action: Callable[[], None]) -> None:
+        # runs an action that may start a navigation (a click, Enter) and
+        # settles on the page it leads to. neither waits for the navigation,
+        # and the old document is loaded and quiet already, so settle has to
+        # be told to wait for the new document first
+        page = self.page
+        document_id = page.evaluate(DOCUMENT_ID_JS)
+        try:
+            with page.expect_request(
+                lambda r: r.is_navigation_request() and r.frame == page.main_frame,
+                timeout=self.settle_grace_ms,
+            ):
+                action()
+        except PlaywrightTimeoutError:
+            document_id = None
+        self.settle(document_id=document_id)
 
     def scroll(self, direction: str) -> None:
-        if direction == "up":
-            self.page.evaluate(
-                "(document.scrollingElement || document.body).scrollTop = (document.scrollingElement || document.body).scrollTop - (window.innerHeight / 2);"
-            )
-        elif direction == "down":
-            self.page.evaluate(
-                "(document.scrollingElement || document.body).scrollTop = (document.scrollingElement || document.body).scrollTop + (window.innerHeight / 2);"
-            )
-
-    def parse(self) -> List[str]:
+        if js := SCROLL_JS.get(direction):
+            self.page.evaluate(js)
+            self.settle()
+
+    def settle(
+        self, condition: Optional[str] = None, document_id: Optional[str] = None
+    ) -> float:
+        # waits until the page is settled according to `condition` (defaults to
+        # settle_condition) or settle_timeout runs out; returns the wait in ms.
+        # with the `document_id` of a document that is being navigated away
+        # from, the wait starts once the new document replaced it
+        condition = condition or self.settle_condition
         st = time.monotonic()
+        deadline = st + self.settle_timeout
+        timed_out = False
 
-        device_pixel_ratio = self.page.evaluate("window.devicePixelRatio")
-
-        window_width = self.page.evaluate("window.screen.width")
-        window_height = self.page.evaluate("window.screen.height")
-
-        window_left_bound = self.page.evaluate("window.pageXOffset")
-        window_upper_bound = self.page.evaluate("window.pageYOffset")
-        window_right_bound = window_left_bound + window_width
-        window_lower_bound = window_upper_bound + window_height
-
-        # https://chromedevtools.github.io/devtools-protocol/tot/DOMSnapshot/
-        tree = self.client.send(
-            method="DOMSnapshot.captureSnapshot",
-            params={
-                "computedStyles": [],
-                "includeDOMRects": True,
-                "includePaintOrder": True,
-            },
-        )
-
-        document = tree["documents"][0]
-        strings = tree["strings"]
-
-        nodes = document["nodes"]
-        parents = nodes["parentIndex"]
-        names = nodes["nodeName"]
-        values = nodes["nodeValue"]
-        attributes = nodes["attributes"]
-        is_clickable = {str(i) for i in nodes["isClickable"]["index"]}
-
-        layout = document["layout"]
-
-        hash_tree = {}
-
-        for element_idx, parent_id in enumerate(parents):
-            hash_name = str(element_idx)
-            hash_tree[hash_name] = {
-                "children": [],
-                "name": strings[names[element_idx]],
-                "value": strings[values[element_idx]],
-                "is_clickable": True if hash_name in is_clickable else False,
-                "attributes": [strings[i] for i in attributes[element_idx]],
-            }
-
-            if (hash_parent_id := str(parent_id)) in hash_tree:
-                hash_tree[hash_parent_id]["children"].append(hash_name)
-            hash_tree[hash_name]["parent"] = hash_parent_id
-
+        while True:
+            remaining_ms = max((deadline - time.monotonic()) * 1000.0, 1.0)
             try:
-                layout_idx = layout["nodeIndex"].index(element_idx)
-            except ValueError:
-                continue
-
-            # left distance, top distance, width, height
-            x, y, width, height = layout["bounds"][layout_idx]
-            x /= device_pixel_ratio
-            y /= device_pixel_ratio
-            width /= device_pixel_ratio
-            height /= device_pixel_ratio
-
-            # check if a given node is at least partially in the viewport
-            if self.limit_to_viewport:
-                is_partially_in_viewport = (
-                    x < window_right_bound
-                    and x + width >= window_left_bound
-                    and y < window_lower_bound
-                    and y + height >= window_upper_bound
-                )
-
-                if not is_partially_in_viewport:
-                    continue
-
-            # the calculation of x_mid and y_mid will be incorrect if the Windows scale
-            # is set to the value other than 100%
-            hash_tree[hash_name].update(
-                {
-                    "x_mid": int(x + (width / 2)),
-                    "y_mid": int(y + (height / 2)),
-                }
-            )
-
-        def extract_text_values(node: dict) -> List[str]:
-            ignore_elements = set(["SCRIPT", "STYLE", "PATH", "SVG"])
-
-            # breadth-first traversal of `node` subtree
-            text_values = list()
-            q = Queue()
-            q.put(node)
-
-            while not q.empty():
-                p = q.get()
-                if not p["name"] in ignore_elements:
-                    if p["name"] == "#text":
-                        text_values.append(p["value"])
-                    if p["children"]:
-                        for child in p["children"]:
-                            q.put(hash_tree[child])
-            return text_values
-
-        def text_values_to_text(text_values: List[str], sep: str = " ") -> str:
-            if text_values:
-                return f"{sep}".join([v.strip() for v in text_values if v.strip()])
-            return ""
-
-        def extract_attributes(attrs: List[str], targets: List[str]) -> Dict[str, str]:
-            # attrs: list of all attributes for a Node
-            # targets: which pairs of attribute:value to extract
-            return {
-                attrs[i]: attrs[i + 1]
-                for i in range(0, len(attrs), 2)
-                if attrs[i] in targets
-            }
-
-        def is_ancestor_of(node: dict, names: List[str] = []):
-            q = Queue()
-
-            for child in node["children"]:
-                q.put(hash_tree[child])
-
-            while not q.empty():
-                p = q.get()
-                if p["name"] in names:
-                    return True
-                if p["children"]:
-                    for child in p["children"]:
-                        q.put(hash_tree[child])
-
-            return False
-
-        def collapse_select_node(hash_name: str, select_buffer: Dict = {}):
-            node = hash_tree[hash_name]
-
-            if node["name"] == "OPTION":
-                name_lower = node["name"].lower()
-                node["node_type"] = name_lower
-                # node["inner_text"] = text_values_to_text(extract_text_values(node))
-                attrs = extract_attributes(node["attributes"], ["selected", "value"])
-                node["inner_text"] = attrs.get("value", "")
-                is_selected = attrs.get("selected")
-
-                node["meta"] = (
-                    f"<{name_lower}"
-                    # + f"id={hash_name}"
-                    + (" selected" if is_selected else "")
-                    + ">"
-                    + node["inner_text"]
-                    + f"</{name_lower}>"
-                )
-                select_buffer[hash_name] = node
-
-            elif node["name"] == "SELECT":
-                name_lower = node["name"].lower()
-                node["node_type"] = name_lower
-                node_en = copy.copy(node)
-                node["inner_text"] = extract_attributes(
-                    node["attributes"], ["name"]
-                ).get("name", "")
-
-                node["meta"] = (
-                    f"<{name_lower} id={hash_name}"
-                    + (f" name={node['inner_text']}" if node["inner_text"] else "")
-                    + ">"
-                )
-                select_buffer[hash_name] = node
-
-                for child_hash in hash_tree[hash_name]["children"]:
-                    collapse_select_node(child_hash, select_buffer)
-
-                node_en["meta"] = f"</{name_lower}>"
-                select_buffer["_" + hash_name + "_"] = node_en
-            else:
-                if hash_tree[hash_name]["children"]:
-                    for child_hash in hash_tree[hash_name]["children"]:
-                        collapse_select_node(child_hash, select_buffer)
-
-        def collapse_table_node(hash_name: str, table_buffer: Dict = {}):
-            node = hash_tree[hash_name]
-
-            if node["name"] in ("TD", "TH") and node["is_clickable"] == False:
-                name_lower = node["name"].lower()
-                node["node_type"] = name_lower
-                node["inner_text"] = text_values_to_text(extract_text_values(node))
-                node["meta"] = (
-                    f"<{name_lower} id={hash_name}>"
-                    + node["inner_text"]
-                    + f"</{name_lower}>"
-                )
-                table_buffer[hash_name] = node
-            elif node["name"] == "TD" and node["is_clickable"] == True:
-                name_lower = "button"
-                node["node_type"] = name_lower
-                aria_label = extract_attributes(node["attributes"], ["aria-label"]).get(
-                    "aria-label"
-                )
-                node["inner_text"] = (
-                    aria_label
-                    if aria_label
-                    else text_values_to_text(extract_text_values(node))
-                )
-                node["meta"] = (
-                    f"<{name_lower} id={hash_name}>"
-                    + node["inner_text"]
-                    + f"</{name_lower}>"
-                )
-                table_buffer[hash_name] = node
-
-            elif node["name"] in ("TR", "TABLE"):
-                name_lower = node["name"].lower()
-                node["node_type"] = name_lower
-                node_en = copy.copy(node)
-                node["meta"] = f"<{name_lower}>"
-                table_buffer[hash_name] = node
-
-                for child_hash in hash_tree[hash_name]["children"]:
-                    collapse_table_node(child_hash, table_buffer)
-
-                node_en["meta"] = f"</{name_lower}>"
-                table_buffer["_" + hash_name + "_"] = node_en
-            else:
-                if hash_tree[hash_name]["children"]:
-                    for child_hash in hash_tree[hash_name]["children"]:
-                        collapse_table_node(child_hash, table_buffer)
-
-        def collapse_node(hash_name: str) -> dict:
-            node = hash_tree[hash_name]
-
-            if node["name"] in ("BUTTON", "A"):
-                name_lower = (
-                    node["name"].lower() if node["name"] == "BUTTON" else "link"
-                )
-                node["node_type"] = name_lower
-                node["inner_text"] = text_values_to_text(
-                    extract_text_values(node), sep=" | "
-                )
-                if not node["inner_text"]:
-                    attrs = extract_attributes(
-                        node["attributes"], ["aria-label", "aria-labelledby"]
+                if document_id is not None:
+                    self.page.wait_for_function(
+                        NEW_DOCUMENT_JS, arg=document_id, timeout=remaining_ms
                     )
-                    if it := attrs.get("aria-labelledby"):
-                        node["inner_text"] = it
-                    else:
-                        node["inner_text"] = attrs.get("aria-label", "")
-
-                node["meta"] = (
-                    f"<{name_lower} id={hash_name}>"
-                    + ("(" if name_lower == "button" else "")
-                    + node["inner_text"]
-                    + (")" if name_lower == "button" else "")
-                    + f"</{name_lower}>"
-                )
-                node["children"] = []
-
-            elif node["name"] == "INPUT":
-                attrs = extract_attributes(
-                    node["attributes"], ["type", "aria-label", "placeholder"]
-                )
-                if attrs.get("type", "") in ("text", "search", ""):
-                    node["node_type"] = "input"
-                    node["inner_text"] = attrs.get("aria-label", "")
-                    if not node["inner_text"]:
-                        node["inner_text"] = attrs.get("placeholder", "")
-                    # check if there initial value typed in the input bar
-                    # input_value = attrs.get("value")  # else None
-                    node["meta"] = (
-                        f"<input id={hash_name} alt="
-                        + node["inner_text"]
-                        # + (f" value={input_value}" if input_value else "")
-                        + "></input>"
+                    document_id = None
+                if condition == "sleep":
+                    time.sleep(self.settle_timeout)
+                elif condition == "dom-quiet":
+                    self.page.wait_for_load_state(
+                        "domcontentloaded", timeout=remaining_ms
                     )
-                    node["children"] = []
-                elif attrs.get("type") == "submit":
-                    node["node_type"] = "button"
-                    node["inner_text"] = attrs.get("aria-label", "")
-                    node["meta"] = (
-                        f"<button id={hash_name}>(" + node["inner_text"] + ")</button>"
+                    self.page.wait_for_function(
+                        DOM_QUIET_JS, arg=self.settle_quiet_ms, timeout=remaining_ms
                     )
-                    node["children"] = []
-            elif node["name"] == "IMG":
-                attrs = extract_attributes(node["attributes"], ["alt"])
-                node["node_type"] = "img"
-                node["inner_text"] = attrs.get("alt", "")
-                node["meta"] = f"<img id={hash_name} alt=" + node["inner_text"] + "/>"
-                node["children"] = []
-            elif node["name"] == "#text":
-                node["node_type"] = "text"
-                node["inner_text"] = node["value"].strip().replace("\n", " ")
-                node["meta"] = f"<text id={hash_name}>" + node["inner_text"] + "</text>"
-                node["children"] = []
-            elif node["name"] == "DIV" and node["is_clickable"] == True:
-                node["node_type"] = "button"
-                node["inner_text"] = text_values_to_text(
-                    extract_text_values(node), " | "
-                )
-                node["meta"] = (
-                    f"<button id={hash_name}>(" + node["inner_text"] + ")</button>"
-                )
-                node["children"] = []
-
-            return node
+                else:
+                    self.page.wait_for_load_state(condition, timeout=remaining_ms)
+                break
+            except PlaywrightTimeoutError:
+                timed_out = True
+                break
+            except PlaywrightError as er:
+                # a navigation replaced the document mid-wait; wait on the new
+                # one. anything else (e.g. a closed page) would fail every retry
+                if not NAVIGATION_ERROR.search(str(er)):
+                    raise
+                time.sleep(NAVIGATION_RETRY_S)
+                if time.monotonic() >= deadline:
+                    timed_out = True
+                    break
+
+        record = report_settle(self.page.url, condition, st, timed_out)
+        self.settle_log.append(record)
+        return record["ms"]
+
+    def metrics(self) -> Dict:
+        # a navigation started after the last settle (e.g. by a timer) can
+        # destroy the document while it is read; read the new one once settled
+        try:
+            return self.page.evaluate(VIEWPORT_METRICS_JS)
+        except PlaywrightError:
+            self.settle()
+            return self.page.evaluate(VIEWPORT_METRICS_JS)
 
-        # with open("tree.json", "w") as outfile:
-        #     json.dump(hash_tree, outfile)
+    def parse(self) -> List[str]:
+        timings = {}
+        st = time.monotonic()
 
-        buffer = {}
+        viewport = self.metrics()
+        timings["metrics"] = time.monotonic()
+        self.viewport = viewport
+
+        dom_version = viewport.get("dom_version")
+        if (
+            self.incremental
+            and self.store is not None
+            and dom_version is not None
+            and dom_version == self.store_version
+            and self.store.reusable_at(viewport)
+        ):
+            store = self.store
+        elif (
+            # a mutated document can keep its fingerprint (e.g. a class toggled
+            # to close a modal), so the cache only serves other documents
+            self.incremental
+            and self.page_cache is not None
+            and not same_document(dom_version, self.store_version)
+            and (store := self.page_cache.get(self.page.url, viewport)) is not None
+            and store.reusable_at(viewport)
+        ):
+            self.store = store
+            self.store_version = dom_version
+        else:
+            tree = self.client.send(
+                method="DOMSnapshot.captureSnapshot", params=SNAPSHOT_PARAMS
+            )
+            timings["snapshot"] = time.monotonic()
 
-        def analyse_node(hash_name: str):
-            collapsable = {"BUTTON", "A", "INPUT", "IMG", "#text"}
-            # "TABLE", "SELECT"
-            if (
-                hash_tree[hash_name]["name"] in ("DIV")
-                and hash_tree[hash_name]["is_clickable"] == False
-            ):
-                name_lower = hash_tree[hash_name]["name"].lower()
-                buffer[hash_name] = {"node_type": "sep", "meta": f"<{name_lower}>"}
-
-            elif hash_tree[hash_name]["name"] in collapsable or (
-                hash_tree[hash_name]["name"] == "DIV"
-                and hash_tree[hash_name]["is_clickable"] == True
-                and not is_ancestor_of(
-                    hash_tree[hash_name],
-                    ["BUTTON", "A", "INPUT", "IMG", "TABLE", "SELECT"],
+            if self.snapshot_dir:
+                path = os.path.join(
+                    self.snapshot_dir, f"snapshot_{self.snapshot_count:04d}.json"
                 )
-            ):
-                hash_tree[hash_name] = collapse_node(hash_name)
-                _fileds = [
-                    "node_type",
-                    "meta",
-                    "inner_text",
-                    "name",
-                    "x_mid",
-                    "y_mid",
-                ]
-                if all([hash_tree[hash_name].get(f) for f in _fileds]):
-                    buffer_node = {f: hash_tree[hash_name][f] for f in _fileds}
-                    buffer_node["is_clickable"] = hash_tree[hash_name].get(
-                        "is_clickable"
-                    )
-                    if buffer_node["inner_text"].replace("·", " ").strip() != "":
-                        buffer[hash_name] = buffer_node
-
-            elif hash_tree[hash_name]["name"] == "TABLE":
-                table_buffer = {}
-                collapse_table_node(hash_name, table_buffer=table_buffer)
-
-                for k, v in table_buffer.items():
-                    buffer[k] = v
-                hash_tree[hash_name]["children"] = []
-
-            elif hash_tree[hash_name]["name"] == "SELECT":
-                select_buffer = {}
-                collapse_select_node(hash_name, select_buffer=select_buffer)
-
-                for k, v in select_buffer.items():
-                    buffer[k] = v
-                hash_tree[hash_name]["children"] = []
-
-            if hash_tree[hash_name]["children"]:
-                for child_hash in hash_tree[hash_name]["children"]:
-                    analyse_node(child_hash)
-
-        analyse_node("0")
+                save_recording(path, tree, viewport, self.page.url)
+                self.snapshot_count += 1
+
+            store = NodeStore(tree)
+            self.store = store
+            self.store_version = dom_version
+            if self.page_cache is not None:
+                self.page_cache.put(self.page.url, viewport, store)
+            timings["tree"] = time.monotonic()
+            if self.recorder is not None:
+                self.recorder.add_snapshot(store, tree, viewport, self.page.url)
+                timings["record"] = time.monotonic()
+
+        buffer = build_buffer(store, viewport, self.limit_to_viewport)
         self.page_buffer = buffer
+        timings["collapse"] = time.monotonic()
+
+        if self.index_pages and store not in self.page_indexes:
+            self.page_indexes[store] = PageIndex(store)
+            timings["index"] = time.monotonic()
 
-        et = time.monotonic()
-        print(f" > ran parser in {(et-st)*1000.0:.2f} ms")
+        self.parse_timings = report_parse_timings(st, timings)
 
         return buffer
@@ -0,0 +1,89 @@
+from collections import Counter
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+# how a completion request is decoded and which of its choices is used:
+#   sample  - one sampled completion at the configured temperature
+#   greedy  - one completion at temperature 0
+#   best_of - `samples` completions ranked server-side, only the best is returned
+#   vote    - `samples` completions returned; the most frequent valid one wins
+STRATEGIES = ("sample", "greedy", "best_of", "vote")
+
+
+class Decoding:
+    def __init__(self, strategy: str = "greedy", samples: int = 3) -> None:
+        if strategy not in STRATEGIES:
+            raise ValueError(f"unknown decoding strategy: {strategy}")
+        self.strategy = strategy
+        self.samples = samples
+
+    def __repr__(self) -> str:
+        if self.strategy in ("best_of", "vote"):
+            return f"{self.strategy}-{self.samples}"
+        return self.strategy
+
+    @property
+    def streamable(self) -> bool:
+        # only single completions can be streamed and cut off early
+        return self.strategy in ("sample", "greedy")
+
+    def params(self, base: Dict) -> Dict:
+        # completion parameters for this strategy on top of `base`
+        params = {k: v for k, v in base.items() if k not in ("best_of", "n")}
+        if self.strategy == "greedy":
+            params["temperature"] = 0
+        elif self.strategy == "best_of":
+            params["best_of"] = self.samples
+        elif self.strategy == "vote":
+            params["n"] = self.samples
+        return params
+
+    def choose(
+        self, choices: List[str], validate: Optional[Callable[[str], bool]] = None
+    ) -> str:
+        if self.strategy == "vote":
+            return vote(choices, validate)
+        return choices[0]
+
+
+def vote(choices: List[str], validate: Optional[Callable[[str], bool]] = None) -> str:
+    # self-consistency: the most frequent choice among the valid ones, compared
+    # by their first line (the command), ties go to the earliest choice. falls
+    # back to the first choice when none is valid
+    counts = Counter()
+    first = {}
+    for choice in choices:
+        if validate is not None and not validate(choice):
+            continue
+        key = choice.strip().split("\n")[0].strip()
+        counts[key] += 1
+        first.setdefault(key, choice)
+
+    if not counts:
+        return choices[0]
+    best = max(counts.values())
+    return next(first[key] for key in first if counts[key] == best)
+
+
+def first_line(chunks: Iterator[str]) -> str:
+    # only the first line of an instruction is ever carried out, so a streamed
+    # instruction is read until that line is complete and the stream is closed,
+    # which ends the generation on the server
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        if "\n" in chunk and "\n" in "".join(parts).lstrip():
+            break
+    if close := getattr(chunks, "close", None):
+        close()
+    return "".join(parts).lstrip().split("\n")[0]
+
+
+async def afirst_line(chunks: AsyncIterator[str]) -> str:
+    parts = []
+    async for chunk in chunks:
+        parts.append(chunk)
+        if "\n" in chunk and "\n" in "".join(parts).lstrip():
+            break
+    if aclose := getattr(chunks, "aclose", None):
+        await aclose()
+    return "".join(parts).lstrip().split("\n")[0]
@@ -0,0 +1,645 @@
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from array import array
+import argparse
+import json
+import os
+import time
+
+# subtrees whose text never makes it into the buffer
+IGNORED_ELEMENTS = frozenset(["SCRIPT", "STYLE", "PATH", "SVG"])
+
+# one bit per tag name tracked in NodeStore.descendant_kinds
+TAG_KINDS = {"BUTTON": 1, "A": 2, "INPUT": 4, "IMG": 8, "TABLE": 16, "SELECT": 32}
+
+
+class NodeStore:
+    # column-oriented view of a DOMSnapshot document. node i is described by the
+    # i-th entry of each column; names, values and attributes stay indices into
+    # the snapshot `strings` table and are only resolved when asked for
+    __slots__ = (
+        "strings",
+        "parent",
+        "name",
+        "value",
+        "attributes",
+        "clickable",
+        "first_child",
+        "next_sibling",
+        "has_layout",
+        "x",
+        "y",
+        "width",
+        "height",
+        "fixed",
+        "has_sticky",
+        "scroll_x",
+        "scroll_y",
+        "texts",
+        "text_start",
+        "text_end",
+        "descendant_kinds",
+        "entries",
+        # lets an episode recorder map stores back to their snapshots
+        "__weakref__",
+    )
+
+    def __init__(self, tree: Dict) -> None:
+        document = tree["documents"][0]
+        nodes = document["nodes"]
+        parents = nodes["parentIndex"]
+        n_nodes = len(parents)
+
+        self.strings = tree["strings"]
+        self.parent = array("i", parents)
+        self.name = array("i", nodes["nodeName"])
+        self.value = array("i", nodes["nodeValue"])
+        self.attributes = nodes["attributes"]
+
+        self.clickable = bytearray(n_nodes)
+        for i in nodes["isClickable"]["index"]:
+            self.clickable[i] = 1
+
+        # children are kept as a linked list: first child + next sibling
+        self.first_child = array("i", [-1]) * n_nodes
+        self.next_sibling = array("i", [-1]) * n_nodes
+        last_child = array("i", [-1]) * n_nodes
+        # nodes are listed in document order, so a parent always precedes its children
+        for element_idx, parent_id in enumerate(parents):
+            if parent_id < 0:
+                continue
+            if last_child[parent_id] < 0:
+                self.first_child[parent_id] = element_idx
+            else:
+                self.next_sibling[last_child[parent_id]] = element_idx
+            last_child[parent_id] = element_idx
+
+        # left distance, top distance, width, height in device pixels
+        self.has_layout = bytearray(n_nodes)
+        self.x = array("d", bytes(8 * n_nodes))
+        self.y = array("d", bytes(8 * n_nodes))
+        self.width = array("d", bytes(8 * n_nodes))
+        self.height = array("d", bytes(8 * n_nodes))
+        layout = document["layout"]
+        for element_idx, (x, y, width, height) in zip(
+            layout["nodeIndex"], layout["bounds"]
+        ):
+            if self.has_layout[element_idx]:
+                continue
+            self.has_layout[element_idx] = 1
+            self.x[element_idx] = x
+            self.y[element_idx] = y
+            self.width[element_idx] = width
+            self.height[element_idx] = height
+
+        # bounds are page coordinates at the scroll offset of the capture, which
+        # position: fixed elements (with their subtrees) and sticky ones do not
+        # keep when the page scrolls; see build_buffer and reusable_at. needs
+        # "position" as the first of the snapshot's computedStyles
+        self.scroll_x = document.get("scrollOffsetX", 0.0)
+        self.scroll_y = document.get("scrollOffsetY", 0.0)
+        self.fixed = bytearray(n_nodes)
+        self.has_sticky = False
+        strings = self.strings
+        for element_idx, style in zip(layout["nodeIndex"], layout.get("styles", ())):
+            if not style or style[0] < 0:
+                continue
+            position = strings[style[0]]
+            if position == "fixed":
+                self.fixed[element_idx] = 1
+            elif position == "sticky":
+                self.has_sticky = True
+        if any(self.fixed):
+            fixed = self.fixed
+            for element_idx, parent_id in enumerate(parents):
+                if parent_id >= 0 and fixed[parent_id]:
+                    fixed[element_idx] = 1
+
+        self.index_subtrees()
+        # filled in by collapse_tree on the first build_buffer call
+        self.entries = None
+
+    def index_subtrees(self) -> None:
+        n_nodes = len(self.parent)
+        strings = self.strings
+
+        # stripped text of every #text node outside ignored elements, in document
+        # order; the text of a subtree is the slice [text_start, text_end)
+        self.texts = []
+        self.text_start = array("i", [-1]) * n_nodes
+        self.text_end = array("i", [-1]) * n_nodes
+
+        # nodes inside an ignored element keep text_start == -1
+        ignored_root = -1
+
+        def enter(element_idx: int) -> bool:
+            nonlocal ignored_root
+            if ignored_root < 0:
+                self.text_start[element_idx] = len(self.texts)
+                name = strings[self.name[element_idx]]
+                if name in IGNORED_ELEMENTS:
+                    ignored_root = element_idx
+                elif name == "#text":
+                    if text := self.node_value(element_idx).strip():
+                        self.texts.append(text)
+            return True
+
+        def leave(element_idx: int) -> None:
+            nonlocal ignored_root
+            if element_idx == ignored_root:
+                ignored_root = -1
+            if ignored_root < 0:
+                self.text_end[element_idx] = len(self.texts)
+
+        if n_nodes:
+            self.walk(0, enter, leave)
+
+        # bottom-up pass: children come after their parent, so by the time a node
+        # is folded into its parent its own mask is complete
+        name_kinds = {i: TAG_KINDS[s] for i, s in enumerate(strings) if s in TAG_KINDS}
+        self.descendant_kinds = array("B", bytes(n_nodes))
+        for element_idx in range(n_nodes - 1, 0, -1):
+            parent_id = self.parent[element_idx]
+            if parent_id >= 0:
+                kinds = name_kinds.get(self.name[element_idx], 0)
+                kinds |= self.descendant_kinds[element_idx]
+                self.descendant_kinds[parent_id] |= kinds
+
+    def walk(
+        self,
+        root: int,
+        enter: Callable[[int], bool],
+        leave: Optional[Callable[[int], None]] = None,
+    ) -> None:
+        # pre-order traversal of the `root` subtree that follows the child/sibling
+        # links instead of recursing, so depth is bounded only by memory.
+        # `enter` decides whether to descend into a node's children and `leave`
+        # runs once they are all done, in the same order a recursive walk would
+        element_idx = root
+        while True:
+            descend = enter(element_idx)
+            if descend and self.first_child[element_idx] >= 0:
+                element_idx = self.first_child[element_idx]
+                continue
+            if descend and leave:
+                leave(element_idx)
+
+            # climb up until there is a sibling left to visit
+            while element_idx != root:
+                if self.next_sibling[element_idx] >= 0:
+                    element_idx = self.next_sibling[element_idx]
+                    break
+                element_idx = self.parent[element_idx]
+                if leave:
+                    leave(element_idx)
+            else:
+                return
+
+    def nbytes(self) -> int:
+        # rough memory footprint, enough to bound a cache of stores
+        columns = (
+            self.parent,
+            self.name,
+            self.value,
+            self.first_child,
+            self.next_sibling,
+            self.x,
+            self.y,
+            self.width,
+            self.height,
+            self.text_start,
+            self.text_end,
+            self.descendant_kinds,
+        )
+        size = sum(len(c) * c.itemsize for c in columns)
+        size += len(self.clickable) + len(self.has_layout) + len(self.fixed)
+        # list slots plus the characters of the strings they point to
+        size += sum(8 + len(s) for s in self.strings)
+        size += sum(8 + len(t) for t in self.texts)
+        size += sum(8 * (len(a) + 1) for a in self.attributes)
+        return size
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def reusable_at(self, viewport: Dict) -> bool:
+        # where sticky elements are depends on the scroll offset in ways the
+        # bounds cannot tell, so a store with any is only good at its own offset
+        if not self.has_sticky:
+            return True
+        device_pixel_ratio = viewport["device_pixel_ratio"]
+        return (
+            abs(viewport["page_x_offset"] * device_pixel_ratio - self.scroll_x) < 1
+            and abs(viewport["page_y_offset"] * device_pixel_ratio - self.scroll_y) < 1
+        )
+
+    def node_name(self, element_idx: int) -> str:
+        return self.strings[self.name[element_idx]]
+
+    def node_value(self, element_idx: int) -> str:
+        value_idx = self.value[element_idx]
+        return self.strings[value_idx] if value_idx >= 0 else ""
+
+    def children(self, element_idx: int) -> Iterator[int]:
+        child_idx = self.first_child[element_idx]
+        while child_idx >= 0:
+            yield child_idx
+            child_idx = self.next_sibling[child_idx]
+
+    def extract_attributes(
+        self, element_idx: int, targets: Iterable[str]
+    ) -> Dict[str, str]:
+        # attributes are stored as a flat [name, value, name, value, ...] list
+        attrs = self.attributes[element_idx]
+        strings = self.strings
+        return {
+            strings[attrs[i]]: strings[attrs[i + 1]]
+            for i in range(0, len(attrs), 2)
+            if strings[attrs[i]] in targets
+        }
+
+    def subtree_text(self, element_idx: int, sep: str = " ") -> str:
+        start = self.text_start[element_idx]
+        if start < 0:
+            return sep.join(self.walk_text_values(element_idx))
+        return sep.join(self.texts[start : self.text_end[element_idx]])
+
+    def walk_text_values(self, element_idx: int) -> List[str]:
+        # slow path for nodes nested inside an ignored element, which are left
+        # out of the precomputed text ranges
+        text_values = []
+        stack = [element_idx]
+        while stack:
+            p = stack.pop()
+            name = self.node_name(p)
+            if name in IGNORED_ELEMENTS:
+                continue
+            if name == "#text":
+                if text := self.node_value(p).strip():
+                    text_values.append(text)
+            stack.extend(reversed(list(self.children(p))))
+        return text_values
+
+    def is_ancestor_of(self, element_idx: int, names: Iterable[str]) -> bool:
+        mask = 0
+        for name in names:
+            mask |= TAG_KINDS[name]
+        return bool(self.descendant_kinds[element_idx] & mask)
+
+
+def parse_snapshot(
+    tree: Dict, viewport: Dict, limit_to_viewport: bool = True
+) -> Dict[str, dict]:
+    return build_buffer(NodeStore(tree), viewport, limit_to_viewport)
+
+
+def collapse_tree(store: NodeStore) -> List[Tuple[str, int, bool, dict]]:
+    # the viewport-independent part of parsing: which nodes end up in the buffer
+    # and how they are rendered. each item is (key, element_idx, is_required,
+    # entry); build_buffer adds the midpoints and drops required entries that are
+    # not visible. element_idx is -1 for entries without a position
+    entries = []
+
+    def node_entry(
+        element_idx: int, node_type: str, meta: str, inner_text: Optional[str] = None
+    ) -> dict:
+        entry = {
+            "node_type": node_type,
+            "meta": meta,
+            "name": store.node_name(element_idx),
+            "is_clickable": bool(store.clickable[element_idx]),
+        }
+        if inner_text is not None:
+            entry["inner_text"] = inner_text
+        return entry
+
+    def collapse_select_node(element_idx: int) -> bool:
+        hash_name = str(element_idx)
+        name = store.node_name(element_idx)
+
+        if name == "OPTION":
+            name_lower = name.lower()
+            # inner_text = store.subtree_text(element_idx)
+            attrs = store.extract_attributes(element_idx, ["selected", "value"])
+            inner_text = attrs.get("value", "")
+            is_selected = attrs.get("selected")
+
+            meta = (
+                f"<{name_lower}"
+                # + f"id={hash_name}"
+                + (" selected" if is_selected else "")
+                + ">"
+                + inner_text
+                + f"</{name_lower}>"
+            )
+            entry = node_entry(element_idx, name_lower, meta, inner_text)
+            entries.append((hash_name, element_idx, False, entry))
+            return False
+
+        elif name == "SELECT":
+            name_lower = name.lower()
+            inner_text = store.extract_attributes(element_idx, ["name"]).get(
+                "name", ""
+            )
+
+            meta = (
+                f"<{name_lower} id={hash_name}"
+                + (f" name={inner_text}" if inner_text else "")
+                + ">"
+            )
+            entry = node_entry(element_idx, name_lower, meta, inner_text)
+            entries.append((hash_name, element_idx, False, entry))
+
+        return True
+
+    def close_select_node(element_idx: int) -> None:
+        if (name := store.node_name(element_idx)) == "SELECT":
+            name_lower = name.lower()
+            entry = node_entry(element_idx, name_lower, f"</{name_lower}>")
+            entries.append(("_" + str(element_idx) + "_", element_idx, False, entry))
+
+    def collapse_table_node(element_idx: int) -> bool:
+        hash_name = str(element_idx)
+        name = store.node_name(element_idx)
+        is_clickable = store.clickable[element_idx]
+
+        if name in ("TD", "TH") and not is_clickable:
+            name_lower = name.lower()
+            inner_text = store.subtree_text(element_idx)
+            meta = f"<{name_lower} id={hash_name}>" + inner_text + f"</{name_lower}>"
+            entry = node_entry(element_idx, name_lower, meta, inner_text)
+            entries.append((hash_name, element_idx, False, entry))
+            return False
+
+        elif name == "TD" and is_clickable:
+            name_lower = "button"
+            aria_label = store.extract_attributes(element_idx, ["aria-label"]).get(
+                "aria-label"
+            )
+            inner_text = aria_label if aria_label else store.subtree_text(element_idx)
+            meta = f"<{name_lower} id={hash_name}>" + inner_text + f"</{name_lower}>"
+            entry = node_entry(element_idx, name_lower, meta, inner_text)
+            entries.append((hash_name, element_idx, False, entry))
+            return False
+
+        elif name in ("TR", "TABLE"):
+            name_lower = name.lower()
+            entry = node_entry(element_idx, name_lower, f"<{name_lower}>")
+            entries.append((hash_name, element_idx, False, entry))
+
+        return True
+
+    def close_table_node(element_idx: int) -> None:
+        if (name := store.node_name(element_idx)) in ("TR", "TABLE"):
+            name_lower = name.lower()
+            entry = node_entry(element_idx, name_lower, f"</{name_lower}>")
+            entries.append(("_" + str(element_idx) + "_", element_idx, False, entry))
+
+    def collapse_node(element_idx: int) -> Optional[dict]:
+        # returns None when the node is not collapsed and its children still
+        # need to be analysed
+        hash_name = str(element_idx)
+        name = store.node_name(element_idx)
+
+        if name in ("BUTTON", "A"):
+            name_lower = name.lower() if name == "BUTTON" else "link"
+            inner_text = store.subtree_text(element_idx, sep=" | ")
+            if not inner_text:
+                attrs = store.extract_attributes(
+                    element_idx, ["aria-label", "aria-labelledby"]
+                )
+                if it := attrs.get("aria-labelledby"):
+                    inner_text = it
+                else:
+                    inner_text = attrs.get("aria-label", "")
+
+            meta = (
+                f"<{name_lower} id={hash_name}>"
+                + ("(" if name_lower == "button" else "")
+                + inner_text
+                + (")" if name_lower == "button" else "")
+                + f"</{name_lower}>"
+            )
+            entry = node_entry(element_idx, name_lower, meta, inner_text)
+            # where a link leads, as written in the page (may be relative)
+            if name == "A" and (
+                href := store.extract_attributes(element_idx, ["href"]).get("href")
+            ):
+                entry["href"] = href
+            return entry
+
+        elif name == "INPUT":
+            attrs = store.extract_attributes(
+                element_idx, ["type", "aria-label", "placeholder"]
+            )
+            if attrs.get("type", "") in ("text", "search", ""):
+                inner_text = attrs.get("aria-label", "")
+                if not inner_text:
+                    inner_text = attrs.get("placeholder", "")
+                # check if there initial value typed in the input bar
+                # input_value = attrs.get("value")  # else None
+                meta = (
+                    f"<input id={hash_name} alt="
+                    + inner_text
+                    # + (f" value={input_value}" if input_value else "")
+                    + "></input>"
+                )
+                return node_entry(element_idx, "input", meta, inner_text)
+            elif attrs.get("type") == "submit":
+                inner_text = attrs.get("aria-label", "")
+                meta = f"<button id={hash_name}>(" + inner_text + ")</button>"
+                return node_entry(element_idx, "button", meta, inner_text)
+        elif name == "IMG":
+            inner_text = store.extract_attributes(element_idx, ["alt"]).get("alt", "")
+            meta = f"<img id={hash_name} alt=" + inner_text + "/>"
+            return node_entry(element_idx, "img", meta, inner_text)
+        elif name == "#text":
+            inner_text = store.node_value(element_idx).strip().replace("\n", " ")
+            meta = f"<text id={hash_name}>" + inner_text + "</text>"
+            return node_entry(element_idx, "text", meta, inner_text)
+        elif name == "DIV" and store.clickable[element_idx]:
+            inner_text = store.subtree_text(element_idx, sep=" | ")
+            meta = f"<button id={hash_name}>(" + inner_text + ")</button>"
+            return node_entry(element_idx, "button", meta, inner_text)
+
+        return None
+
+    def analyse_node(element_idx: int) -> bool:
+        # returns whether the children of `element_idx` still need analysing
+        hash_name = str(element_idx)
+        name = store.node_name(element_idx)
+        is_clickable = store.clickable[element_idx]
+
+        collapsable = {"BUTTON", "A", "INPUT", "IMG", "#text"}
+        # "TABLE", "SELECT"
+        if name in ("DIV") and not is_clickable:
+            entry = {"node_type": "sep", "meta": f"<{name.lower()}>"}
+            entries.append((hash_name, -1, False, entry))
+
+        elif name in collapsable or (
+            name == "DIV"
+            and is_clickable
+            and not store.is_ancestor_of(
+                element_idx,
+                ["BUTTON", "A", "INPUT", "IMG", "TABLE", "SELECT"],
+            )
+        ):
+            node = collapse_node(element_idx)
+            if node is not None:
+                # x_mid and y_mid are checked once the viewport is known
+                _fileds = [
+                    "node_type",
+                    "meta",
+                    "inner_text",
+                    "name",
+                ]
+                if all([node.get(f) for f in _fileds]):
+                    if node["inner_text"].replace("·", " ").strip() != "":
+                        entries.append((hash_name, element_idx, True, node))
+                return False
+
+        elif name == "TABLE":
+            store.walk(element_idx, collapse_table_node, close_table_node)
+            return False
+
+        elif name == "SELECT":
+            store.walk(element_idx, collapse_select_node, close_select_node)
+            return False
+
+        return True
+
+    if len(store):
+        store.walk(0, analyse_node)
+
+    return entries
+
+
+def build_buffer(
+    store: NodeStore, viewport: Dict, limit_to_viewport: bool = True
+) -> Dict[str, dict]:
+    # the collapsed entries only depend on the snapshot, so a store that is
+    # parsed again (e.g. after scrolling) just redoes the viewport culling
+    if store.entries is None:
+        store.entries = collapse_tree(store)
+
+    device_pixel_ratio = viewport["device_pixel_ratio"]
+    window_left_bound = viewport["page_x_offset"]
+    window_upper_bound = viewport["page_y_offset"]
+    window_right_bound = window_left_bound + viewport["width"]
+    window_lower_bound = window_upper_bound + viewport["height"]
+    # how far the page scrolled since the capture; fixed elements moved with it
+    scroll_dx = window_left_bound - store.scroll_x / device_pixel_ratio
+    scroll_dy = window_upper_bound - store.scroll_y / device_pixel_ratio
+
+    def midpoint(element_idx: int) -> Dict[str, int]:
+        if element_idx < 0 or not store.has_layout[element_idx]:
+            return {}
+
+        x = store.x[element_idx] / device_pixel_ratio
+        y = store.y[element_idx] / device_pixel_ratio
+        if store.fixed[element_idx]:
+            x += scroll_dx
+            y += scroll_dy
+        width = store.width[element_idx] / device_pixel_ratio
+        height = store.height[element_idx] / device_pixel_ratio
+
+        # check if a given node is at least partially in the viewport
+        if limit_to_viewport:
+            is_partially_in_viewport = (
+                x < window_right_bound
+                and x + width >= window_left_bound
+                and y < window_lower_bound
+                and y + height >= window_upper_bound
+            )
+
+            if not is_partially_in_viewport:
+                return {}
+
+        # the calculation of x_mid and y_mid will be incorrect if the Windows scale
+        # is set to the value other than 100%
+        return {"x_mid": int(x + (width / 2)), "y_mid": int(y + (height / 2))}
+
+    buffer = {}
+    for hash_name, element_idx, is_required, entry in store.entries:
+        position = midpoint(element_idx)
+        if is_required and not (position.get("x_mid") and position.get("y_mid")):
+            continue
+        buffer[hash_name] = dict(entry, **position)
+
+    return buffer
+
+
+def save_recording(path: str, tree: Dict, viewport: Dict, url: str = "") -> None:
+    # a recording is a captured snapshot plus the viewport metrics it was
+    # parsed with, which is all parse_snapshot needs
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"url": url, "viewport": viewport, "snapshot": tree}, f)
+
+
+def load_recording(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def replay(paths: List[str], limit_to_viewport: bool = True) -> Dict[str, float]:
+    n_nodes = 0
+    n_entries = 0
+    elapsed = 0.0
+    for path in paths:
+        recording = load_recording(path)
+        tree = recording["snapshot"]
+        st = time.perf_counter()
+        buffer = parse_snapshot(tree, recording["viewport"], limit_to_viewport)
+        elapsed += time.perf_counter() - st
+        n_nodes += len(tree["documents"][0]["nodes"]["parentIndex"])
+        n_entries += len(buffer)
+    return {
+        "snapshots": len(paths),
+        "nodes": n_nodes,
+        "entries": n_entries,
+        "seconds": elapsed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="replay recorded DOM snapshots through the parser"
+    )
+    parser.add_argument("directory", help="directory with *.json recordings")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--full-page",
+        action="store_true",
+        help="parse the whole page instead of the recorded viewport",
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    paths = sorted(
+        os.path.join(args.directory, name)
+        for name in os.listdir(args.directory)
+        if name.endswith(".json")
+    )
+    if not paths:
+        raise SystemExit(f"no recordings found in {args.directory}")
+    limit_to_viewport = not args.full_page
+
+    st = time.perf_counter()
+    if args.workers > 1:
+        from multiprocessing import Pool
+
+        chunks = [paths[i :: args.workers] for i in range(args.workers)]
+        with Pool(args.workers) as pool:
+            results = pool.starmap(
+                replay,
+                [(chunk, limit_to_viewport) for chunk in chunks * args.repeat],
+            )
+    else:
+        results = [replay(paths, limit_to_viewport) for _ in range(args.repeat)]
+    wall = time.perf_counter() - st
+
+    total = {k: sum(r[k] for r in results) for k in results[0]}
+    print(f" > parsed {total['snapshots']} snapshots, {total['nodes']} nodes")
+    print(f" > parse time: {total['seconds'] * 1000.0:.2f} ms")
+    print(f" > throughput: {total['snapshots'] / wall:.2f} snapshots/s")
+    print(f" > throughput: {total['nodes'] / wall:.0f} nodes/s")
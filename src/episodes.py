@@ -0,0 +1,117 @@
+from typing import Callable, Dict, Iterator, Optional
+import json
+import lzma
+import os
+import time
+import weakref
+
+# an episode archive is lzma-compressed JSON lines: an "episode" header, then
+# "snapshot" records (a captured DOMSnapshot with the viewport metrics and url
+# it was taken at), "step" records (the viewport metrics of every parse and the
+# snapshot its store came from) and "completion" records (every prompt and the
+# instruction or answer the model gave), in the order they happened. steps on
+# an unchanged page point at an earlier snapshot instead of repeating it
+
+FORMAT = 1
+
+
+class EpisodeRecorder:
+    # saves an agent episode for offline replay; attach it with
+    # `run_agent(..., recorder=...)`, which also hands it to the crawler
+    def __init__(self, path: str, objective: str = "", start_url: str = "") -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = lzma.open(path, "wt", encoding="utf-8")
+        # NodeStore -> id of the snapshot it was built from
+        self.snapshot_ids = weakref.WeakKeyDictionary()
+        self.snapshots = 0
+        self.steps = 0
+        # prompt of the last model call
+        self.prompt = None
+        self.write(
+            {
+                "type": "episode",
+                "format": FORMAT,
+                "objective": objective,
+                "start_url": start_url,
+                "created": time.time(),
+            }
+        )
+
+    def write(self, record: Dict) -> None:
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def add_snapshot(self, store, tree: Dict, viewport: Dict, url: str) -> None:
+        self.snapshot_ids[store] = self.snapshots
+        self.write(
+            {
+                "type": "snapshot",
+                "id": self.snapshots,
+                "url": url,
+                "viewport": viewport,
+                "tree": tree,
+            }
+        )
+        self.snapshots += 1
+
+    def step(self, crawler) -> None:
+        # after `crawler.parse()`
+        self.write(
+            {
+                "type": "step",
+                "step": self.steps,
+                "url": crawler.page.url,
+                "title": crawler.page.title(),
+                "viewport": crawler.viewport,
+                "snapshot": self.snapshot_ids.get(crawler.store),
+            }
+        )
+        self.steps += 1
+
+    def wrap(self, complete: Callable) -> Callable:
+        # a complete or stream function that remembers the prompt it was called with
+        def recorded(prompt: str, **params):
+            self.prompt = prompt
+            return complete(prompt, **params)
+
+        return recorded
+
+    def completion(self, text: str, kind: str = "instruction") -> None:
+        self.write(
+            {"type": "completion", "kind": kind, "prompt": self.prompt, "text": text}
+        )
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_records(path: str) -> Iterator[Dict]:
+    with lzma.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def read_episode(path: str) -> Dict:
+    episode = {"snapshots": {}, "steps": [], "completions": []}
+    for record in read_records(path):
+        kind = record.pop("type")
+        if kind == "episode":
+            if record["format"] != FORMAT:
+                raise ValueError(f"{path}: unknown episode format {record['format']}")
+            episode.update(record)
+        elif kind == "snapshot":
+            episode["snapshots"][record["id"]] = record
+        elif kind == "step":
+            episode["steps"].append(record)
+        elif kind == "completion":
+            episode["completions"].append(record)
+    return episode
+
+
+def snapshot_of(episode: Dict, step: Dict) -> Optional[Dict]:
+    # the recorded snapshot a step was parsed from
+    if step["snapshot"] is None:
+        return None
+    return episode["snapshots"][step["snapshot"]]["tree"]
@@ -0,0 +1,351 @@
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+# completion backends behind get_gpt_* and friends. a backend turns
+# (prompt, **completion params) into the list of choices (`complete`) or a
+# stream of text chunks (`stream`), with async versions of both
+
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+# responses that are worth retrying: rate limits and server side errors
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    def __init__(self, message: str, status: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class RetryableError(LLMError):
+    def __init__(
+        self,
+        message: str,
+        status: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ) -> None:
+        super().__init__(message, status)
+        self.retry_after = retry_after
+
+
+class LatencyMetrics:
+    # per-call latencies (including retries) of a backend
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.retries = 0
+        self.errors = 0
+
+    def record(self, ms: float, retries: int, ok: bool) -> None:
+        with self.lock:
+            self.latencies.append(ms)
+            self.retries += retries
+            self.errors += not ok
+
+    def summary(self) -> Dict[str, float]:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            retries, errors = self.retries, self.errors
+        if not latencies:
+            return {"calls": 0, "retries": retries, "errors": errors}
+
+        def percentile(p: float) -> float:
+            return latencies[min(int(p * len(latencies)), len(latencies) - 1)]
+
+        return {
+            "calls": len(latencies),
+            "retries": retries,
+            "errors": errors,
+            "mean_ms": sum(latencies) / len(latencies),
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "max_ms": latencies[-1],
+        }
+
+    def report(self) -> str:
+        s = self.summary()
+        if not s["calls"]:
+            return " > llm: no calls"
+        return (
+            f" > llm: {s['calls']} calls, p50 {s['p50_ms']:.0f} ms, "
+            f"p95 {s['p95_ms']:.0f} ms, {s['retries']} retries, {s['errors']} errors"
+        )
+
+
+class HTTPBackend:
+    # talks to an OpenAI-compatible /completions endpoint, the OpenAI API or a
+    # self-hosted model server. connections are kept alive in one pool per
+    # backend, at most `concurrency` calls are in flight, and rate limits,
+    # server errors and timeouts are retried with exponential backoff (or the
+    # server's Retry-After)
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None,
+        concurrency: int = 8,
+        timeout: float = 60.0,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        max_backoff: float = 30.0,
+    ) -> None:
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        self.api_base = (
+            api_base or os.environ.get("OPENAI_API_BASE") or DEFAULT_API_BASE
+        ).rstrip("/")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.metrics = LatencyMetrics()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.slots = threading.BoundedSemaphore(concurrency)
+
+        # the aiohttp session and semaphore belong to the loop they were made on
+        self.asession = None
+        self.aslots = None
+        self.aloop = None
+
+    @property
+    def url(self) -> str:
+        return self.api_base + "/completions"
+
+    def headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        delay = min(self.backoff * 2**attempt, self.max_backoff)
+        return delay * (0.5 + random.random() / 2)
+
+    def check(self, status: int, body: str, headers) -> None:
+        if status < 400:
+            return
+        message = f"completion request failed with {status}: {body[:200]}"
+        if status in RETRY_STATUSES:
+            retry_after = headers.get("Retry-After")
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None
+            raise RetryableError(message, status, retry_after)
+        raise LLMError(message, status)
+
+    def post(self, payload: Dict, stream: bool = False):
+        # one request with retries; returns the response, which the caller
+        # closes, and the number of retries it took
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(
+                    self.url,
+                    headers=self.headers(),
+                    data=json.dumps(payload),
+                    timeout=self.timeout,
+                    stream=stream,
+                )
+                if response.status_code >= 400:
+                    body = response.text
+                    response.close()
+                    self.check(response.status_code, body, response.headers)
+                return response, attempt
+            except (RetryableError, requests.ConnectionError, requests.Timeout) as er:
+                if attempt == self.max_retries:
+                    raise LLMError(f"giving up after {attempt} retries: {er}")
+                time.sleep(self.delay(attempt, getattr(er, "retry_after", None)))
+
+    def complete(self, prompt: str, **params) -> List[str]:
+        st = time.monotonic()
+        retries, ok = 0, False
+        with self.slots:
+            try:
+                response, retries = self.post(dict(params, prompt=prompt))
+                with response:
+                    choices = [c["text"] for c in response.json()["choices"]]
+                ok = True
+                return choices
+            finally:
+                self.metrics.record((time.monotonic() - st) * 1000.0, retries, ok)
+
+    def stream(self, prompt: str, **params) -> Iterator[str]:
+        # closing the generator closes the connection, which stops generation
+        st = time.monotonic()
+        retries, ok = 0, False
+        with self.slots:
+            try:
+                response, retries = self.post(
+                    dict(params, prompt=prompt, stream=True), stream=True
+                )
+                with response:
+                    for line in response.iter_lines():
+                        event = parse_event(line.decode("utf-8"))
+                        if event is DONE:
+                            break
+                        if event:
+                            yield event
+                ok = True
+            except GeneratorExit:
+                # cut off by the caller
+                ok = True
+                raise
+            finally:
+                self.metrics.record((time.monotonic() - st) * 1000.0, retries, ok)
+
+    async def async_state(self):
+        loop = asyncio.get_running_loop()
+        if self.aloop is not loop:
+            stale, stale_loop = self.asession, self.aloop
+            self.asession = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self.aslots = asyncio.Semaphore(self.concurrency)
+            self.aloop = loop
+            # a session only works on the loop it was opened on (e.g. that of
+            # an earlier asyncio.run); close it rather than leak its connector
+            if stale is not None:
+                if stale_loop.is_closed():
+                    await stale.close()
+                else:
+                    asyncio.run_coroutine_threadsafe(stale.close(), stale_loop)
+        return self.asession, self.aslots
+
+    async def apost(self, payload: Dict):
+        # see `post`
+        session, _ = await self.async_state()
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await session.post(
+                    self.url, headers=self.headers(), data=json.dumps(payload)
+                )
+                if response.status >= 400:
+                    body = await response.text()
+                    response.release()
+                    self.check(response.status, body, response.headers)
+                return response, attempt
+            except (RetryableError, aiohttp.ClientError, asyncio.TimeoutError) as er:
+                if attempt == self.max_retries:
+                    raise LLMError(f"giving up after {attempt} retries: {er}")
+                await asyncio.sleep(
+                    self.delay(attempt, getattr(er, "retry_after", None))
+                )
+
+    async def acomplete(self, prompt: str, **params) -> List[str]:
+        _, slots = await self.async_state()
+        st = time.monotonic()
+        retries, ok = 0, False
+        async with slots:
+            try:
+                response, retries = await self.apost(dict(params, prompt=prompt))
+                async with response:
+                    choices = [c["text"] for c in (await response.json())["choices"]]
+                ok = True
+                return choices
+            finally:
+                self.metrics.record((time.monotonic() - st) * 1000.0, retries, ok)
+
+    async def astream(self, prompt: str, **params) -> AsyncIterator[str]:
+        _, slots = await self.async_state()
+        st = time.monotonic()
+        retries, ok = 0, False
+        async with slots:
+            try:
+                response, retries = await self.apost(
+                    dict(params, prompt=prompt, stream=True)
+                )
+                async with response:
+                    async for line in response.content:
+                        event = parse_event(line.decode("utf-8"))
+                        if event is DONE:
+                            break
+                        if event:
+                            yield event
+                ok = True
+            except GeneratorExit:
+                # cut off by the caller
+                ok = True
+                raise
+            finally:
+                self.metrics.record((time.monotonic() - st) * 1000.0, retries, ok)
+
+    def close(self) -> None:
+        self.session.close()
+
+    async def aclose(self) -> None:
+        if self.asession is not None:
+            await self.asession.close()
+            self.asession = None
+            self.aloop = None
+
+
+# marks the end of a streamed completion
+DONE = object()
+TOKEN = re.compile(r"\s*\S+|\s+")
+
+
+def parse_event(line: str):
+    # text of one server-sent event line of a streamed completion, None for
+    # lines without data and DONE at the end
+    line = line.strip()
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:") :].strip()
+    if data == "[DONE]":
+        return DONE
+    return json.loads(data)["choices"][0]["text"]
+
+
+class StubBackend:
+    # answers locally with `respond(prompt, params)` after `latency` seconds,
+    # for benchmarks that should not touch the network (see bench_server.py)
+    def __init__(
+        self,
+        respond: Callable[[str, Dict], str] = lambda prompt, params: "",
+        latency: float = 0.0,
+    ) -> None:
+        self.respond = respond
+        self.latency = latency
+        self.metrics = LatencyMetrics()
+
+    def complete(self, prompt: str, **params) -> List[str]:
+        st = time.monotonic()
+        time.sleep(self.latency)
+        choices = [self.respond(prompt, params) for _ in range(params.get("n", 1))]
+        self.metrics.record((time.monotonic() - st) * 1000.0, 0, True)
+        return choices
+
+    def stream(self, prompt: str, **params) -> Iterator[str]:
+        yield from TOKEN.findall(self.complete(prompt, **params)[0])
+
+    async def acomplete(self, prompt: str, **params) -> List[str]:
+        st = time.monotonic()
+        await asyncio.sleep(self.latency)
+        choices = [self.respond(prompt, params) for _ in range(params.get("n", 1))]
+        self.metrics.record((time.monotonic() - st) * 1000.0, 0, True)
+        return choices
+
+    async def astream(self, prompt: str, **params) -> AsyncIterator[str]:
+        for chunk in TOKEN.findall((await self.acomplete(prompt, **params))[0]):
+            yield chunk
+
+    def close(self) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        pass
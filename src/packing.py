@@ -0,0 +1,242 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+import math
+
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to ~4 characters per token
+    tiktoken = None
+
+MODEL = "text-davinci-003"
+# prompt + completion tokens the model accepts
+CONTEXT_SIZES = {"text-davinci-003": 4097}
+
+# share of the prompt budget (after the template) that each section may use at
+# most; whatever a section leaves unused goes to the browser content
+SECTION_SHARES = {"objective": 0.1, "quotes": 0.2, "history": 0.15, "passages": 0.2}
+
+INTERACTIVE_TYPES = {"link", "button", "input", "select"}
+CONSENT_WORDS = ("cookie", "consent", "accept", "agree", "allow all", "reject all")
+
+# a serialization with more characters than this per token of budget is taken
+# not to fit (english text runs at about 4), see pack_buffer
+MAX_CHARS_PER_TOKEN = 8
+
+# element priorities, lower is packed first
+CONSENT, INTERACTIVE, CONTENT = range(3)
+
+_encoders = {}
+
+
+def get_encoder(model: str = MODEL):
+    if tiktoken is None:
+        return None
+    if model not in _encoders:
+        _encoders[model] = tiktoken.encoding_for_model(model)
+    return _encoders[model]
+
+
+def count_tokens(text: str, model: str = MODEL) -> int:
+    if encoder := get_encoder(model):
+        return len(encoder.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = MODEL) -> str:
+    if max_tokens <= 0:
+        return ""
+    if encoder := get_encoder(model):
+        tokens = encoder.encode(text)
+        return text if len(tokens) <= max_tokens else encoder.decode(tokens[:max_tokens])
+    return text[: max_tokens * 4]
+
+
+def iter_buffer_fragments(buffer: Dict) -> Iterator[str]:
+    # yields the string representation of buffer piece by piece in one pass
+    # consecutive text nodes (also across other elements, up to the next sep)
+    # are merged into a single <text> element; a sep closing such a run adds
+    # a blank line
+    text = []
+    in_text_run = False
+
+    for node in buffer.values():
+        node_type = node["node_type"]
+        if node_type == "text":
+            in_text_run = True
+            text.append(node["inner_text"])
+        elif node_type == "sep":
+            if in_text_run:
+                if text:
+                    yield f"\n<text>{' '.join(text)}</text>"
+                    text = []
+                yield "\n"
+                in_text_run = False
+        else:
+            if text:
+                yield f"\n<text>{' '.join(text)}</text>"
+                text = []
+            yield "\n" + node["meta"]
+
+    if text:
+        yield f"\n<text>{' '.join(text)}</text>"
+
+
+def buffer2string(buffer: Dict, budget: Optional[int] = None) -> str:
+    # create string representation of buffer
+    # with a `budget` (in characters) serialization stops as soon as it is
+    # reached and the output is cut to it
+    out = []
+    size = 0
+
+    for fragment in iter_buffer_fragments(buffer):
+        if not out:
+            fragment = fragment.lstrip()
+            if not fragment:
+                continue
+        out.append(fragment)
+        size += len(fragment)
+        if budget is not None and size >= budget:
+            return "".join(out)[:budget]
+    return "".join(out).rstrip()
+
+
+def viewport_centre(viewport: Optional[Dict]) -> Optional[float]:
+    if not viewport:
+        return None
+    return viewport["page_y_offset"] + viewport["height"] / 2
+
+
+def element_priority(node: Dict) -> int:
+    text = (node.get("inner_text") or node["meta"]).lower()
+    if any(word in text for word in CONSENT_WORDS) and node["node_type"] != "text":
+        return CONSENT
+    if node["node_type"] in INTERACTIVE_TYPES:
+        return INTERACTIVE
+    return CONTENT
+
+
+def buffer_units(buffer: Dict) -> Tuple[List[Tuple[int, List[str]]], set]:
+    # groups the buffer into units that are kept or dropped as a whole: a select
+    # with its options, a table row with its cells, or a single element. seps
+    # and table tags are structural and returned separately. units are
+    # (position of the first entry, keys)
+    units = []
+    structural = set()
+    group = None
+    group_end = None
+
+    for position, (key, node) in enumerate(buffer.items()):
+        node_type = node["node_type"]
+        if group is not None:
+            group[1].append(key)
+            if node["meta"] == group_end:
+                units.append(group)
+                group = None
+        elif node_type == "sep" or node_type == "table":
+            structural.add(key)
+        elif node_type in ("select", "tr") and not node["meta"].startswith("</"):
+            group = (position, [key])
+            group_end = f"</{node_type}>"
+        else:
+            units.append((position, [key]))
+
+    if group is not None:
+        units.append(group)
+    return units, structural
+
+
+def pack_buffer(
+    buffer: Dict,
+    budget: int,
+    centre_y: Optional[float] = None,
+    model: str = MODEL,
+) -> str:
+    # serializes the most useful part of buffer in at most `budget` tokens:
+    # consent dialog controls first, then the other interactive controls, then
+    # text and images by their distance to the viewport centre. the packed
+    # elements keep their document order
+    if budget <= 0 or not buffer:
+        return ""
+
+    units, structural = buffer_units(buffer)
+    keys = list(buffer)
+
+    def rank(unit: Tuple[int, List[str]]) -> Tuple[int, float, int]:
+        position, unit_keys = unit
+        nodes = [buffer[k] for k in unit_keys]
+        priority = min(element_priority(node) for node in nodes)
+        y = next((n["y_mid"] for n in nodes if n.get("y_mid") is not None), None)
+        distance = abs(y - centre_y) if y is not None and centre_y is not None else math.inf
+        return (priority, distance, position)
+
+    def unit_cost(unit_keys: List[str]) -> int:
+        return count_tokens(
+            "".join(iter_buffer_fragments({k: buffer[k] for k in unit_keys})), model
+        )
+
+    def serialize(selected: set, limit: Optional[int] = None) -> str:
+        # table tags are only kept around rows that made it in
+        packed = []
+        open_tables = []
+        for key in keys:
+            node = buffer[key]
+            if node["node_type"] == "table" and key in structural:
+                if not node["meta"].startswith("</"):
+                    open_tables.append([len(packed), False])
+                elif open_tables:
+                    start, has_rows = open_tables.pop()
+                    if not has_rows:
+                        del packed[start:]
+                        continue
+                packed.append((key, node))
+            elif key in structural:
+                packed.append((key, node))
+            elif key in selected:
+                packed.append((key, node))
+                for table in open_tables:
+                    table[1] = True
+        return buffer2string(dict(packed), limit)
+
+    # the whole buffer often fits (a short page, one viewport's worth), which
+    # needs no ranking or per-unit counting. serialization stops once it is too
+    # long to fit, so on big pages the check costs little
+    limit = budget * MAX_CHARS_PER_TOKEN
+    content = serialize(set(keys), limit + 1)
+    if len(content) <= limit and count_tokens(content, model) <= budget:
+        return content
+
+    ranked = sorted(units, key=rank)
+    selected_units = []
+    selected = set()
+    remaining = budget
+    for unit in ranked:
+        cost = unit_cost(unit[1])
+        if cost <= remaining:
+            selected_units.append(unit)
+            selected.update(unit[1])
+            remaining -= cost
+
+    # unit costs are estimates (text runs merge across units), so drop the
+    # least important units until the real serialization fits
+    content = serialize(selected)
+    while selected_units and count_tokens(content, model) > budget:
+        _, unit_keys = selected_units.pop()
+        selected.difference_update(unit_keys)
+        content = serialize(selected)
+    return truncate_tokens(content, budget, model)
+
+
+def fit_recent(items: List[str], budget: int, sep: str = "\n", model: str = MODEL) -> str:
+    # keeps the most recent items that fit into `budget` tokens
+    kept = []
+    for item in reversed(items):
+        cost = count_tokens(item + sep, model)
+        if cost > budget:
+            break
+        kept.append(item)
+        budget -= cost
+    return sep.join(reversed(kept))
+
+
+def prompt_budget(max_tokens: int, model: str = MODEL) -> int:
+    # prompt tokens left once the completion is accounted for
+    return CONTEXT_SIZES.get(model, 4097) - max_tokens
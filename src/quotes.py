@@ -0,0 +1,108 @@
+from functools import lru_cache
+from typing import Dict, Iterable, List, Set, Tuple
+import re
+
+# the quotes a run memorizes, deduplicated and scored for relevance to the
+# objective. a quote is a dict with page_title, domain (the page url) and
+# extract, plus its relevance once scored
+
+WORD = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    """a about an and are as at be because but by can did do does for from had
+    has have how i in is it its not of on or so than that the their them there
+    these they this to was we were what when where which who why will with would
+    you""".split()
+)
+
+
+def words(text: str) -> List[str]:
+    return WORD.findall(text.lower())
+
+
+def shingles(text: str, k: int = 3) -> Set[Tuple[str, ...]]:
+    # the word k-grams of `text`, ignoring case and punctuation
+    w = words(text)
+    if len(w) < k:
+        return {tuple(w)} if w else set()
+    return {tuple(w[i : i + k]) for i in range(len(w) - k + 1)}
+
+
+def similarity(a: Set, b: Set) -> float:
+    # shared shingles relative to the smaller set, so a quote that is part of
+    # another one counts as a duplicate too
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+# pages repeat a small vocabulary, so whole-page indexing stems mostly the same
+# words (see search_index.py)
+@lru_cache(maxsize=2**16)
+def stem(word: str) -> str:
+    for suffix in ("ing", "ed", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[: -len(suffix)]
+    return word
+
+
+def tokens(text: str) -> List[str]:
+    # the words of `text` that carry meaning, stemmed
+    return [stem(w) for w in words(text) if w not in STOPWORDS]
+
+
+def terms(text: str) -> Set[str]:
+    return set(tokens(text))
+
+
+def relevance(objective_terms: Set[str], quote: Dict[str, str]) -> float:
+    # share of the objective's terms the quote (or its page title) mentions
+    if not objective_terms:
+        return 0.0
+    found = terms(quote["extract"]) | terms(quote.get("page_title", ""))
+    return len(objective_terms & found) / len(objective_terms)
+
+
+def rank_quotes(objective: str, quotes: Iterable[Dict]) -> List[Dict]:
+    # most relevant first; equally relevant quotes keep their order
+    objective_terms = terms(objective)
+    scored = [
+        (q["relevance"] if "relevance" in q else relevance(objective_terms, q), q)
+        for q in quotes
+    ]
+    return [q for _, q in sorted(scored, key=lambda s: -s[0])]
+
+
+class QuoteStore:
+    # replaces the plain list of quotes: iterating it gives the quotes in the
+    # order they were added. a quote whose shingles mostly appear in a stored
+    # one (`threshold`, see `similarity`) is rejected, e.g. the same passage
+    # quoted again from a mirror site
+    def __init__(self, objective: str, threshold: float = 0.8, k: int = 3) -> None:
+        self.objective_terms = terms(objective)
+        self.threshold = threshold
+        self.k = k
+        self.quotes = []
+        self.shingles = []
+        self.duplicates = 0
+
+    def add(self, page_title: str, url: str, extract: str) -> bool:
+        # False if the quote is a near-duplicate of a stored one
+        quote_shingles = shingles(extract, self.k)
+        for stored in self.shingles:
+            if similarity(quote_shingles, stored) >= self.threshold:
+                self.duplicates += 1
+                return False
+        quote = {"page_title": page_title, "domain": url, "extract": extract}
+        quote["relevance"] = relevance(self.objective_terms, quote)
+        self.quotes.append(quote)
+        self.shingles.append(quote_shingles)
+        return True
+
+    def __iter__(self):
+        return iter(self.quotes)
+
+    def __len__(self) -> int:
+        return len(self.quotes)
+
+    def __getitem__(self, i):
+        return self.quotes[i]
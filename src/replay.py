@@ -0,0 +1,185 @@
+from typing import Dict, List
+import argparse
+import time
+from crawler import VIEWPORT_METRICS_JS, Crawler
+from decoding import Decoding
+from episodes import read_episode, snapshot_of
+from packing import count_tokens
+from tracing import Tracer
+from webgpt import run_agent
+
+# drives the webgpt.py agent loop (run_agent) from an episode archive saved by
+# episodes.EpisodeRecorder, without a browser, websites or the model API. the
+# page and CDP session are stood in for by the recorded viewport metrics and
+# snapshots, and the model by the recorded completions, so the crawler's
+# parse, the prompt code and the loop itself run exactly as they would live
+
+
+class EpisodeEnd(Exception):
+    pass
+
+
+class ReplayPage:
+    def __init__(self, crawler: "ReplayCrawler") -> None:
+        self.crawler = crawler
+
+    @property
+    def url(self) -> str:
+        return self.crawler.current["url"]
+
+    def title(self) -> str:
+        return self.crawler.current["title"]
+
+    def evaluate(self, expression: str, arg=None):
+        if expression == VIEWPORT_METRICS_JS:
+            return dict(self.crawler.current["viewport"])
+        return None
+
+
+class ReplayClient:
+    def __init__(self, crawler: "ReplayCrawler") -> None:
+        self.crawler = crawler
+
+    def send(self, method: str, params=None) -> Dict:
+        tree = snapshot_of(self.crawler.episode, self.crawler.current)
+        if tree is None:
+            raise EpisodeEnd(f"step {self.crawler.index} has no recorded snapshot")
+        return tree
+
+
+class ReplayCrawler(Crawler):
+    # a Crawler whose every parse is the next recorded step; actions do nothing
+    # since the recording already knows where they led
+    def __init__(
+        self,
+        episode: Dict,
+        limit_to_viewport: bool = True,
+        incremental: bool = True,
+        page_cache_bytes: int = 256 * 2**20,
+        index_pages: bool = True,
+    ) -> None:
+        self.episode = episode
+        self.index = -1
+        super().__init__(
+            limit_to_viewport=limit_to_viewport,
+            incremental=incremental,
+            page_cache_bytes=page_cache_bytes,
+            index_pages=index_pages,
+        )
+
+    def open_browser(self) -> None:
+        # no browser: the recording stands in for the page and its CDP session
+        self.page = ReplayPage(self)
+        self.replay_client = ReplayClient(self)
+
+    @property
+    def client(self) -> ReplayClient:
+        return self.replay_client
+
+    @property
+    def current(self) -> Dict:
+        return self.episode["steps"][max(self.index, 0)]
+
+    def parse(self) -> Dict[str, dict]:
+        if self.index + 1 >= len(self.episode["steps"]):
+            raise EpisodeEnd(f"the recording ends after {self.index + 1} steps")
+        self.index += 1
+        return super().parse()
+
+    def go_to_page(self, url) -> None:
+        pass
+
+    def click(self, _id: str) -> None:
+        pass
+
+    def back(self) -> None:
+        pass
+
+    def select(self, _id: str, value: str) -> None:
+        pass
+
+    def type(self, _id: str, text: str) -> None:
+        pass
+
+    def enter(self) -> None:
+        pass
+
+    def scroll(self, direction: str) -> None:
+        pass
+
+    def settle(self, condition=None, document_id=None) -> float:
+        return 0.0
+
+    def close(self) -> None:
+        pass
+
+
+def replay_episode(path: str, **crawler_kwargs) -> Dict[str, float]:
+    # replays one archive; returns wall time, per-phase totals (ms) and token
+    # totals of the prompts this revision builds. a recording that ends before
+    # the answer (e.g. the run was stopped with Ctrl-C) gives the totals up to
+    # its end, flagged as truncated
+    episode = read_episode(path)
+    crawler = ReplayCrawler(episode, **crawler_kwargs)
+    completions = iter(episode["completions"])
+    totals = {"prompt_tokens": 0, "completion_tokens": 0, "changed_prompts": 0}
+    phases = {}
+
+    def complete(prompt: str, **params) -> List[str]:
+        recorded = next(completions, None)
+        if recorded is None:
+            raise EpisodeEnd("the recording has no more completions")
+        totals["prompt_tokens"] += count_tokens(prompt)
+        totals["completion_tokens"] += count_tokens(recorded["text"])
+        totals["changed_prompts"] += prompt != recorded["prompt"]
+        return [recorded["text"]] * params.get("n", 1)
+
+    def collect(record: Dict) -> None:
+        for name, ms in record["phases"].items():
+            phases[name] = phases.get(name, 0.0) + ms
+
+    truncated = False
+    st = time.perf_counter()
+    try:
+        run_agent(
+            crawler,
+            episode["objective"],
+            episode["start_url"],
+            complete=complete,
+            decoding=Decoding("greedy"),
+            tracer=Tracer(exporters=[collect]),
+            # the recording decides when the run ends
+            max_steps=None,
+        )
+    except EpisodeEnd as er:
+        print(f" > replay stopped early: {er}")
+        truncated = True
+    wall = time.perf_counter() - st
+    return dict(
+        totals,
+        truncated=truncated,
+        steps=crawler.index + 1,
+        recorded_steps=len(episode["steps"]),
+        wall_s=wall,
+        **{f"{name}_ms": ms for name, ms in phases.items()},
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="replay recorded agent episodes")
+    parser.add_argument("paths", nargs="+", help="episode archives (*.jsonl.xz)")
+    parser.add_argument(
+        "--full-page",
+        action="store_true",
+        help="parse the whole page instead of the recorded viewport",
+    )
+    args = parser.parse_args()
+
+    for path in args.paths:
+        result = replay_episode(path, limit_to_viewport=not args.full_page)
+        print(
+            f" > {path}: {result['steps']}/{result['recorded_steps']} steps in "
+            f"{result['wall_s'] * 1000.0:.0f} ms, {result['prompt_tokens']} prompt "
+            f"tokens, {result['changed_prompts']} prompts differ from the recording"
+            + (" (the recording ends before the answer)" if result["truncated"] else "")
+        )
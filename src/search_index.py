@@ -0,0 +1,124 @@
+from collections import Counter
+from typing import Container, Dict, List, Optional, Tuple
+import math
+from dom_parser import NodeStore
+from quotes import tokens
+
+# full-page retrieval: the text of every parsed page is split into passages
+# (the elements between two block separators) and indexed with BM25, so the
+# passages most relevant to the objective can go into the prompt even when
+# they are far outside the viewport
+
+# passages longer than this many words are split
+PASSAGE_WORDS = 80
+# closes the last passage
+SEP = ("", -1, False, {"node_type": "sep", "meta": ""})
+
+
+class BM25Index:
+    # an in-memory inverted index; documents are numbered in the order added
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.lengths = []
+        self.total_length = 0
+
+    def add(self, text: str) -> int:
+        doc = len(self.lengths)
+        counts = Counter(tokens(text))
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc] = tf
+        length = sum(counts.values())
+        self.lengths.append(length)
+        self.total_length += length
+        return doc
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        # the `k` best (doc, score) pairs; only documents sharing a term with
+        # the query score
+        n = len(self.lengths)
+        if not n:
+            return []
+        average_length = self.total_length / n or 1.0
+        scores = {}
+        k1, b = self.k1, self.b
+        for term in set(tokens(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            for doc, tf in postings.items():
+                norm = k1 * (1.0 - b + b * self.lengths[doc] / average_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (k1 + 1.0) / (tf + norm)
+        return sorted(scores.items(), key=lambda s: -s[1])[:k]
+
+
+class PageIndex:
+    # BM25 over the passages of one parsed page (a NodeStore). a passage keeps
+    # the buffer keys and entries of its elements, so it can be serialized like
+    # the page buffer; passages are numbered in document order. the index does
+    # not refer to the store, so it can be cached per store in a weak mapping
+    def __init__(self, store: NodeStore) -> None:
+        if store.entries is None:
+            raise ValueError("the store has not been collapsed yet")
+        self.index = BM25Index()
+        self.passages = []
+        # key -> vertical midpoint in device pixels, for elements with a layout
+        self.positions = {}
+
+        passage = {}
+        text = []
+        n_words = 0
+        for key, element_idx, is_required, entry in store.entries + [SEP]:
+            if entry["node_type"] == "sep" or n_words >= PASSAGE_WORDS:
+                if text:
+                    self.index.add(" ".join(text))
+                    self.passages.append(passage)
+                passage = {}
+                text = []
+                n_words = 0
+            if not is_required:
+                continue
+            passage[key] = entry
+            text.append(entry["inner_text"])
+            n_words += len(entry["inner_text"].split())
+            if store.has_layout[element_idx]:
+                self.positions[key] = (
+                    store.y[element_idx] + store.height[element_idx] / 2
+                )
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def search(self, query: str, k: int = 5) -> List[int]:
+        # numbers of the `k` passages that match `query` best, best first
+        return [doc for doc, _ in self.index.search(query, k)]
+
+    def passage_buffer(
+        self, query: str, k: int = 3, exclude: Container[str] = ()
+    ) -> Dict[str, dict]:
+        # the `k` best passages for `query` that have no key in `exclude` (e.g.
+        # the part of the page already in the prompt), in document order and
+        # separated like blocks, as a buffer for pack_buffer
+        found = []
+        for doc in self.search(query, 4 * k):
+            if not any(key in exclude for key in self.passages[doc]):
+                found.append(doc)
+                if len(found) == k:
+                    break
+        buffer = {}
+        for doc in sorted(found):
+            buffer[f"_passage{doc}"] = {"node_type": "sep", "meta": "<div>"}
+            buffer.update(self.passages[doc])
+        return buffer
+
+    def y(self, key: str, device_pixel_ratio: float = 1.0) -> Optional[float]:
+        # the vertical midpoint of an element in CSS pixels of the page
+        if (y := self.positions.get(key)) is None:
+            return None
+        return y / device_pixel_ratio
@@ -0,0 +1,288 @@
+from collections import Counter
+from typing import List, Optional
+import argparse
+import asyncio
+import sys
+import time
+from playwright.async_api import async_playwright
+from async_crawler import AsyncCrawler, launch_browser
+from crawler import SETTLE_CONDITIONS
+from completion_cache import CompletionCache
+from state_store import StateStore
+from tracing import NO_TRACER, Tracer
+from decoding import STRATEGIES, Decoding
+from async_webgpt import Complete, Stream, acomplete, astream, run_agent
+from llm import HTTPBackend
+from webgpt import get_backend, instruction_decoding, set_backend, step_limit
+
+NO_BLOCKING = {"block_resource_types": (), "block_domains": ()}
+
+
+class AgentServer:
+    # one long-lived browser shared by `concurrency` agent loops. every objective
+    # runs in its own browser context, so cookies, pages, the page buffer,
+    # quotes and command history never leak between questions
+    def __init__(
+        self,
+        concurrency: int = 4,
+        start_url: str = "https://www.google.com/",
+        complete: Complete = acomplete,
+        decoding: Decoding = instruction_decoding,
+        stream: Optional[Stream] = None,
+        headless: bool = True,
+        settle_condition: str = "dom-quiet",
+        settle_timeout: float = 4.0,
+        viewport_height: int = 750,
+        prefetch: int = 3,
+        block_resources: bool = True,
+        state_store: Optional[StateStore] = None,
+        tracer: Tracer = NO_TRACER,
+        budget: Optional[int] = None,
+        max_steps: Optional[int] = step_limit,
+        timeout: Optional[float] = 600.0,
+    ) -> None:
+        self.concurrency = concurrency
+        self.start_url = start_url
+        self.complete = complete
+        self.decoding = decoding
+        self.stream = stream
+        self.headless = headless
+        self.settle_condition = settle_condition
+        self.settle_timeout = settle_timeout
+        self.viewport_height = viewport_height
+        self.prefetch = prefetch
+        self.block_resources = block_resources
+        # shared by all agents: consent given by one is reused by the others,
+        # and so are all other persistent cookies and localStorage (e.g. a
+        # site's preferences or logins); leave it out to isolate questions
+        self.state_store = state_store
+        self.tracer = tracer
+        # prompt tokens per instruction (None: webgpt.instruction_budget)
+        self.budget = budget
+        # an objective answers after max_steps steps and fails after timeout
+        # seconds (None: no limit), so a model that never answers cannot hold
+        # a worker forever
+        self.max_steps = max_steps
+        self.timeout = timeout
+
+        self.playwright = None
+        self.browser = None
+        self.queue = asyncio.Queue()
+        self.workers = []
+        self.completed = 0
+        self.failed = 0
+        self.started_at = None
+        # request counts of every finished crawler (see RequestBlocker.summary)
+        self.requests = Counter()
+
+    async def start(self) -> None:
+        self.playwright = await async_playwright().start()
+        self.browser = await launch_browser(self.playwright, self.headless)
+        self.started_at = time.monotonic()
+        self.workers = [
+            asyncio.create_task(self.worker(i)) for i in range(self.concurrency)
+        ]
+
+    async def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        await self.browser.close()
+        await self.playwright.stop()
+
+    def submit(self, objective: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((objective, future))
+        return future
+
+    async def worker(self, worker_id: int) -> None:
+        while True:
+            objective, future = await self.queue.get()
+            crawler = None
+            try:
+                crawler = await AsyncCrawler.create(
+                    browser=self.browser,
+                    viewport_height=self.viewport_height,
+                    settle_condition=self.settle_condition,
+                    settle_timeout=self.settle_timeout,
+                    prefetch=self.prefetch,
+                    state_store=self.state_store,
+                    **({} if self.block_resources else NO_BLOCKING),
+                )
+                answer = await asyncio.wait_for(
+                    run_agent(
+                        crawler,
+                        objective,
+                        start_url=self.start_url,
+                        complete=self.complete,
+                        decoding=self.decoding,
+                        stream=self.stream,
+                        tracer=self.tracer,
+                        budget=self.budget,
+                        max_steps=self.max_steps,
+                    ),
+                    self.timeout,
+                )
+                self.completed += 1
+                future.set_result(answer)
+            except Exception as er:
+                if isinstance(er, asyncio.TimeoutError):
+                    er = TimeoutError(f"no answer after {self.timeout:.0f} s")
+                print(f" > worker {worker_id} failed on `{objective}`: {er}")
+                self.failed += 1
+                future.set_exception(er)
+            finally:
+                if crawler is not None:
+                    self.requests.update(crawler.blocker.summary())
+                    await crawler.close()
+                self.queue.task_done()
+
+    def questions_per_minute(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.completed / elapsed * 60.0 if elapsed > 0 else 0.0
+
+    async def run(self, objectives: List[str]) -> List[Optional[str]]:
+        futures = [self.submit(objective) for objective in objectives]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        return [None if isinstance(r, Exception) else r for r in results]
+
+
+async def main(args) -> None:
+    if args.objectives:
+        with open(args.objectives) as f:
+            objectives = [line.strip() for line in f if line.strip()]
+    else:
+        objectives = [line.strip() for line in sys.stdin if line.strip()]
+
+    if args.api_base:
+        set_backend(
+            HTTPBackend(api_base=args.api_base, concurrency=args.llm_concurrency)
+        )
+    elif args.llm_concurrency:
+        set_backend(HTTPBackend(concurrency=args.llm_concurrency))
+
+    complete = acomplete
+    stream = None if args.no_stream else astream
+    cache = None
+    if args.cache:
+        cache = CompletionCache(args.cache, cache_sampled=args.cache_sampled)
+        complete = cache.wrap_async(acomplete)
+        stream = None
+
+    server = AgentServer(
+        concurrency=args.concurrency,
+        complete=complete,
+        decoding=Decoding(args.decoding, args.samples),
+        stream=stream,
+        start_url=args.start_url,
+        headless=not args.headed,
+        settle_condition=args.settle,
+        settle_timeout=args.settle_timeout,
+        prefetch=args.prefetch,
+        block_resources=not args.no_block,
+        state_store=StateStore(args.state) if args.state else None,
+        tracer=Tracer(args.trace),
+        budget=args.budget,
+        max_steps=args.max_steps or None,
+        timeout=args.timeout or None,
+    )
+    await server.start()
+    try:
+        answers = await server.run(objectives)
+    finally:
+        await server.stop()
+        server.tracer.close()
+
+    for objective, answer in zip(objectives, answers):
+        print(f"\nQUESTION: {objective}\nANSWER:\n{answer}\n")
+    print(
+        f" > answered {server.completed}/{len(objectives)} questions "
+        f"({server.failed} failed) at {server.questions_per_minute():.2f} questions/min"
+    )
+    print(
+        f" > blocked {server.requests['blocked']}/{server.requests['requests']} "
+        f"requests, loaded {server.requests['loaded_bytes'] / 2**20:.1f} MB"
+    )
+    if cache is not None:
+        print(
+            f" > completion cache: {cache.hits} hits, {cache.misses} misses "
+            f"({cache.hit_rate():.0%})"
+        )
+        cache.close()
+    print(get_backend().metrics.report())
+    await get_backend().aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="answer a batch of questions with agents sharing one browser"
+    )
+    parser.add_argument(
+        "--objectives", help="file with one question per line (default: stdin)"
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--start-url", default="https://www.google.com/")
+    parser.add_argument("--headed", action="store_true")
+    parser.add_argument(
+        "--settle", default="dom-quiet", choices=SETTLE_CONDITIONS,
+        help="what to wait for after each action",
+    )
+    parser.add_argument(
+        "--settle-timeout", type=float, default=4.0,
+        help="upper bound (seconds) of every settle wait",
+    )
+    parser.add_argument(
+        "--decoding", default="greedy", choices=STRATEGIES,
+        help="how navigation commands are decoded",
+    )
+    parser.add_argument(
+        "--samples", type=int, default=3, help="samples for best_of and vote"
+    )
+    parser.add_argument(
+        "--budget", type=int,
+        help="prompt tokens per navigation step (default: webgpt.instruction_budget)",
+    )
+    parser.add_argument(
+        "--max-steps", type=int, default=step_limit,
+        help="steps after which an agent answers with its quotes (0: no limit)",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=600.0,
+        help="seconds after which a question fails (0: no limit)",
+    )
+    parser.add_argument(
+        "--prefetch", type=int, default=3,
+        help="result links opened in the background on results pages (0: off)",
+    )
+    parser.add_argument(
+        "--no-block",
+        action="store_true",
+        help="load images, fonts, media, ads and trackers too",
+    )
+    parser.add_argument(
+        "--state",
+        help="SQLite file to keep cookies and localStorage in across runs",
+    )
+    parser.add_argument(
+        "--trace",
+        help="JSONL file to write a record per agent step to (see tracing.py)",
+    )
+    parser.add_argument(
+        "--api-base",
+        help="OpenAI-compatible API base, e.g. a self-hosted model server",
+    )
+    parser.add_argument(
+        "--llm-concurrency", type=int, help="completion requests in flight at most"
+    )
+    parser.add_argument(
+        "--no-stream",
+        action="store_true",
+        help="wait for whole instructions instead of streaming the first line",
+    )
+    parser.add_argument("--cache", help="SQLite file to cache completions in")
+    parser.add_argument(
+        "--cache-sampled",
+        action="store_true",
+        help="also cache completions sampled with temperature > 0",
+    )
+    asyncio.run(main(parser.parse_args()))
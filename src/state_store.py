@@ -0,0 +1,137 @@
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# second-level labels under which sites register a third label (example.co.uk)
+SECOND_LEVEL = {"ac", "co", "com", "edu", "gov", "net", "org"}
+
+
+def site_of(host: str) -> str:
+    # a rough registrable domain of `host`, so www.google.com, consent.google.com
+    # and .google.com share one entry
+    host = host.lower().strip(".")
+    if host.replace(".", "").isdigit() or "." not in host:
+        return host
+    labels = host.split(".")
+    if len(labels) > 2 and labels[-2] in SECOND_LEVEL and len(labels[-1]) == 2:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def split_state(state: Dict) -> Dict[str, Dict]:
+    # splits a playwright storage state (cookies and localStorage by origin)
+    # into one storage state per site
+    sites = {}
+
+    def site_state(host: str) -> Dict:
+        return sites.setdefault(site_of(host), {"cookies": [], "origins": []})
+
+    for cookie in state.get("cookies", []):
+        site_state(cookie["domain"])["cookies"].append(cookie)
+    for origin in state.get("origins", []):
+        host = urlparse(origin["origin"]).hostname or ""
+        site_state(host)["origins"].append(origin)
+    return sites
+
+
+def live_cookies(cookies: Iterable[Dict], now: float) -> list:
+    # unexpired persistent cookies. session cookies (expires -1) end with the
+    # browser context, so they are neither saved nor restored into later runs
+    return [c for c in cookies if c.get("expires", -1) > now]
+
+
+class StateStore:
+    # browser storage state (cookies and localStorage) of every site visited,
+    # kept across runs so consent banners answered once stay answered. entries
+    # are saved per site, older than `ttl` seconds they are dropped, sites
+    # whose state is larger than `max_site_bytes` are not saved, and only the
+    # `max_sites` most recently saved sites are kept. without `path` the store
+    # lives in memory. everything persistent is kept, not just consent: a store
+    # shared by several crawlers (see server.py) shares their cookies too
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: Optional[float] = 30 * 24 * 3600,
+        max_site_bytes: int = 256 * 2**10,
+        max_sites: int = 500,
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_site_bytes = max_site_bytes
+        self.max_sites = max_sites
+        self.lock = threading.Lock()
+        self.oversized = 0
+
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS states ("
+            "site TEXT PRIMARY KEY, state TEXT, saved REAL)"
+        )
+        self.db.commit()
+
+    def save(self, state: Dict) -> int:
+        # stores the storage state of a context, e.g. after a consent click;
+        # returns the number of sites saved
+        now = time.time()
+        saved = 0
+        with self.lock:
+            for site, site_state in split_state(state).items():
+                site_state["cookies"] = live_cookies(site_state["cookies"], now)
+                if not site_state["cookies"] and not site_state["origins"]:
+                    continue
+                text = json.dumps(site_state)
+                if len(text) > self.max_site_bytes:
+                    self.oversized += 1
+                    continue
+                self.db.execute(
+                    "INSERT OR REPLACE INTO states VALUES (?, ?, ?)", (site, text, now)
+                )
+                saved += 1
+            self.evict(now)
+            self.db.commit()
+        return saved
+
+    def load(self, sites: Optional[Iterable[str]] = None) -> Dict:
+        # storage state to create a context with, for `sites` or all of them
+        now = time.time()
+        state = {"cookies": [], "origins": []}
+        with self.lock:
+            self.evict(now)
+            rows = self.db.execute("SELECT site, state FROM states").fetchall()
+        wanted = None if sites is None else {site_of(s) for s in sites}
+        for site, text in rows:
+            if wanted is not None and site not in wanted:
+                continue
+            site_state = json.loads(text)
+            state["cookies"] += live_cookies(site_state["cookies"], now)
+            state["origins"] += site_state["origins"]
+        return state
+
+    def evict(self, now: float) -> None:
+        if self.ttl is not None:
+            self.db.execute("DELETE FROM states WHERE saved < ?", (now - self.ttl,))
+        self.db.execute(
+            "DELETE FROM states WHERE site NOT IN ("
+            "SELECT site FROM states ORDER BY saved DESC LIMIT ?)",
+            (self.max_sites,),
+        )
+
+    def sites(self) -> list:
+        with self.lock:
+            return [r[0] for r in self.db.execute("SELECT site FROM states")]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.db.execute("DELETE FROM states")
+            self.db.commit()
+
+    def close(self) -> None:
+        if self.db is not None:
+            self.db.close()
+            self.db = None
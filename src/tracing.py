@@ -0,0 +1,223 @@
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from logging.handlers import RotatingFileHandler
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlparse
+import argparse
+import json
+import logging
+import os
+import time
+
+# one record per agent step: the url it started on, the duration of each
+# phase (parser phases, prompt serialization, model call, action, settle) in
+# ms, prompt and completion tokens and the command issued. phases do not
+# overlap: `action` excludes the settle wait after it. records go to a
+# rotating JSONL file and to any exporters, e.g. a metrics client
+
+Exporter = Callable[[Dict], None]
+
+
+class Step:
+    enabled = True
+
+    def __init__(self, tracer: "Tracer", index: int, url: str) -> None:
+        self.tracer = tracer
+        self.st = time.monotonic()
+        self.record = {
+            "ts": time.time(),
+            "step": index,
+            "url": url,
+            "domain": urlparse(url).hostname or "",
+            "phases": {},
+        }
+
+    def __enter__(self) -> "Step":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.record["ms"] = (time.monotonic() - self.st) * 1000.0
+        if exc_type is not None:
+            self.record["error"] = exc_type.__name__
+        self.tracer.emit(self.record)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        st = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_phase(name, (time.monotonic() - st) * 1000.0)
+
+    def add_phase(self, name: str, ms: float) -> None:
+        phases = self.record["phases"]
+        phases[name] = phases.get(name, 0.0) + ms
+
+    def add_phases(self, durations: Dict[str, float]) -> None:
+        for name, ms in durations.items():
+            self.add_phase(name, ms)
+
+    def split_phase(self, name: str, part: str, ms: float) -> None:
+        # moves `ms` of phase `name` to phase `part`, e.g. the settle wait out
+        # of the action it was part of, so summaries can add phases up
+        self.add_phase(name, -ms)
+        self.add_phase(part, ms)
+
+    def set(self, **fields) -> None:
+        self.record.update(fields)
+
+
+class NullStep:
+    # what a disabled tracer hands out: every call is a no-op
+    enabled = False
+
+    def __enter__(self) -> "NullStep":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+    def phase(self, name: str):
+        return nullcontext()
+
+    def add_phase(self, name: str, ms: float) -> None:
+        pass
+
+    def add_phases(self, durations: Dict[str, float]) -> None:
+        pass
+
+    def split_phase(self, name: str, part: str, ms: float) -> None:
+        pass
+
+    def set(self, **fields) -> None:
+        pass
+
+
+NULL_STEP = NullStep()
+
+
+class Tracer:
+    # writes step records to `path`, rotated at `max_bytes` with `backups` old
+    # files kept (path.1 is the newest), and passes them to every exporter.
+    # without a path or exporters tracing is off and `step` returns NULL_STEP
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_bytes: int = 16 * 2**20,
+        backups: int = 5,
+        exporters: Iterable[Exporter] = (),
+    ) -> None:
+        self.path = path
+        self.exporters = list(exporters)
+        self.steps = 0
+        self.handler = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.handler = RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8"
+            )
+            self.handler.setFormatter(logging.Formatter("%(message)s"))
+
+    @property
+    def enabled(self) -> bool:
+        return self.handler is not None or bool(self.exporters)
+
+    def add_exporter(self, exporter: Exporter) -> None:
+        self.exporters.append(exporter)
+
+    def step(self, url: str):
+        if not self.enabled:
+            return NULL_STEP
+        self.steps += 1
+        return Step(self, self.steps, url)
+
+    def emit(self, record: Dict) -> None:
+        if self.handler is not None:
+            self.handler.handle(logging.makeLogRecord({"msg": json.dumps(record)}))
+        for exporter in self.exporters:
+            try:
+                exporter(record)
+            except Exception as er:
+                print(f" > trace exporter failed: {er}")
+
+    def close(self) -> None:
+        if self.handler is not None:
+            self.handler.close()
+            self.handler = None
+
+
+NO_TRACER = Tracer()
+
+
+def trace_files(path: str) -> List[str]:
+    # `path` and its rotated files, oldest first
+    rotated = []
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        rotated.append(f"{path}.{i}")
+        i += 1
+    return rotated[::-1] + ([path] if os.path.exists(path) else [])
+
+
+def read_records(paths: Iterable[str]) -> Iterator[Dict]:
+    for path in paths:
+        for name in trace_files(path):
+            with open(name, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(int(p * len(values)), len(values) - 1)]
+
+
+def summarize(records: Iterable[Dict]) -> Dict[str, Dict[str, List[float]]]:
+    # group ("all" or a domain) -> metric (phases, "step", token counts) ->
+    # values of every step
+    groups = defaultdict(lambda: defaultdict(list))
+    for record in records:
+        for group in ("all", record.get("domain", "")):
+            metrics = groups[group]
+            metrics["step"].append(record["ms"])
+            for name, ms in record["phases"].items():
+                metrics[name].append(ms)
+            for name in ("prompt_tokens", "completion_tokens"):
+                if name in record:
+                    metrics[name].append(record[name])
+    return groups
+
+
+def print_summary(groups: Dict[str, Dict[str, List[float]]], domains: int) -> None:
+    ranked = sorted(
+        (g for g in groups if g != "all"), key=lambda g: -len(groups[g]["step"])
+    )
+    for group in ["all"] + ranked[:domains]:
+        metrics = groups[group]
+        print(f"\n{group} ({len(metrics['step'])} steps)")
+        print(f"{'':>18} {'n':>6} {'p50':>10} {'p95':>10}")
+        for name, values in metrics.items():
+            print(
+                f"{name:>18} {len(values):>6} {percentile(values, 0.5):>10.1f} "
+                f"{percentile(values, 0.95):>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="p50/p95 of every step phase in agent traces"
+    )
+    parser.add_argument(
+        "paths", nargs="+", help="trace files (their rotated files are read too)"
+    )
+    parser.add_argument(
+        "--domains", type=int, default=10, help="domains with most steps to show"
+    )
+    args = parser.parse_args()
+
+    groups = summarize(read_records(args.paths))
+    if not groups:
+        raise SystemExit("no steps in the traces")
+    print(" > phases in ms, token counts in tokens")
+    print_summary(groups, args.domains)
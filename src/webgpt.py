@@ -1,58 +1,38 @@
 import os
-from typing import Dict, List
-import time
-import openai
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from collections import deque
 from datetime import datetime
 from crawler import Crawler
+from completion_cache import CompletionCache
+from state_store import StateStore
+from tracing import NO_TRACER, NULL_STEP, Tracer
+from episodes import EpisodeRecorder
+from quotes import QuoteStore, rank_quotes
+from decoding import Decoding, first_line
+from llm import HTTPBackend
 import prompt as p
+from packing import (
+    SECTION_SHARES,
+    count_tokens,
+    fit_recent,
+    pack_buffer,
+    prompt_budget,
+    truncate_tokens,
+    viewport_centre,
+)
 
-openai.api_key = os.environ["OPENAI_API_KEY"]
 # consts:
 hist_len = 5
+# follows a QUOTE in the command history when the quote was rejected as a
+# near-duplicate, so the model moves on instead of quoting it again
+ALREADY_QUOTED = " (already quoted)"
 quote_buffer_limit = 500
-
-
-def buffer2string(buffer: Dict) -> str:
-    # create string representation of buffer
-    # merge consequtive text nodes on the same tree lvl
-    out = ""
-    bk = list(buffer.keys())
-    i = 0
-
-    while i < len(bk):
-        if buffer[bk[i]]["node_type"] == "text":
-            text_node_id = bk[i]
-            local_text_buffer = buffer[bk[i]]["inner_text"]
-            j = i + 1
-
-            while True:
-                if j >= len(bk):
-                    break
-
-                if buffer[bk[j]]["node_type"] == "text":
-                    local_text_buffer += " " + buffer[bk[j]]["inner_text"]
-                    j += 1
-                    continue
-                elif buffer[bk[j]]["node_type"] == "sep":
-                    if local_text_buffer:
-                        out += f"\n<text>{local_text_buffer}</text>"
-                    out += "\n"
-                    j += 1
-                    break
-                else:
-                    if local_text_buffer:
-                        out += f"\n<text>{local_text_buffer}</text>"
-                        local_text_buffer = ""
-                    out += "\n" + buffer[bk[j]]["meta"]
-                    j += 1
-                    continue
-            i = j
-        else:
-            if buffer[bk[i]]["node_type"] != "sep":
-                out += "\n" + buffer[bk[i]]["meta"]
-            i += 1
-    return out.strip()
+# navigation steps after which an agent answers with the quotes it has
+step_limit = 30
+# prompt tokens of an instruction by default: the template takes ~1300, which
+# leaves the page about what the old 3600-character cut gave it. the whole
+# context is rarely worth paying for on every step
+instruction_budget = 2400
 
 
 def quote_buffer_to_string(quote_buffer: List[Dict[str, str]]) -> str:
@@ -69,175 +49,470 @@ def quote_buffer_to_short_string(quote_buffer: List[Dict[str, str]]) -> str:
     return out
 
 
-def get_gpt_instruction(
+def parse_command(ins: str) -> Optional[Tuple[str, ...]]:
+    # turns the first line of a model instruction into (command, *arguments)
+    ins = ins.split("\n")[0]
+
+    if ins.startswith("SCROLL UP"):
+        return ("SCROLL", "up")
+    elif ins.startswith("SCROLL DOWN"):
+        return ("SCROLL", "down")
+    elif ins.startswith("CLICK: "):
+        # CLICK 1
+        return ("CLICK", ins.split(" ")[1])
+    elif ins.startswith("TYPE ") or ins.startswith("SUBMIT "):
+        # TYPE 1 "Paris City Centre"
+        # TYPESUBMIT 1 "Paris City Centre"
+        space_separated = ins.split(" ")
+        _id = space_separated[1][:-1]
+        text = " ".join(space_separated[2:])
+        # if text[0] == '"' and text[-1] == '"':
+        #     text = text[1:-1]
+        return (space_separated[0], _id, text)
+    elif ins.startswith("SELECT "):
+        # SELECT ID "value"
+        space_separated = ins.split(" ")
+        _id = space_separated[1][:-1]
+        value = " ".join(space_separated[2:])
+        # if value[0] == '"' and value[-1] == '"':
+        #     value = value[1:-1]
+        return ("SELECT", _id, value)
+    elif ins.startswith("QUOTE: "):
+        space_separated = ins.split(" ")
+        return ("QUOTE", " ".join(space_separated[1:]))
+    elif ins == "BACK":
+        return ("BACK",)
+    elif ins.startswith("ANSWER"):
+        return ("ANSWER",)
+    return None
+
+
+# (prompt, **completion params) -> completion choices
+Complete = Callable[..., List[str]]
+# (prompt, **completion params) -> streamed text chunks
+Stream = Callable[..., Iterator[str]]
+
+
+# the backend behind create_completion and stream_completion (and their async
+# versions); unless set_backend is called it is an HTTPBackend configured from
+# OPENAI_API_KEY and OPENAI_API_BASE, made on first use
+backend = None
+
+
+def get_backend():
+    global backend
+    if backend is None:
+        backend = HTTPBackend()
+    return backend
+
+
+def set_backend(new_backend) -> None:
+    global backend
+    backend = new_backend
+
+
+def create_completion(prompt: str, **params) -> List[str]:
+    # (prompt, **completion params) -> the text of every returned choice
+    return get_backend().complete(prompt, **params)
+
+
+def stream_completion(prompt: str, **params) -> Iterator[str]:
+    # (prompt, **completion params) -> text chunks as they are generated
+    return get_backend().stream(prompt, **params)
+
+
+def validate_command(ins: str, buffer: Dict) -> bool:
+    # whether `ins` is a command that can be carried out on the parsed page
+    command = parse_command(ins.strip())
+    if command is None:
+        return False
+    action, *args = command
+    if action in ("CLICK", "TYPE", "SUBMIT", "SELECT"):
+        return str(args[0]) in buffer
+    if action == "QUOTE":
+        return bool(args[0].strip())
+    return True
+
+
+# completion parameters of each prompt
+# (n and best_of come from the decoding strategy)
+instruction_params = dict(
+    model="text-davinci-003",
+    temperature=0.75,
+    max_tokens=550,
+)
+answer_params = dict(
+    model="text-davinci-003",
+    temperature=0.7,  # higher the more creative
+    max_tokens=1000,
+)
+welcome_params = dict(
+    model="text-davinci-003",
+    temperature=0.7,
+    max_tokens=256,
+    top_p=1,
+    frequency_penalty=0,
+    presence_penalty=0,
+)
+
+instruction_decoding = Decoding("greedy")
+answer_decoding = Decoding("sample")
+
+
+# introduces the relevant passages after the page content
+PASSAGES_HEADER = "\n\nMOST RELEVANT ELSEWHERE ON THE PAGE:\n"
+
+
+def instruction_prompt(
     objective: str,
     url: str,
     command_history: deque,
     quote_buffer: List,
-    browser_content: str,
+    buffer: Dict,
+    viewport: Optional[Dict] = None,
+    budget: Optional[int] = None,
+    passages: Optional[Dict] = None,
 ) -> str:
-    previous_commands = "\n".join(command_history)
-    quotes_summary = quote_buffer_to_short_string(quote_buffer) if quote_buffer else ""
+    # fills the prompt up to `budget` tokens (by default instruction_budget,
+    # capped by what the model context leaves next to the completion). the
+    # objective, quotes, history
+    # and `passages` (the parts of the page outside the viewport that match
+    # the objective, see Crawler.relevant_passages) get at most their
+    # SECTION_SHARES of it, the page content gets the rest
+    if budget is None:
+        budget = instruction_budget
+    budget = min(budget, prompt_budget(instruction_params["max_tokens"]))
+    url = url[:120]
+    template = p.retrieval_prompt.format(
+        objective="", url=url, previous_commands="", browser_content="", quotes=""
+    )
+    available = budget - count_tokens(template)
 
-    prompt = p.retrieval_prompt.format(
+    objective = truncate_tokens(
+        objective, int(available * SECTION_SHARES["objective"])
+    )
+    quotes_summary = fit_recent(
+        [quote_buffer_to_short_string([q]) for q in quote_buffer],
+        int(available * SECTION_SHARES["quotes"]),
+        sep="",
+    )
+    previous_commands = fit_recent(
+        list(command_history), int(available * SECTION_SHARES["history"])
+    )
+    elsewhere = ""
+    if passages:
+        packed = pack_buffer(
+            passages,
+            int(available * SECTION_SHARES["passages"]) - count_tokens(PASSAGES_HEADER),
+        )
+        # no header without passages: it would only take tokens from the page
+        if packed.strip():
+            elsewhere = PASSAGES_HEADER + packed
+    available -= (
+        count_tokens(objective)
+        + count_tokens(quotes_summary)
+        + count_tokens(previous_commands)
+        + count_tokens(elsewhere)
+    )
+
+    browser_content = pack_buffer(buffer, available, viewport_centre(viewport))
+    return p.retrieval_prompt.format(
         objective=objective,
-        url=url[:120],
+        url=url,
         previous_commands=previous_commands,
-        browser_content=browser_content[:3600],
+        browser_content=browser_content + elsewhere,
         quotes=quotes_summary,
     )
-    response = openai.Completion.create(
-        model="text-davinci-003",
-        prompt=prompt,
-        temperature=0.75,
-        best_of=4,
-        n=2,
-        max_tokens=550,
-    )
-    # print(response)
-    return response.choices[0].text
-
-
-def get_gpt_answer(objective: str, quote_buffer: List[Dict[str, str]]) -> str:
-    quote_str = quote_buffer_to_string(quote_buffer)
-    prompt = p.answering_prompt.format(question=objective, quotes=quote_str)
-    response = openai.Completion.create(
-        model="text-davinci-003",
-        prompt=prompt,
-        temperature=0.7,  # higher the more creative
-        best_of=3,
-        n=2,
-        max_tokens=1000,
-    )
-    return response.choices[0].text
-
-
-def get_gpt_welcome_msg(current_time: str, user_name: str = "Eric") -> str:
-    prompt = p.welcome_prompt.format(current_time=current_time, user_name=user_name)
-    response = openai.Completion.create(
-        model="text-davinci-003",
-        prompt=prompt,
-        temperature=0.7,
-        max_tokens=256,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0,
+
+
+def answer_prompt(
+    objective: str, quote_buffer: List[Dict[str, str]], budget: Optional[int] = None
+) -> str:
+    # the most relevant quotes that fit in `budget` tokens (by default whatever
+    # the model context leaves next to the answer), most relevant first
+    if budget is None:
+        budget = prompt_budget(answer_params["max_tokens"])
+    available = budget - count_tokens(
+        p.answering_prompt.format(question=objective, quotes="")
     )
-    return response.choices[0].text
+    quotes = []
+    for quote in rank_quotes(objective, quote_buffer):
+        # +1 for the quote number growing a digit
+        cost = count_tokens(quote_buffer_to_string([quote])) + 1
+        if cost <= available:
+            quotes.append(quote)
+            available -= cost
+    quote_str = quote_buffer_to_string(quotes)
+    return p.answering_prompt.format(question=objective, quotes=quote_str)
 
 
-if __name__ == "__main__":
-    _c = Crawler(limit_to_viewport=True, viewport_height=750)
-
-    def instruct(ins: str) -> bool:
-        ins = ins.split("\n")[0]
-
-        if ins.startswith("SCROLL UP"):
-            _c.scroll("up")
-            return True
-        elif ins.startswith("SCROLL DOWN"):
-            _c.scroll("down")
-            return True
-        elif ins.startswith("CLICK: "):
-            # CLICK 1
-            _id = ins.split(" ")[1]
-            _c.click(_id)
-            return True
-        elif ins.startswith("TYPE ") or ins.startswith("SUBMIT "):
-            # TYPE 1 "Paris City Centre"
-            # TYPESUBMIT 1 "Paris City Centre"
-            space_separated = ins.split(" ")
-            _id = space_separated[1][:-1]
-            text = " ".join(space_separated[2:])
-            # if text[0] == '"' and text[-1] == '"':
-            #     text = text[1:-1]
-            _c.type(_id, text)
-            if not text:
-                print(f" > Passed empty string to TYPE command")
-                return
-            if space_separated[0] == "SUBMIT":
-                _c.enter()
-            return True
-        elif ins.startswith("SELECT "):
-            # SELECT ID "value"
-            space_separated = ins.split(" ")
-            _id = space_separated[1][:-1]
-            value = " ".join(space_separated[2:])
-            # if value[0] == '"' and value[-1] == '"':
-            #     value = value[1:-1]
-            _c.select(_id, value)
-            return True
-        elif ins.startswith("QUOTE: "):
-            space_separated = ins.split(" ")
-            quote = " ".join(space_separated[1:])
-            to_append = {
-                "page_title": _c.page.title(),
-                "domain": _c.page.url,
-                "extract": quote,
-            }
-            quote_buffer.append(to_append)
-            print(f" > memorized: {quote}")
-            return True
-        elif ins == "BACK":
-            _c.back()
-            return True
-        elif ins.startswith("ANSWER"):
-            print(" > Switching to answering mode...")
-            return True
+def welcome_prompt(current_time: str, user_name: str = "Eric") -> str:
+    return p.welcome_prompt.format(current_time=current_time, user_name=user_name)
+
+
+def get_gpt_instruction(
+    objective: str,
+    url: str,
+    command_history: deque,
+    quote_buffer: List,
+    buffer: Dict,
+    viewport: Optional[Dict] = None,
+    complete: Complete = create_completion,
+    decoding: Decoding = instruction_decoding,
+    stream: Optional[Stream] = None,
+    step=NULL_STEP,
+    passages: Optional[Dict] = None,
+    budget: Optional[int] = None,
+) -> str:
+    # `step` is the trace step (see tracing.py) to record into; `budget` is
+    # the prompt size in tokens (see instruction_prompt)
+    with step.phase("serialize"):
+        prompt = instruction_prompt(
+            objective,
+            url,
+            command_history,
+            quote_buffer,
+            buffer,
+            viewport,
+            budget=budget,
+            passages=passages,
+        )
+    # elements of the passages can be clicked too (the crawler scrolls to them)
+    known = dict(buffer, **passages) if passages else buffer
+    with step.phase("llm"):
+        if stream is not None and decoding.streamable:
+            ins = first_line(stream(prompt, **decoding.params(instruction_params)))
         else:
-            print(f" > Command: `{ins}` is not recognized")
-            return False
+            choices = complete(prompt, **decoding.params(instruction_params))
+            ins = decoding.choose(choices, lambda c: validate_command(c, known))
+    trace_tokens(step, prompt, ins)
+    return ins
 
-    objective = """Why did we decide that certain words were "bad" and shouldn't be used in social settings?"""
-    current_time_str = datetime.today().strftime("%I:%M %p")
-    print(get_gpt_welcome_msg(current_time_str))
-    i = input("\n")
-    if i:
-        objective = i
-    else:
-        print(objective, "\n")
 
-    gpt_ins = ""
-    history = deque(maxlen=hist_len)
-    quote_buffer = []
+def trace_tokens(step, prompt: str, completion: str) -> None:
+    # counted locally, so they are the same with and without streaming
+    if step.enabled:
+        step.set(
+            prompt_tokens=count_tokens(prompt),
+            completion_tokens=count_tokens(completion),
+        )
 
-    _c.go_to_page("https://www.google.com/")
 
-    try:
-        while True:
-            buffer = _c.parse()
-            browser_content = buffer2string(buffer)
+def get_gpt_answer(
+    objective: str,
+    quote_buffer: List[Dict[str, str]],
+    complete: Complete = create_completion,
+    decoding: Decoding = answer_decoding,
+) -> str:
+    prompt = answer_prompt(objective, quote_buffer)
+    return decoding.choose(complete(prompt, **decoding.params(answer_params)))
+
+
+def get_gpt_welcome_msg(
+    current_time: str, user_name: str = "Eric", complete: Complete = create_completion
+) -> str:
+    prompt = welcome_prompt(current_time, user_name)
+    return complete(prompt, **welcome_params)[0]
+
+
+def cache_from_env() -> Optional[CompletionCache]:
+    # WEBGPT_CACHE=path/to/cache.sqlite turns on the completion cache;
+    # WEBGPT_CACHE_SAMPLED=1 also caches sampled (temperature > 0) completions
+    if path := os.environ.get("WEBGPT_CACHE"):
+        return CompletionCache(
+            path, cache_sampled=os.environ.get("WEBGPT_CACHE_SAMPLED") == "1"
+        )
+    return None
+
+
+def tracer_from_env() -> Tracer:
+    # WEBGPT_TRACE=path/to/trace.jsonl writes a record per step; summarize
+    # them with `python src/tracing.py path/to/trace.jsonl`
+    return Tracer(os.environ.get("WEBGPT_TRACE"))
+
+
+def state_store_from_env() -> Optional[StateStore]:
+    # WEBGPT_STATE=path/to/state.sqlite keeps cookies and localStorage (e.g.
+    # answered consent banners) across runs
+    if path := os.environ.get("WEBGPT_STATE"):
+        return StateStore(path)
+    return None
+
+
+def budget_from_env() -> Optional[int]:
+    # WEBGPT_BUDGET=tokens sets the prompt size of every navigation step
+    if budget := os.environ.get("WEBGPT_BUDGET"):
+        return int(budget)
+    return None
+
+
+def instruct(crawler: Crawler, ins: str, quote_buffer: QuoteStore) -> bool:
+    command = parse_command(ins)
+    if command is None:
+        first_line = ins.split("\n")[0]
+        print(f" > Command: `{first_line}` is not recognized")
+        return False
+    action, *args = command
+
+    if action == "SCROLL":
+        crawler.scroll(args[0])
+    elif action == "CLICK":
+        crawler.click(args[0])
+    elif action in ("TYPE", "SUBMIT"):
+        _id, text = args
+        crawler.type(_id, text)
+        if not text:
+            print(f" > Passed empty string to TYPE command")
+            return
+        if action == "SUBMIT":
+            crawler.enter()
+    elif action == "SELECT":
+        crawler.select(*args)
+    elif action == "QUOTE":
+        quote = args[0]
+        if quote_buffer.add(crawler.page.title(), crawler.page.url, quote):
+            print(f" > memorized: {quote}")
+        else:
+            print(f" > already memorized: {quote}")
+    elif action == "BACK":
+        crawler.back()
+    elif action == "ANSWER":
+        print(" > Switching to answering mode...")
+    return True
+
+
+def is_done(
+    ok: bool, ins: str, quote_buffer_str: str, n_steps: int, max_steps: Optional[int]
+) -> bool:
+    # whether the agent should answer after its `n_steps`-th instruction
+    if ok and (ins == "ANSWER" or len(quote_buffer_str) >= quote_buffer_limit):
+        return True
+    if max_steps is not None and n_steps >= max_steps:
+        print(f" > no answer after {n_steps} steps, answering with the quotes so far")
+        return True
+    return False
+
+
+def run_agent(
+    crawler: Crawler,
+    objective: str,
+    start_url: str = "https://www.google.com/",
+    complete: Complete = create_completion,
+    decoding: Decoding = instruction_decoding,
+    stream: Optional[Stream] = None,
+    tracer: Tracer = NO_TRACER,
+    recorder: Optional[EpisodeRecorder] = None,
+    budget: Optional[int] = None,
+    max_steps: Optional[int] = step_limit,
+) -> str:
+    # browses from `start_url` until the model answers, has quoted enough or
+    # `max_steps` (None: no limit) are taken; with a `recorder` the episode is
+    # saved for offline replay (see replay.py)
+    history = deque(maxlen=hist_len)
+    quote_buffer = QuoteStore(objective)
+    if recorder is not None:
+        crawler.recorder = recorder
+        complete = recorder.wrap(complete)
+        stream = stream and recorder.wrap(stream)
+
+    crawler.go_to_page(start_url)
+
+    n_steps = 0
+    while True:
+        with tracer.step(crawler.page.url) as step:
+            buffer = crawler.parse()
+            step.add_phases(crawler.parse_timings)
+            if recorder is not None:
+                recorder.step(crawler)
+            with step.phase("search"):
+                passages = crawler.relevant_passages(objective)
 
             gpt_ins = get_gpt_instruction(
-                objective, _c.page.url, history, quote_buffer, browser_content
+                objective,
+                crawler.page.url,
+                history,
+                quote_buffer,
+                buffer,
+                crawler.viewport,
+                complete,
+                decoding,
+                stream,
+                step,
+                passages,
+                budget,
             )
             gpt_ins = gpt_ins.strip()
+            if recorder is not None:
+                recorder.completion(gpt_ins)
+            print(" > issued instruction:\n" + gpt_ins + "\n")
 
             quote_buffer_str = quote_buffer_to_string(quote_buffer)
-            # print("Objective:" + objective)
-            # print("Quotes:", quote_buffer_str)
-            # print("Past actions:", history)
+            settles = len(crawler.settle_log)
+            duplicates = quote_buffer.duplicates
+            with step.phase("action"):
+                ok = instruct(crawler, gpt_ins, quote_buffer)
+            step.split_phase(
+                "action", "settle", sum(r["ms"] for r in crawler.settle_log[settles:])
+            )
+            step.set(command=gpt_ins.split(" ", 1)[0], ok=bool(ok))
 
-            # print("URL:" + _c.page.url)
-            # print("----------------\n" + browser_content + "\n----------------\n")
+        n_steps += 1
+        if ok:
+            rejected = quote_buffer.duplicates > duplicates
+            history.append(gpt_ins + ALREADY_QUOTED if rejected else gpt_ins)
+        if is_done(ok, gpt_ins, quote_buffer_str, n_steps, max_steps):
+            answer = get_gpt_answer(objective, quote_buffer, complete)
+            if recorder is not None:
+                recorder.completion(answer, "answer")
+            return answer
 
-            print(" > issued instruction:\n" + gpt_ins + "\n")
 
-            # usr_cmd = input("Press ENTER to accept:")
-            # if not usr_cmd:
-                # usr_cmd = gpt_ins
-            usr_cmd = gpt_ins
-
-            status = instruct(usr_cmd)
-            if status:
-                history.append(usr_cmd)
-                if usr_cmd == "ANSWER" or len(quote_buffer_str) >= quote_buffer_limit:
-                    ans = get_gpt_answer(objective, quote_buffer)
-                    print(f"\nANSWER:\n{ans}\n")
-                    input()
-                else:
-                    time.sleep(4.0)
+if __name__ == "__main__":
+    _c = Crawler(
+        limit_to_viewport=True,
+        viewport_height=750,
+        headless=os.environ.get("WEBGPT_HEADLESS") == "1",
+        state_store=state_store_from_env(),
+    )
+    complete = create_completion
+    # streamed instructions are not cached, so streaming is off with the cache
+    stream = stream_completion
+    if cache := cache_from_env():
+        complete = cache.wrap(create_completion)
+        stream = None
 
+    objective = """Why did we decide that certain words were "bad" and shouldn't be used in social settings?"""
+    current_time_str = datetime.today().strftime("%I:%M %p")
+    print(get_gpt_welcome_msg(current_time_str, complete=complete))
+    i = input("\n")
+    if i:
+        objective = i
+    else:
+        print(objective, "\n")
+
+    tracer = tracer_from_env()
+    # WEBGPT_RECORD=path/to/episode.jsonl.xz saves the episode for replay.py
+    recorder = None
+    if path := os.environ.get("WEBGPT_RECORD"):
+        recorder = EpisodeRecorder(path, objective, "https://www.google.com/")
+
+    try:
+        ans = run_agent(
+            _c,
+            objective,
+            complete=complete,
+            stream=stream,
+            tracer=tracer,
+            recorder=recorder,
+            budget=budget_from_env(),
+        )
+        print(f"\nANSWER:\n{ans}\n")
+        input()
     except KeyboardInterrupt:
         print("\nBye!")
-        exit(0)
\ No newline at end of file
+    finally:
+        print(_c.blocker.report())
+        if recorder is not None:
+            recorder.close()
+        tracer.close()
+        _c.close()